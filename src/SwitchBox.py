@@ -29,12 +29,42 @@ from tkinter import *
 import tkinter.ttk as ttk 
 import tkinter
 from tkinter import messagebox
+from tkinter import simpledialog
+import tkinter.font
 from os import popen,path,getcwd,mkdir
+import sys
+import copy
+import queue
+import threading
 import logging
 from lxml import etree
 import webbrowser
 from platform import system #Finds out if is a Mac or not
 import rtmidi #MIDI IO library
+from routing import (EMPTY_ROUTING, readBindings, readSplits,
+                     readFilter,
+                     applyFilter, backendFilter, compileDispatch,
+                     genericDispatch)
+from scenes import Scene, SceneBook, SceneRow, writeRowConfig
+from workers import RoutingWorkers
+from timing import RowTiming
+from watchdog import Watchdog
+from ports import PortOpener, renameOutPort, closePort, reopenInPort
+from devices import DeviceRegistry, fingerprints
+from config import ConfigStore, sameXML, readRowConfig
+from filewatch import FileWatcher
+from control import ControlServer, ControlError, parseBatch, KEEP
+from panic import NoteTracker, PanicButton
+from voices import readVoices
+from quantize import readQuantize
+from state import (ChannelState, RowState, stateProperty, channelStatus,
+                   COL_NORMAL, COL_PAD, LED_OFF, LED_IDLE, LED_ACTIVE,
+                   LED_LISTENING, LED_ERROR)
+from netmidi import NetMidiIn, NetMidiOut, netPortName
+from standby import MirrorServer
+from paths import PATH_SWITCHBOXFILES, PATH_CURRENT_XML, makeFilesFolder
+from scheduler import Scheduler, PRIORITY_HIGH, PRIORITY_LOW
+from time import perf_counter
 
 # Because macOS uses different key codes
 isaMac = system() == 'Darwin'
@@ -46,20 +76,13 @@ GREEN = '#035211'
 YELLOW = '#FFB300'
 LIGHTGREEN = '#07D720'
 
-# Location of user's home path
-PATH_HOME = path.expanduser('~')
+# Which color each status light state is (see state.channelStatus)
+LED_COLORS = {LED_OFF: GRAY, LED_IDLE: GREEN, LED_ACTIVE: LIGHTGREEN,
+              LED_LISTENING: YELLOW, LED_ERROR: RED}
 
-# Where SwitchBox stores its temporary files
-if isaMac:
-    PATH_SWITCHBOXFILES = PATH_HOME + '/Library/Application Support/SwitchBox'
-else:
-    PATH_SWITCHBOXFILES = PATH_HOME + '/SwitchBox'
-
-if not path.isdir(PATH_SWITCHBOXFILES):
-    mkdir(PATH_SWITCHBOXFILES)
-    
-# Location of persistent settings file
-PATH_CURRENT_XML = PATH_SWITCHBOXFILES + '/current.xml'
+# Where SwitchBox stores its temporary files, and the persistent
+# settings file (see paths.py)
+makeFilesFolder()
 
 # Location of user manual
 PATH_MANUAL = 'assets/SwitchBoxManual.pdf'
@@ -73,8 +96,7 @@ VER_STRING = '{0}.{1}.{2}'.format(VER_MAJOR, VER_MINOR, VER_PATCH)
 
 # Columns per row
 NUM_COLS = 9
-# Column element type
-COL_NORMAL,COL_PAD = 0,1
+# Column element types (COL_NORMAL, COL_PAD) come from state.py
 
 # Sets UI element layout padding
 LAYOUT_PAD_X = 5
@@ -88,6 +110,99 @@ LAYOUT_PAD_Y = 5
 #     but uses less CPU.
 INTERVAL_CHECKNEW_MS = 500
 
+# Whether to compile each row's routing table into a dispatch function
+# made just for it. Turn this off to route with the plain, check-every-
+# thing dispatcher instead, e.g. when debugging the compiler.
+ROUTING_COMPILE = True
+
+# Where each row's MIDI gets routed:
+# 'inline' routes right in the MIDI library's callback thread. Simplest,
+#     and plenty for a handful of rows.
+# 'thread' hands messages to a routing thread per shard of rows, so 
+#     busy rows can't hold each other up (or get held up by the UI) as
+#     much. Best on free-threaded Python builds.
+# 'process' does the routing (and owns the output ports) in a separate 
+#     process per shard of rows, for spreading a big rig over several 
+#     cores on a regular Python build.
+ROUTING_MODE = 'inline'
+
+# How many routing threads/processes to spread the rows over. 0 gives
+# every row its own.
+ROUTING_SHARDS = 0
+
+# How many messages can pile up for a row's routing thread before new
+# ones get dropped.
+ROUTING_QUEUE_SIZE = 4096
+
+# How often the UI picks up work handed to it by the MIDI callbacks
+# (status light changes after a scene switch, etc.), in milliseconds.
+INTERVAL_UI_MS = 20
+
+# How long a channel's LED lights up for when its fader moves, in
+# milliseconds.
+INTERVAL_BLINK_MS = 60
+
+# Default hotkeys for the first few scenes in the setlist. A scene can
+# pick its own with the "key" attribute in the save file.
+SCENE_KEYS = ['F5', 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12']
+
+# Whether to measure how long each message takes to get through its row
+# (see Help > Timing). Costs a clock read per message sent.
+TIMING_STATS = True
+
+# Fixed output latency, in milliseconds, for rows that don't set their
+# own with the "latency" attribute in the save file. Messages get sent
+# this long after they were played, by the MIDI backend's timestamps, 
+# which trades a little latency for much steadier timing. None sends
+# everything as soon as it's routed. Not used in 'process' routing mode.
+OUTPUT_LATENCY_MS = None
+
+# How long the MIDI callbacks or the Tk main loop can be held up, in 
+# milliseconds, before the watchdog calls it a stall and says so in the
+# status bar and the log. None turns the watchdog off.
+WATCHDOG_BUDGET_MS = 50
+
+# How long a stall stays up in the status bar, in milliseconds
+INTERVAL_STALL_SHOWN_MS = 5000
+
+# How many rows can be opening their MIDI ports at once
+PORT_THREADS = 4
+
+# How many background jobs (device scans, saving) can run at once, and
+# how long each kind gets before it's given up on, in seconds
+SCHEDULER_WORKERS = 2
+SCAN_TIMEOUT_S = 10
+SAVE_TIMEOUT_S = 5
+
+# Whether to save changes by adding them to a journal next to the save
+# file (folded back into the save file in the background), rather than
+# writing out the whole save file every time something changes.
+CONFIG_JOURNAL = True
+
+# Whether to pick up changes made to the save file by other programs
+# while SwitchBox is running
+CONFIG_WATCH = True
+
+# Whether to let scripts drive SwitchBox through the control API (see
+# control.py and switchboxctl.py), and where it listens
+CONTROL_API = True
+CONTROL_ADDRESS = PATH_SWITCHBOXFILES + '/control.sock'
+
+# How long a control request waits for the UI to get to it, in seconds
+CONTROL_TIMEOUT_S = 5
+
+# Whether to keep a standby SwitchBox (see standby.py) up to date, and
+# where it connects
+MIRROR_API = True
+MIRROR_ADDRESS = PATH_SWITCHBOXFILES + '/mirror.sock'
+
+# Key that stops every note on every row
+PANIC_KEY = 'Escape'
+
+# CC that does the same, from any row's device, unless the save file
+# says otherwise (<swr panic="...">). None for no panic CC.
+PANIC_CC = None
+
 # Sets verbosity of debug printouts. Set to logging.INFO to print 
 # everything, set to logging.WARN if you're annoyed with log spam.
 LOG_LEVEL = logging.WARN
@@ -107,7 +222,16 @@ Each instrument gets its own virtual MIDI port for SwitchBox's output.
 This appears as a "row" in the interface, with "columns" of controls
 for each voice/patch of that instrument.
 """
-class RowElement(): 
+class RowElement():
+    # Settings the routing engine uses live in self.state (a RowState),
+    # not in here with the widgets. These read and write through to it.
+    activeChannel = stateProperty('activeChannel')
+    padchannel = stateProperty('padchannel')
+    splits = stateProperty('splits')
+    filters = stateProperty('filters')
+    voicePool = stateProperty('voicePool')
+    quantize = stateProperty('quantize')
+
     """Create a row element.
     
     container -- The Tk Frame element that contains this RowElement
@@ -116,22 +240,33 @@ class RowElement():
     XMLElement -- The part of the XML file that defines this RowElement
     upper -- points to the App instance that created this RowElement
     name -- The user-provided name of this row (string)
+    config -- The row's settings, as read by the ConfigStore (a
+              RowConfig). Read from XMLElement if not given.
     """
-    def __init__(self, container, row, num_cols, XMLElement, upper, 
-                 name=None):
+    def __init__(self, container, row, num_cols, XMLElement, upper,
+                 name=None, config=None):
+        if config is None:
+            # The pad channel's on the end
+            config = readRowConfig(XMLElement, num_cols + 1)
         self.upper = upper
         self.XMLElement = XMLElement
         self.rowName = name
+        # What the routing engine works from. Dispatch functions get
+        # this rather than the row itself.
+        self.state = RowState(self)
                 
         # Since we number rows from 0 internally
         self.rowNumber = row+1
         
+        # Set once this row is done loading its settings
+        self.isLoaded = False
+        
         # The top element of the RowElement
         self.container = ttk.Frame(container)
         # Holds instrument info and other goodies related to all columns
         self.leftside = ttk.Frame(self.container) 
-        # Container for the channel handlers
-        self.columns = ttk.Frame(self.container) 
+        # Container for the channel handlers, all drawn on one canvas
+        self.columns = RowCanvas(self.container) 
         # Buttons for adding/deleting columns
         self.plusminus = ttk.Frame(self.container) 
         
@@ -152,11 +287,40 @@ class RowElement():
         # Now hide it so it doesn't actually show up    
         self.rowLabel.grid_remove()
         
-        # Set up MIDI ports
-        self.inport = rtmidi.MidiIn() 
-        self.outport = rtmidi.MidiOut()
-        self.inport.set_callback(self.onReceived, None)
-        self.outport.open_virtual_port(self.rowName + ' (SwitchBox)')
+        self.activeChannel = 0
+        # Spreads notes over a range of channels, if this row has a
+        # voice pool (see voices.py). The dispatch functions set up
+        # the allocator.
+        self.voicePool = config.voices
+        # Holds trigger switches back to the beat or bar, going by the
+        # MIDI clock, if this row's set up to (see quantize.py)
+        self.quantize = config.quantize
+        # Where to take input from and send output to over the network
+        # instead, if anywhere (see netmidi.py)
+        self.net = config.net
+        # Precompiled dispatch functions for each scene, along with the
+        # SceneBook they were compiled for.
+        self.sceneDispatchers = (None, ())
+        
+        # Set up MIDI ports. Where the routing happens (and so which
+        # callback the input port gets) is up to the App's workers. The
+        # ports themselves get opened in the background (see 
+        # onPortsReady), so there aren't any until then.
+        self.inport = None
+        self.outport = None
+        self.timing = RowTiming(self.readLatency())
+        # Which notes are held on our output, for panic. Routing
+        # processes send to it without us seeing.
+        self.notes = NoteTracker(tracking=ROUTING_MODE != 'process')
+        self.heartbeat = self.upper.watchdog.watch('')
+        self.nameHeartbeat()
+        self.midiCallback = self.upper.workers.attach(self)
+        self.state.onRoutingThread = self.upper.workers.caller(self)
+        
+        # The routing table and dispatch function the MIDI callback 
+        # works from. Starts out empty until we're done loading.
+        self.routing = EMPTY_ROUTING
+        self.dispatch = self.makeDispatch(EMPTY_ROUTING)
             
         """Auto-saves the row name when user types in the entry box. 
        
@@ -175,54 +339,77 @@ class RowElement():
                                      else 'Row ' + str(self.rowNumber))
             
             # Now change the name in XML
-            self.XMLElement.attrib['name'] = P
+            self.upper.store.set(self.XMLElement, 'name', P)
+            self.nameHeartbeat()
             self.upper.saveFile()
             logging.info('Saved Row Name')
             
-            # Shut down the current port. This might confuse some 
-            # synth programs if used while port is connected.
+            # Still opening the first port; it'll get the name it was
+            # given when it started opening. (The entry box is locked 
+            # until then, so this is just our own insert below.)
+            if self.outport is None:
+                return True
+            
+            # Rename the port where it is if we can. If not, open a port
+            # with the new name first, then swap it in, so the MIDI 
+            # callback always has a port to send to.
+            oldport = self.outport
             try:
-                if self.outport.is_port_open():
-                    self.outport.close_port()
-                del(self.outport)
-                logging.info('Closing port, about to re-open new port name')
+                if P != None and P.strip() != '':
+                    newport = renameOutPort(oldport, self.makeOutPort,
+                                            P + ' (SwitchBox)')
+                else:
+                    newport = renameOutPort(oldport, self.makeOutPort,
+                                            'Row ' + str(self.rowNumber) +
+                                            ' (SwitchBox)')
+                if newport is oldport:
+                    logging.info('Renamed port')
+                    return True
+                self.outport = newport
+                # The old port's send is baked into our dispatch 
+                # functions, so they need to be built again.
+                if self.isLoaded:
+                    self.publishRouting()
+                    self.precompileScenes(self.upper.scenes)
             except:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 exc_type = exc_type.__name__
                 logging.warning(str(exc_tb.tb_lineno) + ':' + 
                              str(exc_type) + ': ' + str(exc_obj) + 
-                             ": Coulnd't close virtual port")
+                             ": Coulnd't re-open virtual port")
+                return True
                 
-            # Attempt to re-open the port with the new name
+            # Shut down the old port. This might confuse some 
+            # synth programs if used while port is connected.
             try:
-                self.outport = rtmidi.MidiOut()
-                if P != None and P.strip() != '':
-                    self.outport.open_virtual_port(P + ' (SwitchBox)')
-                else: 
-                    self.outport.open_virtual_port('Row ' + 
-                                                   self.rowNumber + 
-                                                   ' (SwitchBox)')
+                closePort(oldport)
+                del(oldport)
+                logging.info('Closed old port after re-opening new port name')
             except:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 exc_type = exc_type.__name__
                 logging.warning(str(exc_tb.tb_lineno) + ':' + 
                              str(exc_type) + ': ' + str(exc_obj) + 
-                             ": Coulnd't re-open virtual port")
+                             ": Coulnd't close virtual port")
             
             # We're not really doing any validation, just trying to 
             # capture key input to auto-save names, so anything goes.
             return True 
         
-        # Function pointer of the above function for TKinter's 
+        self.saveRowName = saveRowName
+
+        # Function pointer of the above function for TKinter's
         # validation command
         updateRowName = (container.register(saveRowName), '%P') 
         self.rowNameEntry = ttk.Entry(self.leftside, width=10, 
                                       validate='key', 
                                       validatecommand=updateRowName)
         
-        # Pre-fill the text box with its name
+        # Pre-fill the text box with its name. Renaming has to wait
+        # until the port we'd be renaming is open.
         self.rowNameEntry.insert(0, self.rowName) 
         self.rowNameEntry.grid(column=0, row=0, sticky=W)
+        self.rowNameEntry.state(['disabled'])
         
         # MIDI input port selector
         self.indevice_choice = StringVar()
@@ -250,6 +437,8 @@ class RowElement():
         
         # List to hold the input devices we detect
         self.inports = []
+        # Name of the device our input port is open on, if it is
+        self.connectedName = None
         
         # Create column elements for this row
         for num in range(num_cols):
@@ -263,10 +452,12 @@ class RowElement():
                                        self.validateNumbers, 
                                        type=COL_PAD))
         
-        # Sets column counter so that we can keep track of which columns 
+        # Sets column counter so that we can keep track of which columns
         # correspond to which channel.
         self.num_cols = len(self.cols)
-        
+        self.state.channels = [columns.state for columns in self.cols]
+        self.columns.layout()
+
         self.leftside.grid(column=0, row=0, sticky=(N,S))
         self.columns.grid(column=2, row=0)
         
@@ -286,43 +477,118 @@ class RowElement():
         self.whichListen = None # Which column is listening?
         self.disableAll() # Initialize row by disabling all channels.
 
-        # Read from this row's XML element and update to match
-        for cols in XMLElement:
-            attr = cols.attrib
-            chan = attr.get('chan')
-            trig = attr.get('t')
-            fade = attr.get('f')
-            pad = attr.get('pad')
-            # The +1 is for the pad channel at the end
-            if (chan is not None and chan.isdigit() and 
-                int(chan) - 1 in range(self.num_cols)):
-                thisChannel = self.cols[int(chan) - 1]
-                if fade is not None and fade.isdigit():
-                    thisChannel.fader = int(fade)
-                if (trig is not None and trig.isdigit() and 
-                    thisChannel.type != COL_PAD):
-                    thisChannel.trigger = int(trig)
-                if (thisChannel.type == COL_PAD and
-                    pad is not None and pad.isdigit()):
-                    self.padchannel = int(pad)
-                    thisChannel.padchannel = int(pad)
-                    thisChannel.gui_padchannel.insert(0, pad)
+        # Update to match the save file. Bindings that aren't there
+        # (or the pad's trigger, which it doesn't have) stay unset.
+        for channel, trigger, fader in config.bindings:
+            thisChannel = self.cols[channel]
+            if fader is not None:
+                thisChannel.fader = fader
+            if trigger is not None:
+                thisChannel.trigger = trigger
+        if config.padchannel is not None:
+            self.padchannel = config.padchannel
+            self.cols[-1].padchannel = config.padchannel
+            self.cols[-1].gui_padchannel.insert(0, str(config.padchannel))
+
+        # Keyboard splits. These don't have any widgets (yet), so they
+        # can only be set up in the save file or by a scene.
+        self.splits = list(config.splits)
+
+        # What to do with clock, Active Sensing, SysEx, aftertouch and
+        # Program Change. Whatever the backend can throw away for us, it
+        # does once the input port's open (below), so that traffic never
+        # even makes it to Python.
+        self.filters = config.filters
             
-        savedDevice = XMLElement.attrib.get('dev')
-        self.updateInDevices()
-        self.indevice_choice.set(savedDevice)
-        if savedDevice in self.inports:
-            logging.info('Found saved device. Attempting to connect...')
-            if self.openPort(self.gui_indevice.current()):
-                self.enableAll()
-            else:
-                logging.warning("Couldn't load port from savefile!")
-        else:
-            logging.info("Can't find saved device!")
+        self.indevice_choice.set(XMLElement.attrib.get('dev', ''))
             
         self.deactivateAll()
         self.cols[0].isActive = True
         self.activeChannel = 0
+        self.publishRouting()
+        self.precompileScenes(self.upper.scenes)
+        self.isLoaded = True
+        
+        # Open our ports (and reconnect to the saved device) in the 
+        # background. Until then, the row's yellow.
+        self.gui_led['bg'] = YELLOW
+        self.errmsg = 'Opening MIDI ports...'
+        if self.hasNetInput():
+            self.gui_indevice.state(['disabled'])
+            self.upper.portOpener.open(
+                self.makeOutPort, self.rowName + ' (SwitchBox)',
+                netPortName(self.net.inAddress), None,
+                backendFilter(self.filters, self.quantize),
+                lambda ports: self.upper.postToUI(self.onPortsReady, ports),
+                makeInPort=lambda: NetMidiIn(self.net.inAddress))
+        else:
+            self.upper.portOpener.open(
+                self.makeOutPort, self.rowName + ' (SwitchBox)',
+                XMLElement.attrib.get('dev'), self.savedOrdinal(),
+                backendFilter(self.filters, self.quantize),
+                lambda ports: self.upper.postToUI(self.onPortsReady, ports))
+
+    """Whether this row's input comes over the network rather than from
+    a device.
+    """
+    def hasNetInput(self):
+        return self.net is not None and self.net.inAddress is not None
+
+    """Make an output port for this row: a virtual port, or if the row's
+    output goes over the network, one that sends it there.
+    """
+    def makeOutPort(self):
+        if self.net is not None and self.net.outAddress is not None:
+            if ROUTING_MODE != 'process':
+                return NetMidiOut(self.net.outAddress, self.net.latency)
+            # The routing process sends straight to its own port
+            logging.warning(self.rowName + ": Can't send over the network "
+                            'with process routing; using a virtual port')
+        return self.upper.workers.outPort(self)
+
+    """Put our freshly opened ports into service. Runs on the UI side 
+    once the App's PortOpener is done with them.
+    
+    Arguments:
+    ports -- A RowPorts
+    """
+    def onPortsReady(self, ports):
+        # Deleted while its ports were still opening
+        if self not in self.upper.rowlist:
+            for port in (ports.outport, ports.inport):
+                if port is not None and port.is_port_open():
+                    port.close_port()
+            return
+        
+        self.inport = ports.inport
+        self.outport = ports.outport
+        self.rowNameEntry.state(['!disabled'])
+        if self.inport is None or self.outport is None:
+            self.gui_led['bg'] = RED
+            self.errmsg = "Couldn't open MIDI ports"
+            self.upper.updateErrorMessage()
+            return
+        
+        # The dispatch functions so far were made without an output 
+        # port to send to.
+        self.publishRouting()
+        self.precompileScenes(self.upper.scenes)
+        self.inport.set_callback(self.midiCallback, None)
+        
+        self.inports = list(ports.devices)
+        self.gui_indevice['values'] = self.inports
+        # A network input's only device is itself
+        if not self.upper.devices.ports and not self.hasNetInput():
+            self.upper.devices.apply(ports.devices)
+        if ports.device is not None:
+            self.connectedName = self.inports[ports.device]
+            self.indevice_choice.set(self.connectedName)
+            logging.info('Reconnected ' + self.rowName + ' to ' + 
+                         self.inports[ports.device])
+            self.gui_indevice.current(ports.device)
+            self.enableAll()
+        else:
+            logging.info("Can't find saved device!")
         self.updateAll() # Refresh status lights
           
     """Button handler that ColumnElements will call
@@ -384,31 +650,35 @@ class RowElement():
                 # If the column does not exist (i.e. XML element is empty)
                 if XMLColumnElement is None:
                     # First create a new XML element for this column
-                    XMLColumnElement = etree.SubElement(self.XMLElement, 
+                    XMLColumnElement = etree.SubElement(self.XMLElement,
                                                         'ch')
+                    self.upper.store.added(XMLColumnElement)
                     
                 # If the column still has its fader after deletion, we
                 # know it didn't just delete the fader. So we keep that.
                 # Otherwise, delete it from the save file.
                 if whichOne.fader is not None:
-                    XMLColumnElement.attrib['f'] = str(whichOne.fader)
+                    self.upper.store.set(XMLColumnElement, 'f',
+                                         str(whichOne.fader))
                     logging.info('Keeping fader')
                 else:
-                    XMLColumnElement.attrib.pop('f', None)
+                    self.upper.store.set(XMLColumnElement, 'f', None)
                     logging.info('Deleting fader')
                 
                 # Same here. We deduce that since the trigger is still
                 # there after deletion, it mustn't have been the trigger
                 # that requested to be deleted.
                 if whichOne.trigger is not None:
-                    XMLColumnElement.attrib['t'] = str(whichOne.fader)
+                    self.upper.store.set(XMLColumnElement, 't',
+                                         str(whichOne.trigger))
                     logging.info('Keeping trigger')
                 else:
-                    XMLColumnElement.attrib.pop('t', None)
+                    self.upper.store.set(XMLColumnElement, 't', None)
                     logging.info('Deleting trigger')
                 logging.info('Saving file...')
                 self.upper.saveFile()
             self.enableAll() # Resume our usual SwitchBox behavior.
+        self.publishRouting()
         self.updateAll() # Refresh status lights one more time
     
     """Add a column to the row. Pretty self-explanatory.
@@ -420,13 +690,14 @@ class RowElement():
                                        self.onButtonPress,
                                        self.validateNumbers,
                                        type=COL_NORMAL))
+        self.columns.layout()
     
     """ Remove a column from the row. Also pretty self-explanatory.
     Also unused as of now.
     """
     def delColumn(self):
         if self.num_cols > 1:
-            self.cols[-1].container.grid_forget()
+            self.columns.removeColumn(self.cols[-1])
             del(self.cols[-1])
             self.num_cols -=1
     
@@ -446,14 +717,16 @@ class RowElement():
             for cols in self.XMLElement:
                 if cols.get('chan') == str(whichChannel.channel):
                     columnFound = cols
+            store = self.upper.store
             if columnFound is None:
                 columnFound = etree.SubElement(self.XMLElement, 'ch')
                 columnFound.attrib['chan'] = str(whichChannel.channel)
+                store.added(columnFound)
             if whichChannel.type == COL_NORMAL:
-                columnFound.attrib['t'] = str(whichChannel.trigger)
+                store.set(columnFound, 't', str(whichChannel.trigger))
             else:
-                columnFound.attrib['pad'] = str(self.padchannel)
-            columnFound.attrib['f'] = str(whichChannel.fader)
+                store.set(columnFound, 'pad', str(self.padchannel))
+            store.set(columnFound, 'f', str(whichChannel.fader))
             self.upper.saveFile()
         except:
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -461,6 +734,442 @@ class RowElement():
             logging.warning(str(exc_tb.tb_lineno) + ':' + str(exc_type) + 
                          ': ' + str(exc_obj) + ": Coulnd't save channel")
     
+    """Build a new routing table from this row's settings and put it 
+    into service.
+    
+    Call this whenever a binding, the pad channel or the splits change.
+    The MIDI callback picks up the new table on the very next message.
+    """
+    def publishRouting(self):
+        if self.isListening and self.whichListen is not None:
+            listenChannel = self.whichListen.channel - 1
+        else:
+            listenChannel = None
+        # Build the whole table first, then swap it in with a single
+        # assignment, so the MIDI callback never sees half of a change.
+        routing = self.state.routing(listenChannel=listenChannel,
+                                     listenFor=self.listeningFor,
+                                     panic=self.upper.panicCC)
+        self.routing = routing
+        self.dispatch = self.makeDispatch(routing)
+        if self.outport is not None:
+            self.upper.workers.publish(self, routing, self.upper.scenes)
+    
+    """Make a dispatch function for a routing table.
+    
+    Arguments:
+    routing -- The RowRouting to route with
+    scenes -- The SceneBook to watch for scene changes. Defaults to the
+        App's current one.
+    """
+    def makeDispatch(self, routing, scenes=None):
+        if scenes is None:
+            scenes = self.upper.scenes
+        if self.outport is None:
+            send = lambda message: None
+        else:
+            send = self.notes.wrap(self.outport.send_message)
+        if TIMING_STATS or self.timing.fixedLatency is not None:
+            send = self.timing.wrap(send)
+        if ROUTING_COMPILE:
+            return compileDispatch(routing, self.state, send, scenes)
+        return genericDispatch(routing, self.state, send, scenes)
+    
+    """Read this row's fixed output latency from the save file.
+    
+    Returns the latency in seconds, or None to send right away.
+    """
+    def readLatency(self):
+        latency = self.XMLElement.get('latency')
+        if latency is None:
+            latency = OUTPUT_LATENCY_MS
+        try:
+            latency = float(latency) if latency is not None else None
+        except ValueError:
+            logging.warning('Bad latency for row ' + str(self.rowNumber) + 
+                            ': ' + latency)
+            latency = OUTPUT_LATENCY_MS
+        if latency is None or latency < 0 or ROUTING_MODE == 'process':
+            return None
+        return latency / 1000
+    
+    """Compile dispatch functions for this row's part of every scene.
+    
+    Done ahead of time so that switching scenes doesn't have to compile
+    anything. Needs to be done again if the scenes or the output port 
+    change.
+    
+    Arguments:
+    scenes -- The SceneBook to compile for
+    """
+    def precompileScenes(self, scenes):
+        whichRow = self.rowNumber - 1
+        dispatchers = []
+        for scene in scenes:
+            if whichRow < len(scene.table) and scene.table[whichRow] is not None:
+                # Scenes don't have filters, a panic CC, voice pools or
+                # quantizing, so keep using this row's.
+                routing = scene.table[whichRow]._replace(
+                    filters=self.filters, panic=self.upper.panicCC,
+                    voices=self.voicePool, quantize=self.quantize)
+                dispatchers.append((routing, 
+                                    self.makeDispatch(routing, scenes)))
+            else:
+                dispatchers.append(None)
+        self.sceneDispatchers = (scenes, tuple(dispatchers))
+    
+    """Finish learning a binding.
+    
+    The MIDI callback hands us the CC it caught while listening, along 
+    with the routing table it was using at the time. If the user has 
+    cancelled or moved on to another channel since then, the CC is 
+    thrown away.
+    
+    Arguments:
+    routing -- The RowRouting the MIDI callback was listening with
+    cc -- The CC number that was received
+    """
+    def onLearned(self, routing, cc):
+        if (not self.isListening or self.whichListen is None or 
+            self.whichListen.channel - 1 != routing.listenChannel or 
+            self.listeningFor != routing.listenFor):
+            logging.info('Stale binding, ignoring')
+            return
+        if self.listeningFor == 'T':
+            self.whichListen.trigger = cc
+        elif self.listeningFor == 'F':
+            self.whichListen.fader = cc
+        
+        # Reset button states
+        self.enableAll()
+        self.whichListen.listening = False
+        self.saveChannel(self.whichListen)
+        # Let everything else know we've stopped listening.
+        self.whichListen = None
+        self.listeningFor = None 
+        self.isListening = False
+        self.publishRouting()
+        self.updateAll()
+        
+    """Make the status lights match the channel the MIDI callback 
+    switched to.
+    """
+    def showActiveChannel(self):
+        self.deactivateAll()
+        self.cols[self.activeChannel].isActive = True
+        self.updateAll()
+    
+    """Set the pad channel and fill in its box, without setting off the
+    box's validation (which would save the channel all over again).
+    """
+    def showPadChannel(self, padchannel):
+        padColumn = self.cols[-1]
+        self.padchannel = padchannel
+        padColumn.padchannel = padchannel
+        padColumn.gui_padchannel['validate'] = 'none'
+        padColumn.gui_padchannel.delete(0, END)
+        if padchannel is not None:
+            padColumn.gui_padchannel.insert(0, str(padchannel))
+        padColumn.gui_padchannel['validate'] = 'key'
+
+    """Find this row's element for a channel in the save file, making
+    one if there isn't one yet.
+
+    Arguments:
+    channel -- The channel's number, from 1
+    """
+    def channelElement(self, channel):
+        for element in self.XMLElement:
+            if element.tag == 'ch' and element.get('chan') == str(channel):
+                return element
+        element = etree.SubElement(self.XMLElement, 'ch')
+        element.attrib['chan'] = str(channel)
+        self.upper.store.added(element)
+        return element
+
+    """Bind CCs to a channel without going through Learn.
+
+    The new binding isn't put into service or saved yet, so a whole
+    batch of them can be: call publishRouting() and the App's
+    saveFile() once they're all set.
+
+    Arguments:
+    channel -- Which column, from zero (the last one's the pad channel)
+    trigger -- The trigger CC, None for no trigger, or KEEP to leave it
+    fader -- Likewise for the fader CC
+    """
+    def setBinding(self, channel, trigger=KEEP, fader=KEEP):
+        column = self.cols[channel]
+        element = self.channelElement(column.channel)
+        store = self.upper.store
+        if trigger is not KEEP and column.type == COL_NORMAL:
+            column.trigger = trigger
+            store.set(element, 't',
+                      str(trigger) if trigger is not None else None)
+        if fader is not KEEP:
+            column.fader = fader
+            store.set(element, 'f', str(fader) if fader is not None else None)
+
+    """Set the pad channel without going through its box. Like
+    setBinding(), doesn't put it into service or save.
+
+    Arguments:
+    padchannel -- The new pad channel, or None for none
+    """
+    def setPadChannel(self, padchannel):
+        self.showPadChannel(padchannel)
+        self.upper.store.set(self.channelElement(self.cols[-1].channel),
+                             'pad',
+                             str(padchannel) if padchannel is not None
+                             else None)
+
+    """Switch the active channel, as if its trigger had come in.
+
+    Arguments:
+    channel -- The channel to switch to, from zero
+    """
+    def activateChannel(self, channel):
+        self.cancelSwitch()
+        previous = self.activeChannel
+        if channel == previous:
+            return
+        self.activeChannel = channel
+        outport = self.outport
+        if outport is not None:
+            # Routing in another process keeps its own active channel
+            self.upper.workers.publish(
+                self, self.routing._replace(channel=channel),
+                self.upper.scenes)
+            # Same stuck note precaution as when a trigger does it
+            outport.send_message([(0b1011 << 4) + previous, 123, 0])
+        self.showActiveChannel()
+
+    """Forget any trigger switch that's waiting for the beat, since the
+    channel's being changed some other way.
+    """
+    def cancelSwitch(self):
+        clock = self.state.clock
+        if clock is not None:
+            clock.cancel()
+
+    """This row's settings and status, for the control API.
+    """
+    def describe(self):
+        return {'row': self.rowNumber,
+                'name': self.XMLElement.get('name', ''),
+                'device': self.XMLElement.get('dev'),
+                'connected': self.connectedName is not None,
+                'channel': self.activeChannel + 1,
+                'pad': self.padchannel,
+                'bindings': [{'channel': columns.channel,
+                              'trigger': columns.trigger,
+                              'fader': columns.fader}
+                             for columns in self.cols],
+                'quantize': (self.state.clock.stats()
+                             if self.state.clock is not None else None),
+                'error': self.errmsg}
+
+    """This row's routing state, for a standby (see standby.py). Called
+    from the mirror's thread, so it only reads.
+    """
+    def snapshot(self):
+        state = self.state
+        return {'name': self.rowName,
+                'dev': self.XMLElement.get('dev'),
+                'ord': self.savedOrdinal(),
+                'bindings': state.bindings(),
+                'pad': state.padchannel,
+                'splits': list(state.splits),
+                'filters': list(state.filters),
+                'voices': state.voicePool,
+                'active': state.activeChannel,
+                'held': sorted(list(self.notes.held))}
+
+    """Capture this row's current settings so they can go in a scene.
+    """
+    def sceneRow(self):
+        return SceneRow(self.state.bindings(),
+                        self.padchannel, tuple(self.splits),
+                        self.activeChannel)
+    
+    """Put a precompiled routing table from a scene into service.
+    
+    This is the part of a scene change that has to be quick, so there's
+    no widget or XML work in here. It writes the row's active channel
+    and sends on its output, so it belongs on the row's routing thread
+    (see App.activateScene).
+    
+    Arguments:
+    routing -- A RowRouting from a Scene's table
+    index -- The scene's position in the setlist
+    scenes -- The SceneBook the scene came from
+    """
+    def switchRouting(self, routing, index, scenes):
+        compiled, dispatchers = self.sceneDispatchers
+        if compiled is scenes and dispatchers[index] is not None:
+            routing, dispatch = dispatchers[index]
+        else:
+            # Shouldn't happen, but better late than never.
+            logging.warning('Scene was not precompiled for row ' + 
+                            str(self.rowNumber))
+            routing = routing._replace(filters=self.filters,
+                                       panic=self.upper.panicCC,
+                                       voices=self.voicePool,
+                                       quantize=self.quantize)
+            dispatch = self.makeDispatch(routing, scenes)
+        previous = self.activeChannel
+        outport = self.outport
+        self.routing = routing
+        self.dispatch = dispatch
+        if outport is not None:
+            self.upper.workers.publish(self, routing, scenes)
+        if routing.channel is not None:
+            self.cancelSwitch()
+        if routing.channel is not None and routing.channel != previous:
+            self.activeChannel = routing.channel
+            # Same stuck note precaution as when a trigger switches 
+            # channels: All Notes Off on the channel we're leaving.
+            if outport is not None:
+                outport.send_message([(0b1011 << 4) + previous, 123, 0])
+    
+    """Bring widgets and the save file in line with a scene.
+    
+    Called on the UI side once the scene's routing table is already in
+    service, so the save file isn't written here; the App does that once
+    for all rows.
+    
+    Arguments:
+    sceneRow -- The SceneRow that was just switched in
+    """
+    def applySceneRow(self, sceneRow):
+        bindings = {}
+        for channel, trigger, fader in sceneRow.bindings:
+            bindings[channel] = (trigger, fader)
+        for columns in self.cols:
+            trigger, fader = bindings.get(columns.channel - 1, (None, None))
+            columns.trigger = trigger if columns.type == COL_NORMAL else None
+            columns.fader = fader
+            
+        self.showPadChannel(sceneRow.padchannel)
+        
+        self.splits = list(sceneRow.splits)
+        
+        # The scene's table doesn't listen for anything, so if we were 
+        # in the middle of learning a binding, that's cancelled.
+        self.whichListen = None
+        self.listeningFor = None
+        self.resetListenFlags()
+        
+        self.deactivateAll()
+        self.cols[self.activeChannel].isActive = True
+        
+        # Swap out this row's channels and splits in the XML
+        for element in list(self.XMLElement):
+            if element.tag in ('ch', 'split'):
+                self.XMLElement.remove(element)
+        writeRowConfig(self.XMLElement, sceneRow.bindings,
+                       sceneRow.padchannel, sceneRow.splits,
+                       self.num_cols)
+        self.upper.store.rewrote(self.XMLElement)
+        self.updateAll()
+    
+    """Catch up with a new version of this row's element, from a save
+    file that was changed by something else. Only what's different gets
+    touched: an unchanged device stays connected, an unchanged name
+    keeps its port, and so on.
+
+    Arguments:
+    element -- The row's element from the new save file
+    """
+    def reloadFrom(self, element):
+        store = self.upper.store
+        old = self.XMLElement
+        routingChanged = False
+        filtersChanged = False
+
+        def children(parent, tags):
+            return [(child.tag, dict(child.attrib)) for child in parent
+                    if child.tag in tags]
+
+        # Bindings, pad channel and splits
+        if children(old, ('ch', 'split')) != children(element,
+                                                     ('ch', 'split')):
+            bindings, padchannel = readBindings(element, self.num_cols)
+            self.applySceneRow(SceneRow(
+                tuple(bindings), padchannel,
+                tuple(readSplits(element, self.num_cols)), None))
+            routingChanged = True
+
+        if children(old, ('filter',)) != children(element, ('filter',)):
+            for child in old.findall('filter'):
+                store.remove(child)
+            for child in element.findall('filter'):
+                child = copy.deepcopy(child)
+                old.append(child)
+                store.added(child)
+            self.filters = readFilter(old)
+            if self.inport is not None:
+                applyFilter(self.inport,
+                            backendFilter(self.filters, self.quantize))
+            filtersChanged = True
+
+        if children(old, ('voices',)) != children(element, ('voices',)):
+            for child in old.findall('voices'):
+                store.remove(child)
+            for child in element.findall('voices'):
+                child = copy.deepcopy(child)
+                old.append(child)
+                store.added(child)
+            self.voicePool = readVoices(old)
+            filtersChanged = True
+
+        if children(old, ('quantize',)) != children(element, ('quantize',)):
+            for child in old.findall('quantize'):
+                store.remove(child)
+            for child in element.findall('quantize'):
+                child = copy.deepcopy(child)
+                old.append(child)
+                store.added(child)
+            self.quantize = readQuantize(old)
+            # Whether the backend should let the clock through might
+            # have changed with it
+            if self.inport is not None:
+                applyFilter(self.inport,
+                            backendFilter(self.filters, self.quantize))
+            filtersChanged = True
+
+        if old.get('latency') != element.get('latency'):
+            store.set(old, 'latency', element.get('latency'))
+            self.timing.fixedLatency = self.readLatency()
+            filtersChanged = True
+
+        # Going through the entry box renames the port too
+        name = element.get('name', '')
+        if old.get('name', '') != name:
+            self.rowNameEntry.state(['!disabled'])
+            self.rowNameEntry['validate'] = 'none'
+            self.rowNameEntry.delete(0, END)
+            self.rowNameEntry.insert(0, name)
+            self.rowNameEntry['validate'] = 'key'
+            if self.outport is None:
+                self.rowNameEntry.state(['disabled'])
+            self.saveRowName(name)
+
+        if (old.get('dev') != element.get('dev') or
+                old.get('ord') != element.get('ord')):
+            store.set(old, 'dev', element.get('dev'))
+            store.set(old, 'ord', element.get('ord'))
+            self.indevice_choice.set(element.get('dev', ''))
+            if self.inport is not None:
+                self.connectedName = None
+                self.followDevices()
+
+        if routingChanged or filtersChanged:
+            self.publishRouting()
+        if filtersChanged:
+            self.precompileScenes(self.upper.scenes)
+        self.updateAll()
+
     """MIDI message callback
     
     This is the function that gives SwitchBox its behavior. It handles
@@ -468,6 +1177,10 @@ class RowElement():
     decides which ones to re-route to a different channel, and which ones
     to let pass through.
     
+    The decisions themselves are made by the row's dispatch function, 
+    which is compiled from the current routing table (see routing.py)
+    every time the row's settings change.
+    
     MIDI messages are encoded as a sequence of 1+ bytes. The
         first byte always consists of [message type][channel], where
         both fields are four-bit words (nibbles).
@@ -500,153 +1213,122 @@ class RowElement():
     elapsed since the message was received.
     """
     def onReceived(self, *args): 
-        logging.info('Callback called, received: ' + str(args))
-        signalIn = args[0][0]
+        event = args[0]
+        self.route(event[0], event[1], perf_counter())
+    
+    """Route one incoming MIDI message.
+    
+    Arguments:
+    message -- The MIDI message, as a list of ints
+    delta -- Seconds since the previous message, per the MIDI backend
+    arrival -- perf_counter() when the backend handed it to us
+    """
+    def route(self, message, delta, arrival):
+        self.heartbeat.enter(arrival)
+        self.timing.arrived(delta, arrival)
+        # The dispatch function is swapped out whenever the routing 
+        # changes, so grab it exactly once. This message gets routed 
+        # entirely by whatever was current when it arrived.
+        try:
+            self.dispatch(message)
+        finally:
+            self.heartbeat.leave()
+    
+    """Give this row's heartbeat a name that matches the row's.
+    """
+    def nameHeartbeat(self):
+        name = self.XMLElement.get('name', '')
+        self.heartbeat.name = 'MIDI for ' + (
+            name if name.strip() != '' else 'Row ' + str(self.rowNumber))
+    
+    """Called by the dispatch function when a CC arrives while we're
+    listening for a binding. The UI does the actual binding, since that
+    means changing widgets and saving the file.
+    """
+    def onLearnReceived(self, routing, cc):
+        self.upper.postToUI(self.onLearned, routing, cc)
+    
+    """Called by the dispatch function after a trigger has switched
+    activeChannel. Status lights get updated over on the UI side.
+    """
+    def onTriggered(self):
+        self.upper.postToUI(self.showActiveChannel)
+    
+    """Called by the dispatch function when a fader message gets sent to
+    a channel. Makes the LED on the channel blink so you can see the 
+    fader doing something.
+    """
+    def onFaderMoved(self, channel):
+        self.upper.postToUI(self.cols[channel].blink)
+    
+    """Called by the dispatch function when a Program Change or the 
+    scene CC asks for a scene. These apply to the whole rig, so the App
+    takes it from here.
+    """
+    def onSceneRequested(self, index, scenes):
+        self.upper.activateScene(index, scenes)
 
-        # Get channel in the second nibble of the first byte.
-        channel = signalIn[0] - ((signalIn[0] >> 4) << 4) 
-        
-        # Separates out the parts we're keeping the same, namely
-        # everything except the channel number. First element of the 
-        # array is the message type, everything that follows is the 
-        # un-altered remainder of the MIDI message after the first byte.
-        data = [signalIn[0] >> 4] + signalIn[1:] 
+    """Called by the dispatch function when the panic CC comes in.
+    """
+    def onPanicRequested(self):
+        self.upper.panic()
         
-        logging.info('First Nibble: ' + str(data[0]))
-        logging.info('Channel: ' + str(channel))
-            
-        # Catches all signals if listening for a binding
-        if self.isListening: 
-            #Catches CC signal to use as fader or trigger.
-            if data[0] == 0b1011: 
-                # Reset button states
-                if self.listeningFor == 'T':
-                    self.whichListen.trigger = data[1]
-                elif self.listeningFor == 'F':
-                    self.whichListen.fader = data[1]
-                    
-                self.enableAll()
-                self.whichListen.listening = False
-                self.saveChannel(self.whichListen)
-                # Let everything else know we've stopped listening.
-                self.whichListen = None
-                self.listeningFor = None 
-                self.isListening = False
-                self.updateAll()
-                
-        # Ignores all events on pad channel
-        elif (channel + 1) == self.cols[-1].padchannel:
-            logging.info('Pad channel, Skipping')
-            
-        # Actual re-routing happens down here.
-        else:
-            # If it's a CC message
-            if data[0] == 0b1011:
-                foundTrigger = None
-                foundFader = None
-                
-                # Check if CC is bound to anything as a trigger or fader
-                for channels in self.cols:
-                    if channels.trigger == data[1]:
-                        logging.info('Trigger Match!')
-                        foundTrigger = channels.channel - 1
-                    if channels.fader == data[1]:
-                        logging.info('Fader Match!')
-                        foundFader = channels.channel - 1
-                
-                # If it is bound as a trigger, activate that channel.
-                if foundTrigger is not None:
-                    self.deactivateAll()
-                    # Sends an "All Notes Off" signal to clear out any 
-                    # stuck notes. Since it's possible that this change
-                    # can occur when notes are held down, the key-up
-                    # events for those notes may be re-routed to another
-                    # channel, resulting in those notes continuously
-                    # playing. Thankfully this was discovered during a
-                    # rehearsal.
-                    self.outport.send_message([(data[0] << 4) + 
-                                               self.activeChannel, 123,0]) 
-                    self.cols[foundTrigger].isActive = True
-                    self.updateAll()
-                    logging.info('CC Triggered')
-                    self.activeChannel = foundTrigger
-                
-                # Respond to fader binding for any channel. Will send 
-                # that fader to its bound channel, regardless of which
-                # channel is currently active.
-                elif foundFader is not None: 
-                    # Attempt to make the LED on the channel blink when 
-                    # we receive a fader by quickly toggling the active
-                    # state of this channel while we're handling the
-                    # fader event.
-                    previousState = self.cols[foundFader].isActive 
-                    self.cols[foundFader].isActive = True
-                    self.cols[foundFader].checkStatus()
-                    data[0] = (data[0] << 4) + foundFader
-                    logging.info('Volume Fader')
-                    self.outport.send_message(data)
-                    if (not previousState):
-                        self.cols[foundFader].isActive = False
-                    self.cols[foundFader].checkStatus()
-                    
-                # Other CC message not tied to a particular channel 
-                # action. Gets rerouted to the current channel.
-                else: 
-                    logging.info('Non-Triggerable CC ' + str(data))
-                    logging.info('Active Channel: ' + 
-                                 str(self.activeChannel))
-                    data[0] = (data[0] << 4) + self.activeChannel                    
-                    self.outport.send_message(data)
-                    
-            # Keydown and keyup events that aren't pads get re-routed
-            # to current channel
-            elif data[0] == 0b1000 or data[0] == 0b1001: 
-                logging.info('Keystroke')
-                logging.info('pad: ' + str(self.padchannel))
-                if (self.padchannel is not None and 
-                    (channel + 1 == self.padchannel)):
-                    logging.info('Pad channel. Ignoring.')
-                    self.outport.send_message(signalIn)
-                else:
-                    data[0] = (data[0] << 4) + self.activeChannel
-                    logging.info('data out: ' +  str(data))
-                    logging.info('Key Rerouted to Ch: ' + 
-                                 str(self.activeChannel + 1))
-                    self.outport.send_message(data)
-                    
-            # Pass through all other messages, without modification.        
-            else:
-                logging.info('Other MIDI Message')
-                self.outport.send_message(signalIn)
-                
-    """Scan for MIDI devices and update selector
+    """Scan for MIDI devices right now and update every row's selector
     
-    Also auto-reconnects if current device is dropped but returns later.
-    Returns True if device list changed. Otherwise, do nothing and 
-    return False.
+    Called when the device list is opened, so the user sees what's 
+    plugged in this moment. (The regular scans in the background wait 
+    for things to settle first.) Also auto-reconnects rows whose device 
+    came back. Returns False if our ports aren't open yet.
     """    
     def updateInDevices(self):
-        newPorts = self.inport.get_ports()
-        # Only do stuff if the port list changes from previous.
-        if newPorts != self.inports:
-            self.inports = self.inport.get_ports()
-            choicelist = self.inports #Actual choice names
-            if self.gui_indevice['values'] != choicelist:       
-                self.gui_indevice['values'] = choicelist
-            # Try to re-connect
-            if ('dev' in self.XMLElement.attrib and 
-                self.XMLElement.attrib['dev'] in choicelist):
-                if self.openPort(choicelist.index(self.XMLElement.attrib['dev'])):
-                    logging.info("Everything's good here!")
-                else:
-                    logging.warning("Couldn't auto-reconnect to device!")
+        # Ports are still being opened
+        if self.inport is None:
+            return False
+        # Nothing to look for; the network's always there
+        if self.hasNetInput():
+            return True
+        self.upper.applyDevices(self.inport.get_ports())
+        return True
+
+    """Catch up with the App's DeviceRegistry after the devices change:
+    refresh the device list, and reconnect if our device has moved or
+    come back. If it's still on the port we have open, leave it be.
+    """
+    def followDevices(self):
+        if self.hasNetInput():
+            return
+        registry = self.upper.devices
+        self.inports = list(registry.ports)
+        if list(self.gui_indevice['values']) != self.inports:
+            self.gui_indevice['values'] = self.inports
+        savedDevice = self.XMLElement.attrib.get('dev')
+        index = registry.find(savedDevice, self.savedOrdinal())
+        if index is None:
+            if savedDevice is not None:
+                logging.info('Row ' + str(self.rowNumber) +
+                             "'s device isn't plugged in.")
             else:
-                logging.info('Row ' + str(self.rowNumber) + 
+                logging.info('Row ' + str(self.rowNumber) +
                              ' does not have a device saved.')
-            return True
+            # Whatever we had open went away with it
+            self.connectedName = None
         else:
-            return False
-        
+            name = registry.ports[index]
+            self.indevice_choice.set(name)
+            if name != self.connectedName or not self.inport.is_port_open():
+                if self.openPort(index):
+                    logging.info("Everything's good here!")
+                else:
+                    logging.warning("Couldn't auto-reconnect to device!")
+        self.updateAll()
+
+    """Which of the devices with the saved device's name it was, from
+    the save file. None if it wasn't saved.
+    """
+    def savedOrdinal(self):
+        ordinal = self.XMLElement.attrib.get('ord', '')
+        return int(ordinal) if ordinal.isdigit() else None
+
     """Do things that default all columns to not listening anymore 
     """   
     def resetListenFlags(self): 
@@ -711,11 +1393,14 @@ class RowElement():
     Returns True on success, False on failure.
     """
     def openPort(self, portIndex):
+        if self.inport is None:
+            return False
         try:
             logging.info('Clearing out old port')
-            self.inport.close_port()
-            self.inport.open_port(portIndex)
-            self.inport.set_callback(self.onReceived, None)
+            reopenInPort(self.inport, portIndex, self.midiCallback)
+            # New device, new clock
+            self.timing.reset()
+            self.connectedName = self.inports[portIndex]
             logging.info('New Port opened!')
             logging.info('Port' + str(portIndex))
             logging.info('Port Name: ' + self.inports[portIndex])
@@ -726,6 +1411,7 @@ class RowElement():
             logging.warning(str(exc_tb.tb_lineno) + ':' + str(exc_type) + 
                          ': ' + str(exc_obj) + ": Coulnd't open port")
 
+            self.connectedName = None
             self.indevice_choice.set('')
             self.updateAll()
             return False
@@ -739,10 +1425,17 @@ class RowElement():
         whichOne = event.widget.bindtags()[0]
         if 'indevice' in whichOne: 
             # Opens port in port list with this index.
-            if self.openPort(self.gui_indevice.current()): 
-                try:   
-                    # Try to save new device       
-                    self.XMLElement.attrib['dev'] = self.indevice_choice.get()
+            index = self.gui_indevice.current()
+            if self.openPort(index):
+                try:
+                    # Try to save new device, along with which one of
+                    # the devices with that name it is
+                    store = self.upper.store
+                    store.set(self.XMLElement, 'dev',
+                              self.indevice_choice.get())
+                    ordinal = fingerprints(self.inports)[index][1]
+                    store.set(self.XMLElement, 'ord',
+                              str(ordinal) if ordinal else None)
                     self.upper.saveFile()                    
                 except:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -774,8 +1467,7 @@ class RowElement():
         self.rowLabel.grid_remove()
         self.gui_indeviceLabel.grid()
         self.gui_indevice.grid()
-        for cols in self.cols:
-            cols.maximize()
+        self.columns.maximize()
             
     """Shrinks the row by hiding all non-essential controls
     """
@@ -784,8 +1476,7 @@ class RowElement():
         self.rowLabel.grid()        
         self.gui_indeviceLabel.grid_remove()
         self.gui_indevice.grid_remove()
-        for cols in self.cols:
-            cols.minimize()
+        self.columns.minimize()
             
             
 """ColumnElement: A container for the settings of an individual channel.
@@ -819,10 +1510,21 @@ The logic for all this is primarily handled in the RowElement; this is
 merely a container that holds state values and settings.
 """
 class ColumnElement():
+    # The channel's settings live in self.state (a ChannelState), where
+    # the routing engine can get at them without the widgets.
+    channel = stateProperty('channel')
+    type = stateProperty('type')
+    trigger = stateProperty('trigger')
+    fader = stateProperty('fader')
+    padchannel = stateProperty('padchannel')
+    isActive = stateProperty('isActive')
+    isDisabled = stateProperty('isDisabled')
+    listening = stateProperty('listening')
+
     """Initializes a ColumnElement
     
     Arguments:
-    container -- Points to the Tk frame that holds this ColumnElement.
+    container -- Points to the RowCanvas this ColumnElement is drawn on.
     channel -- A number starting from 1 that indicates the channel this
         ColumnElement will re-route MIDI signals to.
     callback -- Points to a callback function in the RowElement that 
@@ -861,6 +1563,7 @@ class ColumnElement():
                '%S', '%P') 
         self.callback = callback
     
+        self.state = ChannelState(channel, type)
         self.channel = channel
         self.fader = None
         self.trigger = None
@@ -874,41 +1577,18 @@ class ColumnElement():
         self.isDisabled = False 
         
         self.errmsg = None #Returns message if something goes wrong
+        self.blinking = False # Is the LED blinking for a fader?
         
-        # Various Tk frames to get the UI element placements right.
-        self.container = ttk.Frame(container)
-        self.bottomside = ttk.Frame(self.container)
-        self.rightside = ttk.Frame(self.bottomside)
-        self.faderbuttons = ttk.Frame(self.rightside)
-        self.triggerbuttons = ttk.Frame(self.rightside)
-        
-        self.type = type
-        
-        # Channel label
-        if self.type == COL_NORMAL:
-            self.gui_channellabel = ttk.Label(self.rightside, 
-                                              text='CH ' + str(channel), 
-                                              justify=LEFT)
-        else:
-            self.gui_channellabel = ttk.Label(self.rightside, 
-                                              text='PAD', justify=LEFT)
-    
-        self.gui_channellabel.grid(column=0, row=0, sticky=(W))
-        
-        # Status "LED" indicator. 
+        # The channel's label, status "LED" and binding labels are drawn
+        # on the row's canvas (see RowCanvas). Only the things you can
+        # click or type in are widgets of their own. The LED's colors:
         # Grey=Not Configured/Disabled
         # Red=Error
         # Dark Green=Inactive
         # Light Green=Active
         # Yellow=Listening
-        self.gui_led = tkinter.Label(self.rightside, width=2, bg='grey')
-        self.gui_led.grid(column=1, row=0, sticky=(E))
-        
-        # Fader label (Looks like: "F: CC128")
-        self.gui_faderlabel = ttk.Label(self.rightside, text='F:')
-        self.gui_faderlabel.grid(column=0, row=1, sticky=(E))
-        self.gui_fadervalue = ttk.Label(self.rightside, text='N/A', width=6)
-        self.gui_fadervalue.grid(column=1, row=1, sticky=(W))
+        self.canvas = container
+        self.type = type
         
         # Fader listen button
         # This is kinda crazy here. We want to handle these buttons 
@@ -917,74 +1597,41 @@ class ColumnElement():
         # access to the main loop to hit the upper callback function 
         # for all button events. Lambda is used here to pass args. to 
         # our callback. Sorry these lines break PEP-8 line length rules.
-        self.gui_faderlisten = ttk.Button(self.faderbuttons, 
+        self.gui_faderlisten = ttk.Button(container, 
                                           text='L', width=1, 
                                           command=lambda:callback('F', channel, self.gui_faderlisten)) 
         
         # This button clears any fader bindings
-        self.gui_faderclear = ttk.Button(self.faderbuttons, text='X', 
+        self.gui_faderclear = ttk.Button(container, text='X', 
                                          width=1, 
                                          command=self.deleteFader) 
-        self.gui_faderlisten.grid(column=0, row=0)
-        self.gui_faderclear.grid(column=1, row=0)
-        self.faderbuttons.grid(column=0, row=2, columnspan=2)
-        
-        self.gui_padchannel = ttk.Entry(self.rightside, width=3, 
-                                        validate='key', 
-                                        validatecommand=updatePadChannel)
+        self.widgets = [self.gui_faderlisten, self.gui_faderclear]
         
-        # Trigger listen buttons / labels
+        # Trigger listen buttons
         # If this channel isn't a pad channel...
         if self.type == COL_NORMAL: 
-            # Trigger Label (Looks like: "T: CC48")
-            self.gui_triggerlabel = ttk.Label(self.rightside, text='T:')
-            self.gui_triggerlabel.grid(column=0, row=3, sticky=(E))
-            self.gui_triggervalue = ttk.Label(self.rightside, 
-                                              text='N/A', width=6)
-            self.gui_triggervalue.grid(column=1, row=3, sticky=(W))
-            self.gui_triggerlisten = ttk.Button(self.triggerbuttons, 
+            self.gui_triggerlisten = ttk.Button(container, 
                                                 text='L', width=1, 
                                                 command=lambda:callback('T', channel, self.gui_triggerlisten))  # Haha, passing the button itself as an argument! How meta!
-            self.gui_triggerclear = ttk.Button(self.triggerbuttons, 
+            self.gui_triggerclear = ttk.Button(container, 
                                                text='X', width=1, 
                                                command=self.deleteTrigger) 
-            self.gui_triggerlisten.grid(column=0, row=0)
-            self.gui_triggerclear.grid(column=1, row=0)
-            self.triggerbuttons.grid(column=0, row=4, columnspan=2)
+            self.widgets.extend([self.gui_triggerlisten, 
+                                 self.gui_triggerclear])
             
-        # If it's a pad channel, we don't need to trigger it, so those
-        # UI elements aren't displayed.
-        else:
-            # Literally just the word "Channel" above the entry box
-            self.gui_channelBoxHint = ttk.Label(self.rightside, 
-                                                text='Channel', 
-                                                justify=CENTER)
-            self.gui_channelBoxHint.grid(column=0, row=3, columnspan=2)
-            self.gui_padchannel.grid(column=0, row=4, columnspan=2)
-        
-        
-        self.rightside.grid(column=1, row=1, sticky=(E))
-        # Separator between columns
-        ttk.Separator(self.bottomside, orient=VERTICAL).grid(column=0, 
-                                                             row=1, 
-                                                             sticky=(N,S), 
-                                                             padx=LAYOUT_PAD_X)
-        
-        self.bottomside.pack()
-        self.container.grid(row=0, column=(channel-1))
-        
-        # This is a list of all the elements that could be hidden when 
-        # SwitchBox goes into "minimized" mode.
-        self.minimizeableElements = [self.faderbuttons, 
-                                     self.triggerbuttons, 
-                                     self.gui_faderlabel, 
-                                     self.gui_fadervalue]
-        if self.type == COL_NORMAL:
-            self.minimizeableElements.extend([self.gui_triggerlabel, 
-                                              self.gui_triggervalue])
+        # If it's a pad channel, we don't need to trigger it, so it 
+        # gets a box for its channel number instead.
         else:
-            self.minimizeableElements.extend([self.gui_padchannel, 
-                                              self.gui_channelBoxHint])
+            self.gui_padchannel = ttk.Entry(container, width=3, 
+                                            validate='key', 
+                                            validatecommand=updatePadChannel)
+            self.widgets.append(self.gui_padchannel)
+        
+        # Where our items are on the canvas
+        self.index = container.addColumn(self)
+        # Whether the buttons were last shown disabled
+        self.shownDisabled = None
+        
         # Give an update before we finish initializing.
         self.checkStatus()
     
@@ -994,57 +1641,23 @@ class ColumnElement():
     updates the labels
     """
     def checkStatus(self):
-        self.errmsg = None
         if not self.listening:
             self.gui_faderlisten['text'] = 'L'
             if self.type == COL_NORMAL:
                 self.gui_triggerlisten['text'] = 'L'
-                
-        if self.listening:
-            self.gui_led['bg'] = YELLOW
-            self.errmsg = 'is listening'
-            logging.info('Is Listening')
-            
-        # If a channel has no fader and no trigger, that's fine. It
-        # just won't do anything.
-        elif self.fader is None and self.trigger is None:
-            self.gui_led['bg'] = GRAY
-            
-        elif self.isDisabled:
-            self.gui_led['bg'] = GRAY
-            
-        elif (self.type == COL_PAD and 
-              self.padchannel is None and 
-              self.fader is None):
-            self.gui_led['bg'] = GRAY
-            
-        # A channel has to have a trigger. If there's also a fader
-        # paired, it can't be re-routed, which is a problem.
-        elif self.trigger is None and self.type == COL_NORMAL:
-            self.errmsg = 'has a Fader, but no Trigger'
-            self.gui_led['bg'] = RED
-        
-        # A pad channel only works when it has a channel number assigned
-        # Otherwise, it wouldn't make sense to have a fader paired
-        # since it would never be re-routed.
-        elif (self.type == COL_PAD and 
-              self.padchannel is None and 
-              self.fader is not None):
-            self.errmsg = 'has a Fader, but no Pad Channel.'
-            self.gui_led['bg'] = RED
         
-        # Because pad channels are always active.
-        elif self.type == COL_PAD:
-            self.gui_led['bg'] = LIGHTGREEN
-            
-        elif self.isActive:
-            self.gui_led['bg'] = LIGHTGREEN
-        
-        else:
-            self.gui_led['bg'] = GREEN
+        # Which color the light is, and what's wrong, is worked out
+        # from the channel's settings alone (see state.py)
+        led, self.errmsg = channelStatus(self.state)
+        self.canvas.setLed(self.index, LED_COLORS[led])
+        if led == LED_LISTENING:
+            logging.info('Is Listening')
         
-        # This grays out widgets if current channel is disabled.
-        if self.isDisabled: 
+        # This grays out widgets if current channel is disabled. Only
+        # when that changes, though, since every one's a trip to Tcl.
+        if self.isDisabled == self.shownDisabled:
+            pass
+        elif self.isDisabled: 
             self.gui_faderclear['state'] = DISABLED
             self.gui_faderlisten['state'] = DISABLED
             if self.type == COL_NORMAL:
@@ -1060,18 +1673,29 @@ class ColumnElement():
                 self.gui_triggerlisten['state'] = NORMAL
             else:
                 self.gui_padchannel['state'] = NORMAL
+        self.shownDisabled = self.isDisabled
         
         if self.type == COL_NORMAL:
-            if self.trigger is None:
-                self.gui_triggervalue['text'] = 'N/A'
-            else:
-                self.gui_triggervalue['text'] = 'CC' + str(self.trigger)
-            
-        if self.fader is None:
-            self.gui_fadervalue['text'] = 'N/A'
-        else:
-            self.gui_fadervalue['text'] = 'CC' + str(self.fader) 
+            self.canvas.setText(self.index, 'trigger', 
+                                'N/A' if self.trigger is None
+                                else 'CC' + str(self.trigger))
+        self.canvas.setText(self.index, 'fader', 
+                            'N/A' if self.fader is None
+                            else 'CC' + str(self.fader))
             
+    """Briefly light up the status LED, e.g. when a fader moves.
+    """
+    def blink(self):
+        if self.blinking:
+            return
+        self.blinking = True
+        self.canvas.setLed(self.index, LIGHTGREEN)
+        
+        def endBlink():
+            self.blinking = False
+            self.checkStatus()
+        self.canvas.after(INTERVAL_BLINK_MS, endBlink)
+    
     """ Button handler for when the "delete" button is pressed on a 
     trigger binding.
     """
@@ -1088,20 +1712,167 @@ class ColumnElement():
         self.listening = False
         self.checkStatus()
         self.callback('F', self.channel, self.gui_faderclear)
-        
-    """Puts this ColumnElement into a "minimized" state.
+
+
+"""Draws a whole row's channels on one Canvas: each one's label, status
+"LED" and bindings, with its buttons (and the pad channel's box) placed
+on it too.
+
+This used to take a dozen or so Tk widgets per channel, hundreds for a
+whole rig, and an LED changing color meant a configure on a Label. Now
+every item is made once, when its ColumnElement is, and after that only
+gets an itemconfigure when what it shows actually changes.
+"""
+class RowCanvas(Canvas):
+    def __init__(self, container):
+        Canvas.__init__(self, container, highlightthickness=0, 
+                        borderwidth=0)
+        style = ttk.Style()
+        background = style.lookup('TFrame', 'background')
+        if background:
+            self['background'] = background
+        self.foreground = style.lookup('TLabel', 'foreground') or 'black'
+        self.font = tkinter.font.nametofont('TkDefaultFont')
+        self.items = []   # For each column, its items by name
+        self.shown = {}   # Item -> what it's showing
+        self.isMinimized = False
+        self.fullHeight = 0
+        self.smallHeight = 0
+    
+    """Make the items for a new ColumnElement, at the end of the row.
+    Call layout() once the row's columns are all added.
+    
+    Returns the column's index, for setLed() and setText().
+    """
+    def addColumn(self, column):
+        tag = 'col' + str(len(self.items))
+        
+        def text(value, full=True):
+            return self.create_text(0, 0, text=value, anchor=W, 
+                                    font=self.font, fill=self.foreground,
+                                    tags=(tag, 'full') if full else tag)
+        
+        def window(widget):
+            return self.create_window(0, 0, window=widget, anchor=NW, 
+                                      tags=(tag, 'full'))
+        items = {'separator': self.create_line(0, 0, 0, 0, fill=GRAY, 
+                                               tags=(tag, 'full')),
+                 'label': text('CH ' + str(column.channel) 
+                               if column.type == COL_NORMAL else 'PAD',
+                               full=False),
+                 'led': self.create_rectangle(0, 0, 0, 0, fill=GRAY, 
+                                              outline='', tags=tag),
+                 'faderlabel': text('F:'),
+                 'fader': text('N/A'),
+                 'faderlisten': window(column.gui_faderlisten),
+                 'faderclear': window(column.gui_faderclear)}
+        if column.type == COL_NORMAL:
+            items.update({'triggerlabel': text('T:'),
+                          'trigger': text('N/A'),
+                          'triggerlisten': window(column.gui_triggerlisten),
+                          'triggerclear': window(column.gui_triggerclear)})
+        else:
+            items.update({'hint': text('Channel'),
+                          'padchannel': window(column.gui_padchannel)})
+        self.items.append(items)
+        if self.isMinimized:
+            self.itemconfigure('full', state='hidden')
+        return len(self.items) - 1
     
-    This makes the column more compact by only showing essential info.
+    """Take the last column's items (and its widgets) off.
+    """
+    def removeColumn(self, column):
+        items = self.items.pop()
+        for item in items.values():
+            self.shown.pop(item, None)
+        self.delete('col' + str(len(self.items)))
+        for widget in column.widgets:
+            widget.destroy()
+        self.layout()
+    
+    """Put every column's items where they go, and size the canvas to
+    fit. Sizes come from the font and the buttons, so it suits whatever
+    theme Tk's using.
+    """
+    def layout(self):
+        line = self.font.metrics('linespace')
+        gap = LAYOUT_PAD_X
+        widgets = [self.nametowidget(self.itemcget(item, 'window'))
+                   for items in self.items for name, item in items.items()
+                   if self.type(item) == 'window']
+        buttonWidth = max([widget.winfo_reqwidth() for widget in widgets 
+                           if isinstance(widget, ttk.Button)] or [0])
+        buttonHeight = max([widget.winfo_reqheight() 
+                            for widget in widgets] or [line])
+        ledWidth = self.font.measure('00')
+        valueX = self.font.measure('F: ')
+        width = max(self.font.measure('CH 10') + gap + ledWidth,
+                    valueX + self.font.measure('CC127'),
+                    2 * buttonWidth,
+                    max([widget.winfo_reqwidth() for widget in widgets] or 
+                        [0])) + 2 * gap
+        self.fullHeight = 3 * line + 2 * buttonHeight
+        self.smallHeight = line
+        
+        for index, items in enumerate(self.items):
+            left = index * width + gap
+            self.coords(items['separator'], index * width, 0, 
+                        index * width, self.fullHeight)
+            self.coords(items['label'], left, line / 2)
+            self.coords(items['led'], left + width - 2 * gap - ledWidth, 2,
+                        left + width - 2 * gap, line - 2)
+            self.coords(items['faderlabel'], left, line * 3 / 2)
+            self.coords(items['fader'], left + valueX, line * 3 / 2)
+            self.coords(items['faderlisten'], left, 2 * line)
+            self.coords(items['faderclear'], left + buttonWidth, 2 * line)
+            below = 2 * line + buttonHeight
+            if 'trigger' in items:
+                self.coords(items['triggerlabel'], left, below + line / 2)
+                self.coords(items['trigger'], left + valueX, 
+                            below + line / 2)
+                self.coords(items['triggerlisten'], left, below + line)
+                self.coords(items['triggerclear'], left + buttonWidth, 
+                            below + line)
+            else:
+                self.coords(items['hint'], left, below + line / 2)
+                self.coords(items['padchannel'], left, below + line)
+        self.configure(width=len(self.items) * width, 
+                       height=(self.smallHeight if self.isMinimized 
+                               else self.fullHeight))
+    
+    """Show something on an item, unless it's already showing it.
+    """
+    def show(self, item, option, value):
+        if self.shown.get(item) != value:
+            self.shown[item] = value
+            self.itemconfigure(item, **{option: value})
+    
+    """Set a column's status light to a color.
+    """
+    def setLed(self, index, color):
+        self.show(self.items[index]['led'], 'fill', color)
+    
+    """Set one of a column's labels ('fader' or 'trigger').
+    """
+    def setText(self, index, name, text):
+        self.show(self.items[index][name], 'text', text)
+    
+    """Puts the row's channels into a "minimized" state.
+    
+    This makes the row more compact by only showing each channel's 
+    label and light.
     """
     def minimize(self):
-        for elements in self.minimizeableElements:
-            elements.grid_remove()
-            
+        self.isMinimized = True
+        self.itemconfigure('full', state='hidden')
+        self.configure(height=self.smallHeight)
+    
     """The opposite of the above function.
     """
     def maximize(self):
-        for elements in self.minimizeableElements:
-            elements.grid()
+        self.isMinimized = False
+        self.itemconfigure('full', state='normal')
+        self.configure(height=self.fullHeight)
         
 
 """The App class is basically a Tkinter frame that runs the whole show.
@@ -1125,6 +1896,8 @@ class App(ttk.Frame):
         helpmenu.add_command(label='SwitchBox Help',
                             command=self.help, accelerator='F1')
         self.bind_all('<F1>', self.help)
+        self.bind_all('<' + PANIC_KEY + '>', self.panic)
+        helpmenu.add_command(label='Timing', command=self.showTiming)
         
         # If on a Mac, make the "About" menu show up in the menu with 
         # the application's name in it (Apple menu). Otherwise, make it 
@@ -1138,6 +1911,10 @@ class App(ttk.Frame):
             helpmenu.add_command(label='About SwitchBox', 
                                   command=self.on_about_action)
             
+        # Scenes menu. Gets filled in once we've read the setlist.
+        self.scenemenu = Menu(self.menu)
+        self.menu.add_cascade(menu=self.scenemenu, label='Scenes')
+            
         self.menu.add_cascade(menu=helpmenu, label='Help')
         master.config(menu=self.menu) 
         
@@ -1152,6 +1929,50 @@ class App(ttk.Frame):
         master.protocol('WM_DELETE_WINDOW', self.onApplicationClose)
         
         self.rowlist = []
+        
+        # The setlist, and where we are in it. MIDI callbacks read 
+        # self.scenes directly, so it's only ever replaced, never edited.
+        self.scenes = SceneBook()
+        self.currentScene = None
+        # CC that sets off panic. Rows build it into their routing.
+        self.panicCC = PANIC_CC
+        # Hotkeys currently bound to scenes, so we can unbind them
+        self.sceneKeys = []
+        
+        # Work handed to the UI from the MIDI callbacks
+        self.uiQueue = queue.SimpleQueue()
+        
+        # Keeps an eye on the MIDI callbacks and the main loop
+        self.watchdog = Watchdog(WATCHDOG_BUDGET_MS / 1000 
+                                 if WATCHDOG_BUDGET_MS is not None else None,
+                                 self.onStall)
+        
+        # Routing threads/processes, if we're using them
+        self.workers = RoutingWorkers(ROUTING_MODE, ROUTING_SHARDS, 
+                                      ROUTING_QUEUE_SIZE, rtmidi)
+        
+        # Device scans, saving and the like, off the UI thread
+        self.scheduler = Scheduler(SCHEDULER_WORKERS)
+
+        # The save file, and the journal of changes to it
+        self.store = ConfigStore(PATH_CURRENT_XML, journal=CONFIG_JOURNAL)
+        self.watcher = None
+        self.isReloading = False
+        # Set while a control API batch is being applied, so the save
+        # file only gets written once for all of it
+        self.isBatching = False
+        self.control = None
+        self.mirror = None
+
+        # Sends panic, off on its own thread
+        self.panicButton = PanicButton(self.panicTargets)
+
+        # Opens rows' MIDI ports in the background
+        self.portOpener = PortOpener(rtmidi, PORT_THREADS)
+        # Which devices are plugged in, and which ports they're on
+        self.devices = DeviceRegistry()
+        self.scanning = None
+
         # Holds the RowElements and "top bar"
         self.windowUpper = ttk.Frame(self.master)
         # Holds the horizontal separator and +/- buttons
@@ -1173,6 +1994,17 @@ class App(ttk.Frame):
         self.gui_errmsg.grid(column=1, row=0, padx=LAYOUT_PAD_X, 
                              pady=LAYOUT_PAD_Y)
         
+        # Name of the current scene, if there is one
+        self.gui_scene = ttk.Label(self.topbar)
+        self.gui_scene.grid(column=2, row=0, padx=LAYOUT_PAD_X, 
+                            pady=LAYOUT_PAD_Y)
+        
+        # Most recent stall the watchdog caught
+        self.gui_stall = ttk.Label(self.topbar, foreground=RED)
+        self.gui_stall.grid(column=3, row=0, padx=LAYOUT_PAD_X, 
+                            pady=LAYOUT_PAD_Y)
+        self.stallTimer = None
+        
         self.topbar.grid(column=0, row=0, sticky=(W,E))
         
         # Buttons for adding/removing a slot
@@ -1191,6 +2023,8 @@ class App(ttk.Frame):
         self.bottombar.pack(fill='x')
         
         self.readState()
+        # Rows added from here on look for devices themselves
+        self.portOpener.rescan()
         
         # Prevents you from deleting rows when there's only one left.
         if len(self.rowlist) <= 1:
@@ -1200,38 +2034,89 @@ class App(ttk.Frame):
         self.windowLower.pack(fill='x')
                         
         self.myXML = self.myTree.getroot()
-        
+        self.rebuildSceneMenu()
+
+        # Watch for other programs changing the save file
+        if CONFIG_WATCH:
+            self.watcher = FileWatcher(PATH_CURRENT_XML,
+                                       self.onConfigChanged)
+
+        # Let scripts drive us
+        if CONTROL_API:
+            try:
+                self.control = ControlServer(CONTROL_ADDRESS,
+                                             self.onControlBatch)
+            except:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                                ": Couldn't start control API")
+
+        # Keep a standby ready to take over if we die
+        if MIRROR_API:
+            try:
+                self.mirror = MirrorServer(
+                    MIRROR_ADDRESS, self.mirrorSnapshot,
+                    lambda: self.postToUI(self.standAside))
+            except:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                                ": Couldn't start mirroring for a standby")
+
+        # The main loop's heartbeat. The UI tick beats it, so it should
+        # hear from us at least every INTERVAL_UI_MS.
+        self.heartbeat = self.watchdog.watch('Main loop',
+                                             INTERVAL_UI_MS / 1000)
+
+        # Look for new devices every so often. USB can take its time,
+        # so nothing else should have to wait on it.
+        self.scanning = self.scheduler.every(
+            INTERVAL_CHECKNEW_MS / 1000, self.scanDevices,
+            priority=PRIORITY_LOW, timeout=SCAN_TIMEOUT_S, name='Device scan')
+
         logging.info('About to enter loop!')
-        master.after(INTERVAL_CHECKNEW_MS, self.onUpdateTick)
+        master.after(INTERVAL_UI_MS, self.onUiTick)
     
     """Load savefile from XML file
     """    
     def readState(self):
-        # Try to open file; Creates a brand new one if it can't
-        try:
-            self.myTree = etree.ElementTree(file=PATH_CURRENT_XML)
-            logging.info('Successfully read XML')
-        except:
-            logging.warning('Cannot read savefile; Creating new file')
+        # Try to open file; Creates a brand new one if it can't. Any
+        # changes that were still in the journal get replayed.
+        def makeDefault():
             myRoot = etree.Element('swr')
             myRoot.set('title', 'Auto-Generated Save File')
             etree.SubElement(myRoot, 'row')
-            self.myTree = etree.ElementTree(element=myRoot)
-            self.myTree.write(PATH_CURRENT_XML, pretty_print=True)
+            return myRoot
+        # The rows get read on the way in (the +1 is the pad channel)
+        self.myTree = self.store.load(makeDefault, NUM_COLS + 1)
+        
+        self.panicCC = self.readPanicCC(self.myTree.getroot())
+
+        # Load the setlist first, since rows can start asking about
+        # scenes as soon as their ports are open.
+        scenesElement = self.myTree.getroot().find('scenes')
+        self.scenes = SceneBook.fromXML(scenesElement, NUM_COLS + 1)
+        if scenesElement is not None:
+            current = scenesElement.get('cur', '')
+            if current.isdigit() and int(current) < len(self.scenes):
+                self.currentScene = int(current)
         
         # This is where the XML loading magic happens
-        for rows in self.myTree.getroot():
+        rowNumber = 0
+        for config in self.store.rows:
             logging.info('Reading row from XML...')
-            # Pass the XML element to the row to have it configure itself
-            newRow = RowElement(self.windowUpper, 
-                                self.myTree.getroot().index(rows), 
-                                NUM_COLS, 
-                                rows, 
-                                self, 
-                                name=rows.attrib.get('name'))
+            # Pass the row's settings to the row to have it configure
+            # itself
+            newRow = RowElement(self.windowUpper,
+                                rowNumber,
+                                NUM_COLS,
+                                config.element,
+                                self,
+                                name=config.name,
+                                config=config)
             if not self.isExpanded:
                 newRow.minimize()
             self.rowlist.append(newRow)
+            rowNumber += 1
             
         minimizeAttrib = self.myTree.getroot().attrib.get('min')
         if minimizeAttrib == 't':
@@ -1248,9 +2133,22 @@ class App(ttk.Frame):
     """Write XML to file
     """
     def saveFile(self):
+        # A control API batch saves once, when it's done
+        if self.isBatching:
+            return
         logging.info('Saving XML...')
+        # The journal gets written in the background. Saves share a
+        # key, so they go out in order, and one that's asked for while
+        # another's waiting just goes along with it.
+        if self.store.useJournal:
+            self.scheduler.submit(self.store.save, priority=PRIORITY_HIGH,
+                                  timeout=SAVE_TIMEOUT_S, key='save',
+                                  name='Save')
+            return
+        # Without a journal, the whole tree gets written, and only the
+        # UI thread can read that
         try:
-            self.myTree.write(PATH_CURRENT_XML, pretty_print=True)
+            self.store.save()
         except:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             exc_type = exc_type.__name__
@@ -1267,14 +2165,14 @@ class App(ttk.Frame):
         if expand:
             logging.info('Maximizing')
             self.expand['text'] = 'Minimize'
-            self.myTree.getroot().attrib['min'] = 'f'
+            self.store.set(self.myTree.getroot(), 'min', 'f')
             self.bottombar.pack(fill='x') # Unhide bottom bar
             for rows in self.rowlist: # Expand all row elements
                 rows.maximize()   
         else:
             logging.info('Minimizing')
             self.expand['text'] = 'Maximize'
-            self.myTree.getroot().attrib['min'] = 't'
+            self.store.set(self.myTree.getroot(), 'min', 't')
             self.bottombar.pack_forget() # Hide bottom bar from view
             for rows in self.rowlist: # Shrink all row elements
                 rows.minimize()
@@ -1341,18 +2239,38 @@ class App(ttk.Frame):
     We're not using any of the arguments that Tk passes us.
     """
     def onApplicationClose(self, *args):
+        # Fold the journal into the save file before we go
+        if self.control is not None:
+            self.control.stop()
+        if self.mirror is not None:
+            self.mirror.stop()
+        if self.watcher is not None:
+            self.watcher.stop()
+        # Lets any saves still waiting finish first
+        self.scheduler.stop()
+        self.store.close()
+        self.watchdog.stop()
+        self.panicButton.stop()
+        self.portOpener.stop()
+        self.workers.stop()
         self.master.destroy() #Event logic to quit program
     
     """Add a new blank row
     """
-    def addRow(self):
-        channelnumber = len(self.myXML)
-        newElement = etree.SubElement(self.myXML, 'row')
-        self.rowlist.append(RowElement(self.windowUpper, 
-                                       channelnumber, 
-                                       NUM_COLS, 
-                                       newElement, 
-                                       self))
+    def addRow(self, element=None):
+        channelnumber = len(self.rowlist)
+        if element is None:
+            newElement = etree.SubElement(self.myXML, 'row')
+        else:
+            newElement = element
+            self.myXML.append(newElement)
+        self.store.added(newElement)
+        self.rowlist.append(RowElement(self.windowUpper,
+                                       channelnumber,
+                                       NUM_COLS,
+                                       newElement,
+                                       self,
+                                       name=newElement.get('name')))
         self.saveFile()
         self.gui_sub['state'] = NORMAL
     
@@ -1360,26 +2278,535 @@ class App(ttk.Frame):
     """
     def delRow(self):
         if messagebox.askokcancel('', 'Are you sure you want to delete a row? This cannot be undone.'):
-            toDelete = self.rowlist[-1]
-            toDelete.container.grid_forget()
-            toDelete.topSeparator.grid_forget()
-            self.myXML.remove(toDelete.XMLElement)
-            del(self.rowlist[-1])
+            self.removeLastRow()
             self.printXML()
             self.saveFile()
-            if len(self.rowlist) < 2:
-                self.gui_sub['state'] = DISABLED
         else:
             pass
+
+    """Get rid of the last row, no questions asked
+    """
+    def removeLastRow(self):
+        toDelete = self.rowlist[-1]
+        toDelete.container.grid_forget()
+        toDelete.topSeparator.grid_forget()
+        self.store.remove(toDelete.XMLElement)
+        self.workers.detach(toDelete)
+        self.watchdog.forget(toDelete.heartbeat)
+        # Its output port goes back to the workers' OutputManager, so a
+        # row that's added again can have it
+        for port in (toDelete.inport, toDelete.outport):
+            if port is not None:
+                try:
+                    closePort(port)
+                except:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                                    ": Couldn't close deleted row's port")
+        del(self.rowlist[-1])
+        if len(self.rowlist) < 2:
+            self.gui_sub['state'] = DISABLED
         
-    """Repeatedly checks for new MIDI devices, but not too often
+    """Hand a function to the UI to run on its next tick.
+    
+    MIDI callbacks use this for anything that touches widgets or the 
+    save file, so that work stays off the MIDI path.
     """
-    def onUpdateTick(self):
-        for rows in self.rowlist:
-            if rows.updateInDevices():
+    def postToUI(self, function, *args):
+        self.uiQueue.put((function, args))
+    
+    """Runs everything the MIDI callbacks have handed to the UI
+    """
+    def onUiTick(self):
+        self.heartbeat.beat()
+        while True:
+            try:
+                function, args = self.uiQueue.get_nowait()
+            except queue.Empty:
+                break
+            function(*args)
+        self.master.after(INTERVAL_UI_MS, self.onUiTick)
+    
+    """Called from the watchdog's thread when it catches a stall, and
+    again when the stall is over. The watchdog has already logged it.
+    """
+    def onStall(self, stall):
+        self.postToUI(self.showStall, stall)
+    
+    """Put a stall up in the status bar for a while.
+    """
+    def showStall(self, stall):
+        self.gui_stall['text'] = stall.summary()
+        if self.stallTimer is not None:
+            self.master.after_cancel(self.stallTimer)
+        self.stallTimer = self.master.after(INTERVAL_STALL_SHOWN_MS, 
+                                            self.clearStall)
+    
+    def clearStall(self):
+        self.stallTimer = None
+        self.gui_stall['text'] = ''
+
+    """Called from the control API's threads with a batch of commands.
+    The batch gets applied on the UI side, and we wait for it there.
+
+    If the UI hasn't got to it within CONTROL_TIMEOUT_S, it's called
+    off, so a client that tries again doesn't get it applied twice. One
+    that's already started gets waited for.
+    """
+    def onControlBatch(self, commands):
+        reply = queue.Queue(1)
+        lock = threading.Lock()
+        progress = {'started': False, 'cancelled': False}
+        def run():
+            with lock:
+                if progress['cancelled']:
+                    return
+                progress['started'] = True
+            try:
+                reply.put((True, self.runBatch(commands)))
+            except Exception as error:
+                reply.put((False, error))
+        self.postToUI(run)
+        try:
+            ok, result = reply.get(timeout=CONTROL_TIMEOUT_S)
+        except queue.Empty:
+            with lock:
+                if not progress['started']:
+                    progress['cancelled'] = True
+                    raise ControlError('SwitchBox is busy; try again')
+            ok, result = reply.get()
+        if not ok:
+            raise result
+        return result
+
+    """Apply a batch of control API commands (see control.py).
+
+    The whole batch is checked before any of it is applied. Each row it
+    changes gets its new routing put into service once, after all of
+    the batch's changes to it, and the save file is written once at the
+    end. Should something go wrong partway anyway, the rows it touched
+    are put back the way they were (a panic can't be taken back, but
+    it's harmless).
+
+    Returns a list of results, one per command: None, except for state.
+    """
+    def runBatch(self, commands):
+        batch = parseBatch(commands, len(self.rowlist), NUM_COLS + 1,
+                           len(self.scenes))
+        changed = []
+        results = []
+        saved = self.saveBatchState(batch)
+        self.isBatching = True
+        try:
+            for command in batch:
+                result = None
+                if command[0] == 'bind':
+                    rows = self.rowlist[command[1]]
+                    rows.setBinding(command[2], command[3], command[4])
+                    if rows not in changed:
+                        changed.append(rows)
+                elif command[0] == 'pad':
+                    rows = self.rowlist[command[1]]
+                    rows.setPadChannel(command[2])
+                    if rows not in changed:
+                        changed.append(rows)
+                elif command[0] == 'activate':
+                    self.rowlist[command[1]].activateChannel(command[2])
+                elif command[0] == 'scene':
+                    self.activateScene(command[1], fromUI=True)
+                elif command[0] == 'state':
+                    result = self.describeState(command[1])
+                elif command[0] == 'panic':
+                    self.panic()
+                results.append(result)
+            for rows in changed:
+                rows.publishRouting()
                 rows.updateAll()
-                self.updateErrorMessage()
-        self.master.after(INTERVAL_CHECKNEW_MS, self.onUpdateTick)
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ': Control batch failed; undoing it')
+            self.restoreBatchState(saved)
+            raise
+        finally:
+            self.isBatching = False
+            self.saveFile()
+        logging.info('Applied ' + str(len(batch)) + ' control commands')
+        return results
+
+    """Remember how the rows a batch touches are, so it can be undone.
+
+    Arguments:
+    batch -- The batch, as parseBatch returns it
+
+    Returns something for restoreBatchState().
+    """
+    def saveBatchState(self, batch):
+        touched = set()
+        for command in batch:
+            if command[0] == 'scene':
+                touched.update(range(len(self.rowlist)))
+            elif command[0] in ('bind', 'pad', 'activate'):
+                touched.add(command[1])
+        scenesElement = self.myXML.find('scenes')
+        return {'rows': [(self.rowlist[row], self.rowlist[row].sceneRow())
+                         for row in sorted(touched)],
+                'scene': self.currentScene,
+                'cur': (scenesElement.get('cur')
+                        if scenesElement is not None else None),
+                'label': self.gui_scene['text']}
+
+    """Put the rows a batch touched back the way saveBatchState() found
+    them.
+    """
+    def restoreBatchState(self, saved):
+        for rows, sceneRow in saved['rows']:
+            rows.applySceneRow(sceneRow)
+            rows.activateChannel(sceneRow.channel)
+            rows.publishRouting()
+        self.currentScene = saved['scene']
+        scenesElement = self.myXML.find('scenes')
+        if scenesElement is not None:
+            self.store.set(scenesElement, 'cur', saved['cur'])
+        self.gui_scene['text'] = saved['label']
+
+    """The rig's settings and status, for the control API.
+
+    Arguments:
+    row -- Just this row (from zero), or None for all of them
+    """
+    def describeState(self, row=None):
+        rows = self.rowlist if row is None else [self.rowlist[row]]
+        return {'scene': (self.scenes[self.currentScene].name
+                          if self.currentScene is not None else None),
+                'scenes': [scene.name for scene in self.scenes],
+                'rows': [rowElement.describe() for rowElement in rows],
+                'resources': self.resourceUse()}
+
+    """How many MIDI clients and ports the rig's using. In process 
+    routing mode, output ports live in the routing processes, so they
+    aren't counted here.
+    """
+    def resourceUse(self):
+        inputs = [rows.inport for rows in self.rowlist
+                  if rows.inport is not None]
+        return {'inputs': len(inputs),
+                'connected': sum(1 for port in inputs
+                                 if port.is_port_open()),
+                'outputs': self.workers.outputs.stats()}
+
+    """Everything a standby needs to take over from us. Called from the
+    mirror's thread.
+    """
+    def mirrorSnapshot(self):
+        return {'panic': self.panicCC,
+                'rows': [rows.snapshot() for rows in list(self.rowlist)]}
+
+    """A standby took over while we were stuck (see standby.py). Let go
+    of every row's ports, so there's only one of each routing.
+    """
+    def standAside(self):
+        for rows in self.rowlist:
+            self.workers.detach(rows)
+            for port in (rows.inport, rows.outport):
+                if port is not None:
+                    try:
+                        closePort(port)
+                    except:
+                        exc_type, exc_obj, exc_tb = sys.exc_info()
+                        logging.warning(exc_type.__name__ + ': ' +
+                                        str(exc_obj) +
+                                        ": Couldn't close row's port")
+            rows.inport = None
+            rows.outport = None
+            rows.gui_led['bg'] = RED
+            rows.errmsg = 'The standby took over this row'
+        self.updateErrorMessage()
+
+    """Stop every note on every row (see panic.py). The messages go
+    out on the PanicButton's thread, so this is safe to call from
+    anywhere, MIDI callbacks included.
+    """
+    def panic(self, *args):
+        self.panicButton.press()
+
+    """Every row's output, and the notes held on it. Called from the
+    PanicButton's thread.
+    """
+    def panicTargets(self):
+        targets = []
+        for rows in list(self.rowlist):
+            outport = rows.outport
+            if outport is not None:
+                targets.append((outport.send_message, rows.notes))
+        return targets
+
+    """Read the panic CC from the save file's root element.
+    """
+    def readPanicCC(self, root):
+        panic = root.get('panic', '')
+        if panic.isdigit() and int(panic) < 128:
+            return int(panic)
+        return PANIC_CC
+    
+    """Switch every row over to a scene.
+    
+    The scene's routing tables and each row's dispatch functions were 
+    compiled ahead of time, so all that happens here is each row getting
+    handed its table. Each row takes it on its own routing thread, if it
+    has one, since a scene change usually comes in on some other row's.
+    Widgets and the save file are caught up afterwards, on the UI side.
+    
+    Arguments:
+    index -- The scene's position in the setlist
+    scenes -- The SceneBook to take it from. Defaults to the current one.
+    fromUI -- Whether we're already on the UI side, in which case the
+        rows switch right here, in step with whatever else the UI's
+        changing (e.g. the rest of a control batch), and the widgets
+        and save file are caught up right away
+    """
+    def activateScene(self, index, scenes=None, fromUI=False):
+        if scenes is None:
+            scenes = self.scenes
+        scene = scenes[index]
+        for rows, routing in zip(list(self.rowlist), scene.table):
+            if routing is None:
+                continue
+            onRoutingThread = rows.state.onRoutingThread
+            if fromUI or onRoutingThread is None:
+                rows.switchRouting(routing, index, scenes)
+            else:
+                onRoutingThread(rows.switchRouting, routing, index, scenes)
+        self.currentScene = index
+        logging.info('Activated scene ' + scene.name)
+        if fromUI:
+            self.onSceneActivated(scene, index)
+        else:
+            self.postToUI(self.onSceneActivated, scene, index)
+    
+    """UI half of a scene change: update widgets and save.
+    """
+    def onSceneActivated(self, scene, index):
+        for rows, sceneRow in zip(self.rowlist, scene.rows):
+            if sceneRow is not None:
+                rows.applySceneRow(sceneRow)
+        scenesElement = self.myXML.find('scenes')
+        if scenesElement is not None:
+            self.store.set(scenesElement, 'cur', str(index))
+        self.gui_scene['text'] = 'Scene: ' + scene.name
+        self.saveFile()
+        self.updateErrorMessage()
+    
+    """Save the rig's current settings as a new scene at the end of 
+    the setlist.
+    """
+    def saveScene(self, *args):
+        name = simpledialog.askstring('Save Scene', 'Scene name:', 
+                                      parent=self.master)
+        if name is None or name.strip() == '':
+            return
+        scene = Scene(name.strip(), [rows.sceneRow() 
+                                     for rows in self.rowlist])
+        self.setScenes(self.scenes.withScene(scene))
+        self.currentScene = len(self.scenes) - 1
+        self.gui_scene['text'] = 'Scene: ' + scene.name
+        self.writeScenes()
+    
+    """Remove the current scene from the setlist, but ask nicely
+    """
+    def deleteScene(self, *args):
+        if self.currentScene is None:
+            return
+        scene = self.scenes[self.currentScene]
+        if messagebox.askokcancel('', 'Are you sure you want to delete the scene "' + scene.name + '"? This cannot be undone.'):
+            self.setScenes(self.scenes.withoutScene(self.currentScene))
+            self.currentScene = None
+            self.gui_scene['text'] = ''
+            self.writeScenes()
+    
+    """Go to the next scene in the setlist
+    """
+    def nextScene(self, *args):
+        if len(self.scenes) == 0:
+            return
+        if self.currentScene is None:
+            self.activateScene(0)
+        elif self.currentScene + 1 < len(self.scenes):
+            self.activateScene(self.currentScene + 1)
+            
+    """Go to the previous scene in the setlist
+    """
+    def previousScene(self, *args):
+        if self.currentScene is not None and self.currentScene > 0:
+            self.activateScene(self.currentScene - 1)
+    
+    """Swap in a new setlist and update the menu to match.
+    """
+    def setScenes(self, scenes):
+        self.scenes = scenes
+        # Scene changes are baked into the rows' dispatch functions, so
+        # those all need compiling again.
+        for rows in self.rowlist:
+            rows.publishRouting()
+            rows.precompileScenes(scenes)
+        self.rebuildSceneMenu()
+    
+    """Write the setlist to the save file
+    """
+    def writeScenes(self):
+        old = self.myXML.find('scenes')
+        if old is not None:
+            self.store.remove(old)
+        self.store.added(self.scenes.toXML(self.myXML, NUM_COLS + 1,
+                                           self.currentScene))
+        self.saveFile()
+        
+    """Called from the file watcher's thread when the save file
+    changes. The reload happens on the UI side, once per burst of
+    changes.
+    """
+    def onConfigChanged(self):
+        if not self.isReloading:
+            self.isReloading = True
+            self.postToUI(self.reloadConfig)
+
+    """Bring the running rig in line with the save file, after
+    something else changed it. Only what's different gets touched.
+    """
+    def reloadConfig(self):
+        self.isReloading = False
+        # We just wrote it ourselves
+        if self.store.isOwnWrite():
+            return
+        start = perf_counter()
+        try:
+            newRoot = etree.parse(PATH_CURRENT_XML).getroot()
+        except:
+            # Probably caught halfway through being written; there'll be
+            # another change along in a moment.
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ": Couldn't reload save file")
+            return
+
+        newRows = [element for element in newRoot if element.tag == 'row']
+        for rows, element in zip(self.rowlist, newRows):
+            if not sameXML(rows.XMLElement, element):
+                rows.reloadFrom(element)
+        for element in newRows[len(self.rowlist):]:
+            self.addRow(copy.deepcopy(element))
+            if not self.isExpanded:
+                self.rowlist[-1].minimize()
+        while len(self.rowlist) > max(len(newRows), 1):
+            self.removeLastRow()
+
+        panic = self.readPanicCC(newRoot)
+        if panic != self.panicCC:
+            self.store.set(self.myXML, 'panic', newRoot.get('panic'))
+            self.panicCC = panic
+            for rows in self.rowlist:
+                rows.publishRouting()
+                rows.precompileScenes(self.scenes)
+
+        expand = newRoot.get('min') != 't'
+        if expand != self.isExpanded:
+            self.setExpand(expand)
+
+        oldScenes = self.myXML.find('scenes')
+        newScenes = newRoot.find('scenes')
+        if not sameXML(oldScenes, newScenes):
+            if oldScenes is not None:
+                self.store.remove(oldScenes)
+            if newScenes is not None:
+                newScenes = copy.deepcopy(newScenes)
+                self.myXML.append(newScenes)
+                self.store.added(newScenes)
+            self.setScenes(SceneBook.fromXML(newScenes, NUM_COLS + 1))
+            current = newScenes.get('cur', '') if newScenes is not None else ''
+            self.currentScene = (int(current) if current.isdigit() and
+                                 int(current) < len(self.scenes) else None)
+            self.gui_scene['text'] = ('Scene: ' +
+                                      self.scenes[self.currentScene].name
+                                      if self.currentScene is not None
+                                      else '')
+
+        self.saveFile()
+        self.updateErrorMessage()
+        logging.info('Reloaded save file in {0:.1f} ms'.format(
+            (perf_counter() - start) * 1000))
+
+    """Fill in the Scenes menu and bind scene hotkeys
+    """
+    def rebuildSceneMenu(self):
+        for key in self.sceneKeys:
+            self.unbind_all('<' + key + '>')
+        self.sceneKeys = []
+        
+        self.scenemenu.delete(0, END)
+        self.scenemenu.add_command(label='Save Scene...', 
+                                   command=self.saveScene)
+        self.scenemenu.add_command(label='Delete Current Scene', 
+                                   command=self.deleteScene)
+        self.scenemenu.add_separator()
+        self.scenemenu.add_command(label='Next Scene', 
+                                   command=self.nextScene, 
+                                   accelerator='Page Down')
+        self.scenemenu.add_command(label='Previous Scene', 
+                                   command=self.previousScene, 
+                                   accelerator='Page Up')
+        self.bind_all('<Next>', self.nextScene)
+        self.bind_all('<Prior>', self.previousScene)
+        if len(self.scenes) > 0:
+            self.scenemenu.add_separator()
+            
+        for index, scene in enumerate(self.scenes):
+            key = scene.key
+            if key is None and index < len(SCENE_KEYS):
+                key = SCENE_KEYS[index]
+            self.scenemenu.add_command(label=scene.name, 
+                                       command=lambda i=index: self.activateScene(i),
+                                       accelerator=key)
+            if key is not None:
+                try:
+                    self.bind_all('<' + key + '>', 
+                                  lambda event, i=index: self.activateScene(i))
+                    self.sceneKeys.append(key)
+                except TclError:
+                    logging.warning('Bad hotkey for scene ' + scene.name + 
+                                    ': ' + key)
+        
+        if self.currentScene is not None:
+            self.gui_scene['text'] = ('Scene: ' + 
+                                      self.scenes[self.currentScene].name)
+    
+    """Look for new MIDI devices. Runs every INTERVAL_CHECKNEW_MS as
+    one of the scheduler's jobs.
+    """
+    def scanDevices(self):
+        self.postToUI(self.onDevicesScanned, self.portOpener.listDevices())
+
+    """Called on the UI side with the results of a device scan. Rows
+    only catch up once the port list has stopped changing.
+    """
+    def onDevicesScanned(self, ports):
+        if self.devices.update(ports, perf_counter()):
+            self.followDevices()
+
+    """Use a port list straight away, e.g. a scan the user asked for by
+    opening a device list.
+    """
+    def applyDevices(self, ports):
+        if tuple(ports) != self.devices.ports:
+            self.devices.apply(ports)
+            self.followDevices()
+
+    """Have every row with open ports catch up with the devices.
+    """
+    def followDevices(self):
+        for rows in self.rowlist:
+            if rows.inport is not None:
+                rows.followDevices()
+        self.updateErrorMessage()
 
     """Opens a PDF help document
     
@@ -1388,6 +2815,24 @@ class App(ttk.Frame):
     def help(self, *args):
         webbrowser.open_new('file://' + getcwd() + 
                             '/' + PATH_MANUAL)
+    
+    """Show how long each row's messages are taking to get through, 
+    and how steady that is. Also goes into the log.
+    """
+    def showTiming(self, *args):
+        report = []
+        for row in self.rowlist:
+            name = row.rowName if row.rowName else 'Row ' + str(row.rowNumber)
+            summary = row.timing.summary()
+            if row.state.clock is not None:
+                summary += '\n' + row.state.clock.summary()
+            report.append(name + '\n' + summary)
+        report = '\n\n'.join(report) if report else 'No rows yet.'
+        if ROUTING_MODE == 'process':
+            report += ('\n\nRows are routed in other processes, so their '
+                       "timing isn't measured here.")
+        logging.info('Timing:\n' + report)
+        messagebox.showinfo('Timing', report)
             
     """Updates error message by checking all RowElements
     """
@@ -0,0 +1,1266 @@
+"""
+SwitchBox benchmarks
+
+Measures the parts of SwitchBox that have to be fast. None of these need
+Tk or a MIDI backend, so they can be run anywhere (apart from 'canvas',
+which needs a display and rtmidi, and says so if it can't have them):
+
+    python3 ./benchmarks.py             (runs everything)
+    python3 ./benchmarks.py dispatch    (runs just the one benchmark)
+"""
+
+import sys
+import time
+import random
+import logging
+from routing import (buildRouting, compileDispatch, genericDispatch, 
+                     MidiFilter, FILTER_PASS)
+from timing import RowTiming, LatencyStats
+from ports import PortOpener, openRowPorts
+from routing import DEFAULT_FILTER
+import standin
+import threading
+from panic import NoteTracker, PanicButton
+from voices import VoicePool, VOICES_MPE, VOICES_ROTATE
+from state import ChannelState, RowState, COL_NORMAL, COL_PAD
+import tracemalloc
+import os
+import subprocess
+import tempfile
+from lxml import etree
+from config import readConfig
+import socket
+import select
+import statistics
+from netmidi import NetMidiIn, NetMidiOut, packBatch
+import signal
+from standby import MirrorServer, Standby
+from concurrent.futures import ThreadPoolExecutor
+from scheduler import Scheduler, PRIORITY_HIGH, PRIORITY_LOW
+from outputs import OutputManager
+from ports import openOutPort, renameOutPort, closePort
+from soak import residentMemory
+from quantize import (Quantize, QUANTIZE_BEAT, QUANTIZE_BAR,
+                      TICKS_PER_BEAT, GRACE_TICKS)
+from workers import RoutingWorkers
+
+# How many messages to push through each dispatcher
+DISPATCH_MESSAGES = 200000
+
+# Size of each SysEx message, and how many in a burst
+SYSEX_BYTES = 64 * 1024
+SYSEX_BURST = 16
+
+# Notes played in the timing benchmark, how far apart (seconds), and 
+# the fixed latency to compare against (seconds)
+TIMING_NOTES = 400
+TIMING_SPACING_S = 0.0025
+TIMING_FIXED_S = 0.004
+
+# Rows in the startup benchmark, how many threads open them, and how 
+# slow the stand-in backend's calls are (seconds)
+STARTUP_ROWS = 50
+STARTUP_THREADS = 4
+STARTUP_DELAYS_S = {'client': 0.002, 'scan': 0.03, 'open': 0.01,
+                    'virtual': 0.005, 'close': 0.0}
+
+"""Stands in for a RowElement as far as the dispatch functions are 
+concerned.
+"""
+class BenchRow():
+    def __init__(self):
+        self.activeChannel = 0
+
+    def onLearnReceived(self, routing, cc):
+        pass
+
+    def onTriggered(self):
+        pass
+
+    def onFaderMoved(self, channel):
+        pass
+
+    def onSceneRequested(self, index, scenes):
+        pass
+
+    def onPanicRequested(self):
+        pass
+
+    def route(self, message, delta, arrival):
+        self.dispatch(message)
+
+"""Time how long a function takes to run over a list of messages.
+
+Returns nanoseconds per message.
+"""
+def timeMessages(function, messages):
+    start = time.perf_counter()
+    for message in messages:
+        function(message)
+    return (time.perf_counter() - start) * 1e9 / len(messages)
+
+"""Make a mix of traffic that looks like somebody playing: mostly keys,
+some CCs, a bit of pitch bend.
+"""
+def playingTraffic(count):
+    messages = []
+    for n in range(count):
+        note = 36 + (n * 7) % 48
+        which = n % 10
+        if which < 6:
+            messages.append([0x90, note, 100] if which % 2 == 0
+                            else [0x80, note, 0])
+        elif which < 8:
+            messages.append([0xB0, 1, n % 128])
+        elif which == 8:
+            messages.append([0xB0, 7, n % 128])
+        else:
+            messages.append([0xE0, 0, 64])
+    return messages
+
+"""Generic vs. compiled dispatch, per message, for a few row setups.
+"""
+def benchDispatch():
+    messages = playingTraffic(DISPATCH_MESSAGES)
+    setups = [
+        ('bare row', buildRouting(())),
+        ('triggers only', buildRouting([(n, 20 + n, None)
+                                        for n in range(9)])),
+        ('triggers+faders+pad', buildRouting(
+            [(n, 20 + n, 40 + n) for n in range(9)] + [(9, None, 7)],
+            padchannel=10)),
+        ('everything+splits', buildRouting(
+            [(n, 20 + n, 40 + n) for n in range(9)] + [(9, None, 7)],
+            padchannel=10, splits=[(0, 47, 8)])),
+    ]
+    print('Dispatch, ns/message (%d messages)' % len(messages))
+    print('%-22s %10s %10s %8s' % ('setup', 'generic', 'compiled',
+                                   'speedup'))
+    for name, routing in setups:
+        sent = []
+        row = BenchRow()
+        generic = timeMessages(genericDispatch(routing, row, sent.append),
+                               messages)
+        sent = []
+        row = BenchRow()
+        compiled = timeMessages(compileDispatch(routing, row, sent.append),
+                                messages)
+        print('%-22s %10.0f %10.0f %7.2fx' % (name, generic, compiled,
+                                             generic / compiled))
+
+"""The MIDI callback the way it used to be, before routing tables and 
+compiled dispatch, minus the Tk bits. Only here to compare against.
+"""
+def legacyDispatch(row, send, padchannel=None):
+    def onReceived(*args):
+        logging.info('Callback called, received: ' + str(args))
+        signalIn = args[0][0]
+        channel = signalIn[0] - ((signalIn[0] >> 4) << 4)
+        data = [signalIn[0] >> 4] + signalIn[1:]
+        logging.info('First Nibble: ' + str(data[0]))
+        logging.info('Channel: ' + str(channel))
+        if (channel + 1) == padchannel:
+            logging.info('Pad channel, Skipping')
+        elif data[0] == 0b1011:
+            data[0] = (data[0] << 4) + row.activeChannel
+            send(data)
+        elif data[0] == 0b1000 or data[0] == 0b1001:
+            data[0] = (data[0] << 4) + row.activeChannel
+            logging.info('data out: ' + str(data))
+            send(data)
+        else:
+            logging.info('Other MIDI Message')
+            send(signalIn)
+    return lambda message: onReceived((message, 0.0), None)
+
+"""SysEx bursts (e.g. a librarian sending patch dumps) through the old
+callback, the generic dispatcher and the compiled one.
+"""
+def benchSysex():
+    sysex = [0xF0] + [n % 128 for n in range(SYSEX_BYTES - 2)] + [0xF7]
+    # A handful of bursts, each a fresh set of messages, same as rtmidi
+    # would hand us.
+    bursts = [[list(sysex) for count in range(SYSEX_BURST)]
+              for bursts in range(8)]
+    routing = buildRouting([(n, 20 + n, 40 + n) for n in range(9)],
+                           filters=MidiFilter(FILTER_PASS, FILTER_PASS,
+                                              FILTER_PASS, FILTER_PASS,
+                                              FILTER_PASS))
+    paths = [('legacy callback', lambda row, send:
+                  legacyDispatch(row, send)),
+             ('generic', lambda row, send:
+                  genericDispatch(routing, row, send)),
+             ('compiled', lambda row, send:
+                  compileDispatch(routing, row, send))]
+    print('SysEx pass-through, %d x %d KB bursts' % (SYSEX_BURST,
+                                                    SYSEX_BYTES // 1024))
+    print('%-22s %12s %10s' % ('path', 'us/message', 'MB/s'))
+    for name, make in paths:
+        sent = []
+        row = BenchRow()
+        dispatch = make(row, sent.append)
+        start = time.perf_counter()
+        for burst in bursts:
+            for message in burst:
+                dispatch(message)
+        elapsed = time.perf_counter() - start
+        count = sum(len(burst) for burst in bursts)
+        print('%-22s %12.1f %10.0f' % (name, elapsed * 1e6 / count,
+                                      count * SYSEX_BYTES / elapsed / 1e6))
+
+"""Play a steady stream of notes through a row, with the backend 
+handing them over late by a random amount (as it does on a busy 
+computer), and see how steady the output is with and without a fixed
+output latency.
+"""
+def benchTiming():
+    randomness = random.Random(32)
+    # How late each note reaches Python: usually a little, sometimes a lot
+    delays = [randomness.uniform(0, 0.0005) if randomness.random() < 0.9
+              else randomness.uniform(0.001, 0.003)
+              for n in range(TIMING_NOTES)]
+    print('Output timing, %d notes %.1f ms apart' % (
+          TIMING_NOTES, TIMING_SPACING_S * 1000))
+    print('%-22s %10s %10s %10s %6s' % ('mode', 'mean ms', 'std dev ms',
+                                       'worst ms', 'late'))
+    for name, fixedLatency in (('immediate', None),
+                               ('fixed %.0f ms' % (TIMING_FIXED_S * 1000),
+                                TIMING_FIXED_S)):
+        timing = RowTiming(fixedLatency)
+        played = []
+        sentAt = []
+
+        def send(message):
+            sentAt.append(time.perf_counter())
+        dispatch = compileDispatch(buildRouting([]), BenchRow(),
+                                   timing.wrap(send))
+        start = time.perf_counter() + 0.01
+        for n in range(TIMING_NOTES):
+            playedAt = start + n * TIMING_SPACING_S
+            played.append(playedAt)
+            arrival = playedAt + delays[n]
+            while time.perf_counter() < arrival:
+                time.sleep(0)
+            timing.arrived(TIMING_SPACING_S if n else 0.0,
+                           time.perf_counter())
+            dispatch([0x90, 36 + n % 48, 100])
+        # Wait for anything still scheduled
+        time.sleep((fixedLatency or 0) + 0.05)
+        output = LatencyStats()
+        for playedAt, sent in zip(played, sentAt):
+            output.add(sent - playedAt)
+        print('%-22s %10.3f %10.3f %10.3f %6d' % (
+              name, output.mean * 1000, output.deviation() * 1000,
+              output.worst * 1000, timing.late))
+
+"""Open the ports for a save file's worth of rows, one row after 
+another like SwitchBox used to, then on a PortOpener. Uses the stand-in
+backend, slowed down to about what a busy USB hub is like.
+"""
+def benchStartup():
+    standin.DELAYS_S.update(STARTUP_DELAYS_S)
+    standin.devices[:] = ['Keyboard %d' % n for n in range(STARTUP_ROWS)]
+    names = ['Row %d (SwitchBox)' % n for n in range(STARTUP_ROWS)]
+    print('Opening ports for %d rows' % STARTUP_ROWS)
+    print('%-22s %14s %14s' % ('how', 'first row ms', 'all rows ms'))
+
+    start = time.perf_counter()
+    first = None
+    opened = []
+    for n, name in enumerate(names):
+        opened.append(openRowPorts(standin, standin.MidiOut, name,
+                                   standin.devices[n], None,
+                                   DEFAULT_FILTER))
+        if first is None:
+            first = time.perf_counter() - start
+    serial = time.perf_counter() - start
+    print('%-22s %14.1f %14.1f' % ('one at a time', first * 1000,
+                                   serial * 1000))
+    for ports in opened:
+        ports.inport.delete()
+        ports.outport.delete()
+
+    opener = PortOpener(standin, STARTUP_THREADS)
+    done = threading.Event()
+    times = []
+    opened = []
+
+    def onOpened(ports):
+        times.append(time.perf_counter() - start)
+        opened.append(ports)
+        if len(times) == STARTUP_ROWS:
+            done.set()
+    start = time.perf_counter()
+    for n, name in enumerate(names):
+        opener.open(standin.MidiOut, name, standin.devices[n], None,
+                    DEFAULT_FILTER, onOpened)
+    queued = time.perf_counter() - start
+    done.wait()
+    opener.stop()
+    print('%-22s %14.1f %14.1f' % ('%d threads' % STARTUP_THREADS,
+                                   min(times) * 1000, max(times) * 1000))
+    print('(window blocked for %.1f ms while queueing)' % (queued * 1000))
+    failed = [ports.error for ports in opened if ports.device is None]
+    if failed:
+        print('%d rows failed to reconnect: %s' % (len(failed), failed[0]))
+    for ports in opened:
+        ports.inport.delete()
+        ports.outport.delete()
+    standin.DELAYS_S.update(dict.fromkeys(standin.DELAYS_S, 0.0))
+
+# Rows in the panic benchmark, the channels each one's been playing
+# on, how many notes are held on each, and how many panics to time
+PANIC_ROWS = 10
+PANIC_CHANNELS = 9
+PANIC_HELD = 16
+PANIC_RUNS = 200
+
+"""Panic on a rig with notes held on every row, against the brute
+force way: a Note Off for every note on every channel, then the
+channel resets. Sent to the stand-in backend, so this is SwitchBox's
+side of it only.
+"""
+def benchPanic():
+    outports = []
+    trackers = []
+    for n in range(PANIC_ROWS):
+        outport = standin.MidiOut()
+        outport.open_virtual_port('Row %d (SwitchBox)' % n)
+        outports.append(outport)
+        trackers.append(NoteTracker())
+    sends = [tracker.wrap(outport.send_message)
+             for outport, tracker in zip(outports, trackers)]
+    button = PanicButton(lambda: [(outport.send_message, tracker)
+                                  for outport, tracker
+                                  in zip(outports, trackers)])
+
+    def holdNotes():
+        for send in sends:
+            for note in range(PANIC_HELD):
+                send([0x90 | (note % PANIC_CHANNELS), 48 + note, 100])
+
+    times = []
+    for run in range(PANIC_RUNS):
+        holdNotes()
+        sent, elapsed = button.fire()
+        times.append(elapsed)
+    button.stop()
+    times.sort()
+
+    bruteTimes = []
+    for run in range(PANIC_RUNS):
+        start = time.perf_counter()
+        bruteSent = 0
+        for outport in outports:
+            for channel in range(16):
+                for note in range(128):
+                    outport.send_message([0x80 | channel, note, 0])
+                for controller in (123, 120, 121):
+                    outport.send_message([0xB0 | channel, controller, 0])
+                bruteSent += 128 + 3
+        bruteTimes.append(time.perf_counter() - start)
+    bruteTimes.sort()
+
+    print('Panic, %d rows with %d notes held on %d channels each' %
+          (PANIC_ROWS, PANIC_HELD, PANIC_CHANNELS))
+    print('%-22s %10s %12s %12s' % ('how', 'messages', 'median ms',
+                                    'worst ms'))
+    print('%-22s %10d %12.3f %12.3f' % ('brute force', bruteSent,
+                                        bruteTimes[len(bruteTimes) // 2]
+                                        * 1000, bruteTimes[-1] * 1000))
+    print('%-22s %10d %12.3f %12.3f' % ('tracked', sent,
+                                        times[len(times) // 2] * 1000,
+                                        times[-1] * 1000))
+    for outport in outports:
+        outport.delete()
+
+# Notes played in the voice benchmark, and how many bend/pressure
+# messages come with each one
+VOICE_NOTES = 100000
+VOICE_EXPRESSION = 4
+
+"""A stream of MPE-style playing: each note on its own input channel,
+with pitch bend and pressure on that channel while it's held, and up
+to ten notes held at once.
+"""
+def mpeTraffic(count):
+    randomness = random.Random(40)
+    messages = []
+    held = []
+    for n in range(count):
+        if len(held) == 10 or (held and randomness.random() < 0.5):
+            channel, note = held.pop(randomness.randrange(len(held)))
+            messages.append([0x80 | channel, note, 0])
+        channel = 1 + n % 15
+        note = randomness.randrange(36, 96)
+        messages.append([0x90 | channel, note, 100])
+        held.append((channel, note))
+        for m in range(VOICE_EXPRESSION):
+            messages.append([0xE0 | channel, 0, 64 + m])
+            messages.append([0xD0 | channel, 100 - m])
+    for channel, note in held:
+        messages.append([0x80 | channel, note, 0])
+    return messages
+
+"""Rows with a voice pool, against one that sends everything to the
+active channel.
+"""
+def benchVoices():
+    messages = mpeTraffic(VOICE_NOTES)
+    setups = [('active channel', None),
+              ('mpe pool 2-16', VoicePool(1, 15, VOICES_MPE)),
+              ('mpe pool 2-5', VoicePool(1, 4, VOICES_MPE)),
+              ('rotate pool 1-4', VoicePool(0, 3, VOICES_ROTATE))]
+    print('Voice allocation, %d notes (%d messages)' % (VOICE_NOTES,
+                                                        len(messages)))
+    print('%-22s %10s %10s %14s' % ('setup', 'generic', 'compiled',
+                                    'notes/second'))
+    for name, pool in setups:
+        routing = buildRouting((), voices=pool,
+                               filters=DEFAULT_FILTER._replace(
+                                   at=FILTER_PASS))
+        times = []
+        for dispatch in (genericDispatch, compileDispatch):
+            sent = []
+            function = dispatch(routing, BenchRow(), sent.append)
+            times.append(timeMessages(function, [list(message)
+                                                 for message in messages]))
+        # Each note comes with its Note Off and its bends and pressure
+        perNote = times[1] * len(messages) / VOICE_NOTES
+        print('%-22s %10.0f %10.0f %14.0f' % (name, times[0], times[1],
+                                              1e9 / perNote))
+
+# Rows in the state benchmark (each with ten channels), and how many
+# times to read through all of them
+STATE_ROWS = 100
+STATE_PASSES = 200
+
+"""How a ColumnElement kept its settings before state.py: as ordinary
+attributes, in the same dictionary as all of its widgets. The widgets
+are stand-ins, since there's no Tk here; it's their slots in the
+dictionary that count.
+"""
+class LegacyColumn():
+    def __init__(self, channel, widget):
+        self.callback = widget
+        self.channel = channel
+        self.fader = None
+        self.trigger = None
+        self.padchannel = None
+        self.listening = False
+        self.isActive = False
+        self.isDisabled = False
+        self.errmsg = None
+        self.blinking = False
+        for name in ('container', 'bottomside', 'rightside', 'faderbuttons',
+                     'triggerbuttons', 'gui_channellabel', 'gui_led',
+                     'gui_faderlabel', 'gui_fadervalue', 'gui_faderlisten',
+                     'gui_faderclear', 'gui_padchannel', 'gui_triggerlabel',
+                     'gui_triggervalue', 'gui_triggerlisten',
+                     'gui_triggerclear', 'minimizeableElements'):
+            setattr(self, name, widget)
+        self.type = 0
+
+"""Memory used by the channels' settings, and how fast the engine can
+read them (building every row's bindings, as publishRouting does) and
+the active channel (as the MIDI path does), for a rig with hundreds of
+channels: the old way against state.py's.
+"""
+def benchState():
+    widget = object()
+    channels = STATE_ROWS * 10
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    legacy = [[LegacyColumn(n + 1, widget) for n in range(10)]
+              for row in range(STATE_ROWS)]
+    legacyBytes = tracemalloc.get_traced_memory()[0] - before
+    before = tracemalloc.get_traced_memory()[0]
+    rows = []
+    for row in range(STATE_ROWS):
+        state = RowState(BenchRow())
+        state.channels = [ChannelState(n + 1, 0) for n in range(10)]
+        rows.append(state)
+    slottedBytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for run in range(STATE_PASSES):
+        for columns in legacy:
+            tuple((column.channel - 1, column.trigger, column.fader)
+                  for column in columns)
+    legacyRead = (time.perf_counter() - start) / (STATE_PASSES * channels)
+    start = time.perf_counter()
+    for run in range(STATE_PASSES):
+        for state in rows:
+            state.bindings()
+    slottedRead = (time.perf_counter() - start) / (STATE_PASSES * channels)
+
+    # The MIDI path reads and writes the active channel on every message
+    legacyRow = BenchRow()
+    legacyRow.__dict__.update(('widget%d' % n, widget) for n in range(40))
+    timings = []
+    for row in (legacyRow, rows[0]):
+        start = time.perf_counter()
+        for n in range(DISPATCH_MESSAGES):
+            row.activeChannel = row.activeChannel
+        timings.append((time.perf_counter() - start) * 1e9 /
+                       DISPATCH_MESSAGES)
+
+    print('State for %d channels (%d rows)' % (channels, STATE_ROWS))
+    print('%-22s %14s %14s %16s' % ('how', 'bytes/channel', 'ns/binding',
+                                    'ns/activeChannel'))
+    print('%-22s %14.0f %14.0f %16.1f' % ('attributes on widgets',
+                                          legacyBytes / channels,
+                                          legacyRead * 1e9, timings[0]))
+    print('%-22s %14.0f %14.0f %16.1f' % ('__slots__ state',
+                                          slottedBytes / channels,
+                                          slottedRead * 1e9, timings[1]))
+
+# Rows in each generated save file, channels per row (the pad channel's
+# one more), and how many times to time each load
+LOAD_ROWS = (10, 100, 1000, 5000)
+LOAD_COLS = 10
+LOAD_RUNS = 5
+
+"""Write a save file with the given number of rows, every channel bound,
+and a scene with a copy of each row (so there are rows that aren't the
+root's too).
+"""
+def makeConfig(path, rows):
+    root = etree.Element('swr')
+    scene = etree.Element('scene', name='Everything')
+    for row in range(rows):
+        element = etree.SubElement(root, 'row', name='Row %d' % row,
+                                   dev='Keyboard %d' % row, ord='1')
+        for channel in range(LOAD_COLS + 1):
+            attributes = {'chan': str(channel + 1), 'f': str(channel + 20)}
+            if channel < LOAD_COLS:
+                attributes['t'] = str(channel + 40)
+            else:
+                attributes['pad'] = '10'
+            etree.SubElement(element, 'ch', attributes)
+        etree.SubElement(element, 'split', lo='0', hi='47', chan='2')
+        etree.SubElement(element, 'filter', clock='pass', at='drop')
+        copied = etree.SubElement(scene, 'row')
+        copied.extend(etree.fromstring(etree.tostring(child))
+                      for child in element if child.tag == 'ch')
+    etree.SubElement(root, 'scenes').append(scene)
+    etree.ElementTree(root).write(path, xml_declaration=True,
+                                  encoding='UTF-8')
+
+"""A row's channels, ready to be filled in from a save file.
+"""
+def loadChannels(num_cols):
+    return [ChannelState(n + 1, COL_PAD if n == num_cols - 1
+                         else COL_NORMAL) for n in range(num_cols)]
+
+"""Load a save file the way App.readState used to, before readConfig:
+parse the whole tree, then for every row, find its position with
+root.index() (which is what it was numbered by) and walk its XML
+element filling in each channel.
+"""
+def legacyLoad(path, num_cols):
+    tree = etree.ElementTree(file=path)
+    rows = []
+    for element in tree.getroot():
+        if element.tag != 'row':
+            continue
+        number = tree.getroot().index(element)
+        channels = loadChannels(num_cols)
+        padchannel = None
+        for cols in element:
+            attr = cols.attrib
+            chan = attr.get('chan')
+            trig = attr.get('t')
+            fade = attr.get('f')
+            pad = attr.get('pad')
+            if (chan is not None and chan.isdigit() and
+                    int(chan) - 1 in range(num_cols)):
+                thisChannel = channels[int(chan) - 1]
+                if fade is not None and fade.isdigit():
+                    thisChannel.fader = int(fade)
+                if (trig is not None and trig.isdigit() and
+                        thisChannel.type != COL_PAD):
+                    thisChannel.trigger = int(trig)
+                if (thisChannel.type == COL_PAD and
+                        pad is not None and pad.isdigit()):
+                    padchannel = int(pad)
+                    thisChannel.padchannel = int(pad)
+        rows.append((number, channels, padchannel))
+    return tree, rows
+
+"""Load a save file the way SwitchBox does now: readConfig, then each
+row's channels filled in from its RowConfig, like RowElement does.
+"""
+def currentLoad(path, num_cols):
+    tree, configs = readConfig(path, num_cols)
+    rows = []
+    for number, config in enumerate(configs):
+        channels = loadChannels(num_cols)
+        for channel, trigger, fader in config.bindings:
+            if fader is not None:
+                channels[channel].fader = fader
+            if trigger is not None:
+                channels[channel].trigger = trigger
+        if config.padchannel is not None:
+            channels[-1].padchannel = config.padchannel
+        rows.append((number, channels, config.padchannel))
+    return tree, rows
+
+LOADERS = {'readState': legacyLoad, 'readConfig': currentLoad}
+
+"""How much a load grows the process's peak memory, in KB. Run in a
+process of its own, since lxml's memory doesn't show up in tracemalloc
+and a process's peak never goes back down. None if we can't tell.
+"""
+def loadMemory(how, path):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__),
+                             '--load-memory', how, path],
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        return float(result.stdout)
+    except ValueError:
+        return None
+
+"""This process's peak memory so far, in KB, or None if we can't tell.
+
+Linux hands a new process its parent's peak in getrusage (which would
+hide anything smaller), so ask /proc there.
+"""
+def peakMemory():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS counts in bytes, everybody else in KB
+    return peak / 1024 if sys.platform == 'darwin' else peak
+
+"""The other end of loadMemory.
+"""
+def measureLoadMemory(how, path):
+    before = peakMemory()
+    loaded = LOADERS[how](path, LOAD_COLS + 1)
+    after = peakMemory()
+    if before is not None:
+        print(after - before)
+
+"""Load-to-ready time and peak memory for save files from 10 to 1000
+rows (and 5000, to show where root.index() starts to tell): the old
+App.readState way, with a root.index() for every row, against
+readConfig. Both end with every row's channels filled in.
+"""
+def benchLoad():
+    print('Loading save files with %d channels a row' % LOAD_COLS)
+    print('%-6s %-12s %12s %14s' % ('rows', 'how', 'ms to ready',
+                                    'peak KB added'))
+    directory = tempfile.mkdtemp()
+    try:
+        for rows in LOAD_ROWS:
+            path = os.path.join(directory, 'rows%d.xml' % rows)
+            makeConfig(path, rows)
+            for how, loader in LOADERS.items():
+                timings = []
+                for run in range(LOAD_RUNS):
+                    start = time.perf_counter()
+                    loader(path, LOAD_COLS + 1)
+                    timings.append(time.perf_counter() - start)
+                memory = loadMemory(how, path)
+                print('%-6d %-12s %12.2f %14s' % (
+                    rows, how, sorted(timings)[LOAD_RUNS // 2] * 1000,
+                    'n/a' if memory is None else '%.0f' % memory))
+            os.remove(path)
+    finally:
+        os.rmdir(directory)
+
+# Where the network benchmark's stand-in peer listens, the batching
+# windows to try (seconds), how many messages to blast through, and how
+# many to send one at a time for latency, how far apart (seconds)
+NET_ADDRESS = ('127.0.0.1', 47990)
+NET_LATENCIES_S = (0.0, 0.001, 0.004)
+NET_MESSAGES = 20000
+NET_NOTES = 400
+NET_SPACING_S = 0.001
+
+"""Wait (up to a second) for a NetMidiIn to have heard everything.
+"""
+def waitForNet(received, count):
+    deadline = time.perf_counter() + 1.0
+    while len(received) < count and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+"""Network MIDI over localhost, to a NetMidiIn standing in for the
+machine on the other end: throughput and datagrams used with messages
+sent as fast as possible, then how late notes played one at a time
+arrive, for a few batching windows. Then a check that the peer counts
+datagrams that go missing.
+"""
+def benchNet():
+    peer = NetMidiIn(NET_ADDRESS)
+    peer.open_port(0)
+    received = []
+    peer.set_callback(lambda event, data: received.append(
+        (time.perf_counter(), event[0])))
+    traffic = playingTraffic(NET_MESSAGES)
+
+    print('Network MIDI to a peer on localhost')
+    print('%-10s %12s %10s %8s %12s %12s' % ('window ms', 'msgs/s',
+                                             'datagrams', 'lost',
+                                             'median ms', 'p99 ms'))
+    for latency in NET_LATENCIES_S:
+        port = NetMidiOut(NET_ADDRESS, latency)
+        port.open_virtual_port('Bench')
+        del received[:]
+        lost = peer.lost
+        start = time.perf_counter()
+        for message in traffic:
+            port.send_message(message)
+        waitForNet(received, NET_MESSAGES)
+        rate = len(received) / (received[-1][0] - start) if received else 0
+        datagrams = port.datagrams
+
+        # One at a time, with the note number and velocity saying which
+        del received[:]
+        sent = []
+        for n in range(NET_NOTES):
+            sent.append(time.perf_counter())
+            port.send_message([0x90, n & 0x7F, n >> 7])
+            time.sleep(NET_SPACING_S)
+        waitForNet(received, NET_NOTES)
+        delays = sorted((arrived - sent[message[1] | message[2] << 7]) * 1000
+                        for arrived, message in received)
+        port.close_port()
+        print('%-10g %12.0f %10d %8d %12.3f %12.3f' % (
+            latency * 1000, rate, datagrams, peer.lost - lost,
+            statistics.median(delays) if delays else 0,
+            delays[int(len(delays) * 0.99)] if delays else 0))
+
+    # A sender that drops every tenth datagram on the floor. (The peer
+    # says so each time; it doesn't need to here.)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    lost = peer.lost
+    dropped = 0
+    logging.disable(logging.WARNING)
+    for sequence in range(1000):
+        if sequence % 10 == 5:
+            dropped += 1
+            continue
+        sender.sendto(packBatch(sequence, [bytes([0xF8])]), NET_ADDRESS)
+    time.sleep(0.05)
+    logging.disable(logging.NOTSET)
+    sender.close()
+    print('Dropped %d of 1000 datagrams; the peer counted %d missing' %
+          (dropped, peer.lost - lost))
+    peer.close_port()
+    if peer.lost - lost != dropped:
+        return ['net: dropped %d datagrams, but the peer counted %d' % (
+            dropped, peer.lost - lost)]
+
+# Rows the primary has in the failover benchmark
+FAILOVER_ROWS = 20
+
+"""A primary's snapshot, with every row on its own channel and holding
+a note there.
+"""
+def failoverSnapshot():
+    rows = []
+    for n in range(FAILOVER_ROWS):
+        active = n % 9
+        rows.append({'name': 'Row %d' % n, 'dev': 'Keyboard %d' % n,
+                     'ord': None,
+                     'bindings': [(channel, 20 + channel, 40 + channel)
+                                  for channel in range(9)] + [(9, None, 50)],
+                     'pad': 10, 'splits': [], 'filters': list(DEFAULT_FILTER),
+                     'voices': None, 'active': active,
+                     'held': [active << 7 | 60]})
+    return {'panic': None, 'rows': rows}
+
+"""Be a primary, until killed. Run in a process of its own by
+benchFailover. Says so if a standby fences it off.
+"""
+def runPrimary(address):
+    def onFenced():
+        print('fenced')
+        sys.stdout.flush()
+    mirror = MirrorServer(address, failoverSnapshot, onFenced)
+    print('ready')
+    sys.stdout.flush()
+    threading.Event().wait()
+
+# How long the primary's stopped for in the failover benchmark's stall:
+# a whole-file parse of a big rig takes about this long
+FAILOVER_STALL_S = 0.1
+
+"""A standby taking over from a primary that's killed, or that hangs
+(stopped with SIGSTOP), timed from the moment it happens to every
+row's ports being open on the stand-in backend. Then a check that the
+standby routes like the primary was, and that a hung primary closes
+its ports when it comes back. A primary that only stalls for a moment
+shouldn't be taken over from at all, and a standby that's stopped
+should leave no backend clients behind. Any of that going wrong fails
+the run.
+"""
+def benchFailover():
+    standin.devices[:] = ['Keyboard %d' % n for n in range(FAILOVER_ROWS)]
+    clients = standin.counts['clients']
+    ways = [('killed', signal.SIGKILL if hasattr(signal, 'SIGKILL')
+             else signal.SIGTERM)]
+    if hasattr(signal, 'SIGSTOP'):
+        ways.insert(0, ('stalled', signal.SIGSTOP))
+        ways.append(('hung', signal.SIGSTOP))
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'mirror.sock')
+    print('Standby taking over %d rows' % FAILOVER_ROWS)
+    print('%-10s %16s %10s %14s' % ('primary', 'ms to take over', 'routing',
+                                    'then primary'))
+    failures = []
+    try:
+        for how, which in ways:
+            primary = subprocess.Popen([sys.executable,
+                                        os.path.abspath(__file__),
+                                        '--mirror-primary', address],
+                                       stdout=subprocess.PIPE,
+                                       universal_newlines=True)
+            primary.stdout.readline()
+            standby = Standby(standin, address)
+            follower = threading.Thread(target=standby.run, daemon=True)
+            follower.start()
+            standby.following.wait(5)
+
+            start = time.perf_counter()
+            os.kill(primary.pid, which)
+            if how == 'stalled':
+                time.sleep(FAILOVER_STALL_S)
+                os.kill(primary.pid, signal.SIGCONT)
+                tookOver = standby.tookOver.wait(0.5)
+                print('%-10s %16s %10s %14s' % (
+                    how, 'took over' if tookOver else 'no', '-',
+                    'carried on'))
+                if tookOver:
+                    failures.append('failover: standby took over from a '
+                                    'primary stalled for %g ms' % (
+                                        FAILOVER_STALL_S * 1000))
+            else:
+                tookOver = standby.tookOver.wait(5)
+                elapsed = time.perf_counter() - start
+                then = 'gone'
+                if which == getattr(signal, 'SIGSTOP', None):
+                    # Back from the dead; it should see it's been fenced
+                    # off and say so
+                    os.kill(primary.pid, signal.SIGCONT)
+                    said = select.select([primary.stdout], [], [], 2)[0]
+                    fenced = bool(said) and \
+                        primary.stdout.readline().strip() == 'fenced'
+                    then = 'stood aside' if fenced else 'STILL ROUTING'
+                    if tookOver and not fenced:
+                        failures.append('failover: hung primary carried '
+                                        'on after the standby took over')
+                if not tookOver:
+                    print('%-10s %16s %10s %14s' % (how, 'never', '-', then))
+                    failures.append('failover: standby never took over '
+                                    'from a %s primary' % how)
+                else:
+                    # A key on the first row should go to its active
+                    # channel, and the note it left held should still be
+                    # known about
+                    row = standby.rows[0]
+                    row.inport.play([0x90, 64, 100])
+                    active = standby.snapshot['rows'][0]['active']
+                    routed = (row.outport.lastSent ==
+                              [0x90 | active, 64, 100] and
+                              (active << 7 | 60) in row.notes.held)
+                    print('%-10s %16.1f %10s %14s' % (
+                        how, elapsed * 1000, 'ok' if routed else 'WRONG',
+                        then))
+                    if len(standby.rows) != FAILOVER_ROWS:
+                        failures.append('failover: took over %d of %d rows '
+                                        'from a %s primary' % (
+                                            len(standby.rows),
+                                            FAILOVER_ROWS, how))
+                    if not routed:
+                        failures.append('failover: standby routed '
+                                        'differently from a %s primary' %
+                                        how)
+            standby.stop()
+            primary.kill()
+            primary.wait()
+            if os.path.exists(address):
+                os.remove(address)
+    finally:
+        os.rmdir(directory)
+    standin.devices[:] = []
+    if standin.counts['clients'] != clients:
+        failures.append('failover: %d backend clients left behind' % (
+            standin.counts['clients'] - clients))
+    return failures
+
+# How long the scheduler benchmark runs (seconds), how often it asks
+# for a device scan and a save, and how long a (slow) scan takes
+SCHEDULE_RUN_S = 2.0
+SCHEDULE_SCAN_EVERY_S = 0.5
+SCHEDULE_SAVE_EVERY_S = 0.02
+SCHEDULE_SCAN_S = 0.3
+SCHEDULE_SAVE_S = 0.001
+
+"""How long saves take to happen while slow device scans are going on:
+everything one after another, the way it was on Tk's timer, against
+the Scheduler with saves at a higher priority.
+"""
+def benchScheduler():
+    def scan():
+        time.sleep(SCHEDULE_SCAN_S)
+
+    def save():
+        time.sleep(SCHEDULE_SAVE_S)
+
+    serial = ThreadPoolExecutor(max_workers=1)
+    scheduler = Scheduler(2)
+    ways = [('one after another', lambda function, priority:
+             serial.submit(function)),
+            ('scheduler', lambda function, priority:
+             scheduler.submit(function, priority=priority))]
+    print('Saves every %g ms, %g ms device scans every %g ms' % (
+        SCHEDULE_SAVE_EVERY_S * 1000, SCHEDULE_SCAN_S * 1000,
+        SCHEDULE_SCAN_EVERY_S * 1000))
+    print('%-22s %14s %14s' % ('how', 'median save ms', 'worst save ms'))
+    for how, submit in ways:
+        waits = []
+        start = time.perf_counter()
+        nextScan = start
+        while time.perf_counter() - start < SCHEDULE_RUN_S:
+            if time.perf_counter() >= nextScan:
+                submit(scan, PRIORITY_LOW)
+                nextScan += SCHEDULE_SCAN_EVERY_S
+            asked = time.perf_counter()
+            submit(save, PRIORITY_HIGH).add_done_callback(
+                lambda future, asked=asked: waits.append(
+                    time.perf_counter() - asked))
+            time.sleep(SCHEDULE_SAVE_EVERY_S)
+        # Let the last ones finish
+        submit(save, PRIORITY_LOW).result()
+        waits.sort()
+        print('%-22s %14.1f %14.1f' % (how, waits[len(waits) // 2] * 1000,
+                                       waits[-1] * 1000))
+    serial.shutdown()
+    scheduler.stop()
+
+# Rows in the output port benchmark, how long a name each one gets
+# typed in, and how many rows get deleted and added back
+OUTPUTS_ROWS = 30
+OUTPUTS_NAME = 'Synth pads'
+OUTPUTS_READDED = 10
+
+"""How many backend clients a rig goes through with a client for every
+port, against the OutputManager, on a backend that can rename ports
+(ALSA) and one that can't (Windows). Every row gets renamed a keystroke
+at a time, then some get deleted and added back. Then one more gets
+deleted, and a row with a new name added: that one mustn't get the
+deleted row's port, connections and all.
+"""
+def benchOutputs():
+    failures = []
+    standin.DELAYS_S.update(STARTUP_DELAYS_S)
+    print('%d rows renamed, %d deleted and added back' % (OUTPUTS_ROWS,
+                                                          OUTPUTS_READDED))
+    print('%-26s %8s %8s %8s %14s' % ('how', 'made', 'held', 'reused',
+                                      'rename ms'))
+    for api, apiName in ((standin.API_LINUX_ALSA, 'ALSA'),
+                         (standin.API_WINDOWS_MM, 'Windows')):
+        standin.api = api
+        for how in ('client per port', 'OutputManager'):
+            made = [0]
+
+            def makeClient():
+                made[0] += 1
+                return standin.MidiOut()
+            outputs = OutputManager(standin)
+            makeOutPort = makeClient if how == 'client per port' \
+                else outputs.port
+            names = ['Row %d (SwitchBox)' % n for n in range(OUTPUTS_ROWS)]
+            rig = [openOutPort(makeOutPort, name) for name in names]
+            start = time.perf_counter()
+            renames = 0
+            for n in range(OUTPUTS_ROWS):
+                for length in range(1, len(OUTPUTS_NAME) + 1):
+                    port = renameOutPort(rig[n], makeOutPort, '%s %d' % (
+                        OUTPUTS_NAME[:length], n))
+                    if port is not rig[n]:
+                        closePort(rig[n])
+                        rig[n] = port
+                    renames += 1
+            perRename = (time.perf_counter() - start) / renames
+            for n in range(OUTPUTS_READDED):
+                closePort(rig.pop())
+            for n in range(OUTPUTS_READDED):
+                rig.append(openOutPort(makeOutPort, '%s %d' % (
+                    OUTPUTS_NAME, len(rig))))
+            stats = outputs.stats()
+            if how == 'OutputManager':
+                made[0] = stats['made']
+            with standin.lock:
+                held = standin.counts['clients']
+            print('%-26s %8d %8d %8d %14.3f' % (
+                apiName + ', ' + how, made[0], held, stats['reused'],
+                perRename * 1000))
+            closePort(rig.pop())
+            rig.append(openOutPort(makeOutPort, 'Newcomer (SwitchBox)'))
+            if outputs.stats()['reused'] != stats['reused']:
+                failures.append("outputs: a new row got a deleted row's "
+                                'port on ' + apiName)
+            for port in rig:
+                closePort(port)
+            outputs.stop()
+    standin.api = standin.API_LINUX_ALSA
+    standin.DELAYS_S.update(dict.fromkeys(standin.DELAYS_S, 0.0))
+    return failures
+
+# Rows (of 9 channels and a pad) in the canvas benchmark, and how many
+# times every channel's status gets redrawn
+CANVAS_ROWS = 10
+CANVAS_PASSES = 200
+
+"""A channel drawn the way it was before RowCanvas: a frame of Labels
+and Buttons of its own, the same ones ColumnElement used to make.
+"""
+class WidgetColumn():
+    def __init__(self, container, channel, type):
+        import tkinter
+        import tkinter.ttk as ttk
+        from state import COL_NORMAL
+        self.type = type
+        self.container = ttk.Frame(container)
+        bottomside = ttk.Frame(self.container)
+        rightside = ttk.Frame(bottomside)
+        faderbuttons = ttk.Frame(rightside)
+        triggerbuttons = ttk.Frame(rightside)
+        ttk.Label(rightside, text='CH ' + str(channel)).grid(column=0, row=0)
+        self.led = tkinter.Label(rightside, width=2, bg='grey')
+        self.led.grid(column=1, row=0)
+        ttk.Label(rightside, text='F:').grid(column=0, row=1)
+        self.fadervalue = ttk.Label(rightside, text='N/A', width=6)
+        self.fadervalue.grid(column=1, row=1)
+        self.buttons = [ttk.Button(faderbuttons, text='L', width=1),
+                        ttk.Button(faderbuttons, text='X', width=1)]
+        self.padchannel = ttk.Entry(rightside, width=3)
+        if type == COL_NORMAL:
+            ttk.Label(rightside, text='T:').grid(column=0, row=3)
+            self.triggervalue = ttk.Label(rightside, text='N/A', width=6)
+            self.triggervalue.grid(column=1, row=3)
+            self.buttons.extend([ttk.Button(triggerbuttons, text='L',
+                                            width=1),
+                                 ttk.Button(triggerbuttons, text='X',
+                                            width=1)])
+            triggerbuttons.grid(column=0, row=4, columnspan=2)
+        else:
+            ttk.Label(rightside, text='Channel').grid(column=0, row=3,
+                                                      columnspan=2)
+            self.padchannel.grid(column=0, row=4, columnspan=2)
+        for n, button in enumerate(self.buttons):
+            button.grid(column=n % 2, row=0)
+        faderbuttons.grid(column=0, row=2, columnspan=2)
+        rightside.grid(column=1, row=1)
+        ttk.Separator(bottomside, orient='vertical').grid(column=0, row=1)
+        bottomside.pack()
+        self.container.grid(row=0, column=channel - 1)
+
+    """Everything the old checkStatus did to the widgets.
+    """
+    def show(self, color, disabled, fader, trigger):
+        from state import COL_NORMAL
+        self.led['bg'] = color
+        for button in self.buttons:
+            button['state'] = 'disabled' if disabled else 'normal'
+        self.fadervalue['text'] = fader
+        if self.type == COL_NORMAL:
+            self.triggervalue['text'] = trigger
+
+def countWidgets(widget):
+    return 1 + sum(countWidgets(child) for child in widget.winfo_children())
+
+def benchCanvas():
+    try:
+        import tkinter
+        import SwitchBox
+        from SwitchBox import RowCanvas, ColumnElement, LED_COLORS
+        root = tkinter.Tk()
+    except Exception:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        print('Skipped: needs a display and rtmidi (' +
+              exc_type.__name__ + ': ' + str(exc_obj) + ')')
+        return
+    from state import COL_NORMAL, COL_PAD, LED_IDLE, LED_ACTIVE
+    types = [COL_NORMAL] * 9 + [COL_PAD]
+    print('%d rows of %d channels, every channel redrawn %d times' % (
+        CANVAS_ROWS, len(types), CANVAS_PASSES))
+    print('%-12s %8s %10s %10s %10s' % ('how', 'widgets', 'RSS MB',
+                                         'pass ms', 'idle ms'))
+    for how in ('widgets', 'RowCanvas'):
+        frame = tkinter.Frame(root)
+        frame.pack()
+        root.update()
+        before = residentMemory()
+        columns = []
+        for row in range(CANVAS_ROWS):
+            if how == 'widgets':
+                container = tkinter.Frame(frame)
+                columns.extend(WidgetColumn(container, n + 1, type)
+                               for n, type in enumerate(types))
+            else:
+                container = RowCanvas(frame)
+                columns.extend(ColumnElement(container, n + 1,
+                                             lambda *args: None,
+                                             lambda *args: None, type=type)
+                               for n, type in enumerate(types))
+                container.layout()
+            container.pack()
+        root.update()
+        memory = residentMemory()
+        widgets = countWidgets(frame)
+        drawing = 0.0
+        idle = 0.0
+        for n in range(CANVAS_PASSES):
+            # Every other pass, one channel a row changes; the rest
+            # just get redrawn the same, which is most of what happens
+            active = (n // 2) % len(types)
+            start = time.perf_counter()
+            for index, column in enumerate(columns):
+                isActive = index % len(types) == active
+                if how == 'widgets':
+                    column.show(LED_COLORS[LED_ACTIVE if isActive
+                                           else LED_IDLE],
+                                False, 'CC' + str(index % 100), 'CC20')
+                else:
+                    column.isActive = isActive
+                    column.fader = index % 100
+                    column.trigger = 20
+                    column.checkStatus()
+            middle = time.perf_counter()
+            root.update_idletasks()
+            drawing += middle - start
+            idle += time.perf_counter() - middle
+        grew = ('-' if before is None
+                else '%.1f' % ((memory - before) / 1024 / 1024))
+        print('%-12s %8d %10s %10.3f %10.3f' % (
+            how, widgets, grew,
+            drawing / CANVAS_PASSES * 1000, idle / CANVAS_PASSES * 1000))
+        frame.destroy()
+        root.update()
+    root.destroy()
+
+# Clock ticks to time on their own, then beats (each with a trigger
+# somewhere in it) to switch on, and at what tempo
+QUANTIZE_TICKS = 200000
+QUANTIZE_BEATS = 24
+QUANTIZE_BPM = 240
+
+"""What it costs to keep count of the clock, and how close to the beat
+quantized switches land, when the clock's ticks get to Python a bit
+late (like benchTiming's notes do). The switches go through a routing
+thread, like they do in SwitchBox.
+"""
+def benchQuantize():
+    bindings = [(n, 20 + n, None) for n in range(9)]
+    ticks = [[0xF8] for n in range(QUANTIZE_TICKS)]
+    print('Clock ticks, per tick')
+    for name, quantize in (('dropped', None),
+                           ('counted', Quantize(QUANTIZE_BAR, 4))):
+        dispatch = compileDispatch(buildRouting(bindings, quantize=quantize),
+                                   BenchRow(), lambda message: None)
+        print('%-22s %8.1f ns' % (name, timeMessages(dispatch, ticks)))
+
+    randomness = random.Random(50)
+    period = 60 / (QUANTIZE_BPM * TICKS_PER_BEAT)
+    total = (QUANTIZE_BEATS + 1) * TICKS_PER_BEAT
+    delays = [randomness.uniform(0, 0.0005) if randomness.random() < 0.9
+              else randomness.uniform(0.001, 0.003)
+              for n in range(total)]
+    # Tick each trigger comes in after -> which trigger
+    presses = {}
+    for beat in range(QUANTIZE_BEATS):
+        tick = beat * TICKS_PER_BEAT + randomness.randint(
+            GRACE_TICKS, TICKS_PER_BEAT - 2)
+        presses[tick] = 20 + beat % 9
+    print('')
+    print('%d switches at %d BPM, against the beat they were meant for' % (
+        QUANTIZE_BEATS, QUANTIZE_BPM))
+    print('%-22s %10s %10s %10s' % ('switched', 'mean ms', 'std dev ms',
+                                     'worst ms'))
+    for how in ('right away', 'on the tick', 'scheduled'):
+        row = BenchRow()
+        workers = RoutingWorkers('thread', 0, 1024, standin)
+        callback = workers.attach(row)
+        if how == 'scheduled':
+            row.onRoutingThread = workers.caller(row)
+        switched = []
+        row.onTriggered = lambda: switched.append(time.perf_counter())
+        quantize = None if how == 'right away' else Quantize(QUANTIZE_BEAT, 4)
+        row.dispatch = compileDispatch(
+            buildRouting(bindings, quantize=quantize), row,
+            lambda message: None)
+        start = time.perf_counter() + 0.01
+        callback(([0xFA], 0))
+        for tick in range(total):
+            arrival = start + tick * period + delays[tick]
+            while time.perf_counter() < arrival:
+                time.sleep(0)
+            callback(([0xF8], 0))
+            if tick in presses:
+                callback(([0xB0, presses[tick], 127], 0))
+        time.sleep(0.05)
+        workers.stop()
+        errors = LatencyStats()
+        for tick, switchedAt in zip(sorted(presses), switched):
+            beat = (tick // TICKS_PER_BEAT + 1) * TICKS_PER_BEAT
+            errors.add(abs(switchedAt - (start + beat * period)))
+        print('%-22s %10.3f %10.3f %10.3f' % (
+            how, errors.mean * 1000, errors.deviation() * 1000,
+            errors.worst * 1000))
+        clock = getattr(row, 'clock', None)
+        if clock is not None:
+            print('    reported: ' + clock.summary())
+
+# Name -> benchmark function. Run in this order. A benchmark can return
+# a list of things it found wrong, which fail the run.
+BENCHMARKS = [('dispatch', benchDispatch),
+              ('sysex', benchSysex),
+              ('timing', benchTiming),
+              ('startup', benchStartup),
+              ('panic', benchPanic),
+              ('voices', benchVoices),
+              ('state', benchState),
+              ('load', benchLoad),
+              ('net', benchNet),
+              ('failover', benchFailover),
+              ('scheduler', benchScheduler),
+              ('outputs', benchOutputs),
+              ('canvas', benchCanvas),
+              ('quantize', benchQuantize)]
+
+def main():
+    chosen = sys.argv[1:]
+    if chosen[:1] == ['--load-memory']:
+        measureLoadMemory(*chosen[1:])
+        return
+    if chosen[:1] == ['--mirror-primary']:
+        runPrimary(chosen[1])
+        return
+    failures = []
+    for name, function in BENCHMARKS:
+        if not chosen or name in chosen:
+            failures.extend(function() or [])
+            print('')
+    for failure in failures:
+        print('FAIL: ' + failure)
+    if failures:
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
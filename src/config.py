@@ -0,0 +1,450 @@
+"""
+Save file handling for SwitchBox
+
+The save file (current.xml) used to be written out in full, pretty-
+printed, every time anything changed, even if all that changed was one
+attribute. A ConfigStore can instead keep a journal next to it: each
+edit is appended as one short line of JSON, and a background thread
+folds the journal back into the XML every so often, and on exit.
+
+If SwitchBox dies before that happens, nothing's lost: loading the save
+file replays whatever's in the journal on top of it.
+
+All edits to the save file's tree should go through the store, so they
+make it into the journal:
+
+    store.set(element, 'dev', name)   (instead of element.attrib[...] =)
+    store.added(element)              (after making a new element)
+    store.remove(element)             (instead of parent.remove(element))
+    store.rewrote(element)            (after changing lots of an element)
+    store.save()                      (once the edit's done)
+"""
+
+import os
+import sys
+import json
+import queue
+import logging
+import threading
+from collections import namedtuple
+from time import monotonic
+from lxml import etree
+from filewatch import signature
+from routing import readBindings, readSplits, readFilter
+from voices import readVoices
+from quantize import readQuantize
+from netmidi import readNet
+
+# How often the journal gets folded into the save file, in seconds
+COMPACT_INTERVAL_S = 30.0
+
+# Fold sooner than that if the journal gets this long
+COMPACT_RECORDS = 500
+
+# Root attribute recording the last journal entry the save file includes
+SEQUENCE_ATTRIBUTE = 'seq'
+
+"""Everything a row needs from its element in the save file.
+
+element -- The row's element
+name -- The row's name, or None
+device -- Name of the saved input device, or None
+ordinal -- Which of the devices with that name it was, or None
+bindings -- (channel, trigger, fader) tuples, zero-based channels
+padchannel -- The pad channel, or None
+splits -- (low, high, channel) tuples, zero-based channels
+filters -- The row's MidiFilter
+voices -- The row's VoicePool, or None
+net -- The row's NetEndpoint, or None
+quantize -- The row's Quantize, or None
+"""
+class RowConfig(namedtuple('RowConfig', ['element', 'name', 'device',
+                                         'ordinal', 'bindings',
+                                         'padchannel', 'splits', 'filters',
+                                         'voices', 'net', 'quantize'])):
+    __slots__ = ()
+
+"""Read a row's settings out of its element.
+
+Arguments:
+element -- The row's element
+num_cols -- Number of channels in a row, the pad channel included
+"""
+def readRowConfig(element, num_cols):
+    bindings, padchannel = readBindings(element, num_cols)
+    ordinal = element.get('ord', '')
+    return RowConfig(element, element.get('name'), element.get('dev'),
+                     int(ordinal) if ordinal.isdigit() else None,
+                     tuple(bindings), padchannel,
+                     tuple(readSplits(element, num_cols)),
+                     readFilter(element), readVoices(element),
+                     readNet(element), readQuantize(element))
+
+"""Read a save file and its rows' settings.
+
+The tree is kept (everything edits it through the ConfigStore), so it's
+parsed whole, which is what lxml does quickest. Only the root's own
+rows get read; scenes have rows in them too.
+
+Arguments:
+path -- The save file
+num_cols -- Number of channels in a row, the pad channel included
+
+Returns (tree, rows), where rows is a list of RowConfigs in order.
+Raises whatever lxml does if the file can't be read.
+"""
+def readConfig(path, num_cols):
+    tree = etree.parse(path)
+    rows = [readRowConfig(element, num_cols) for element in tree.getroot()
+            if element.tag == 'row']
+    return tree, rows
+
+"""Apply one journal entry to a tree.
+
+Arguments:
+tree -- The lxml ElementTree
+record -- The entry, as a dictionary
+"""
+def applyRecord(tree, record):
+    operation = record['op']
+    element = tree.xpath(record['at'])[0]
+    if operation == 'set':
+        if record['value'] is None:
+            element.attrib.pop(record['key'], None)
+        else:
+            element.attrib[record['key']] = record['value']
+    elif operation == 'add':
+        element.append(etree.fromstring(record['xml']))
+    elif operation == 'remove':
+        element.getparent().remove(element)
+    elif operation == 'xml':
+        element.getparent().replace(element, etree.fromstring(record['xml']))
+    else:
+        raise ValueError('Unknown journal entry ' + str(operation))
+
+"""Read the journal entries in a file, in order.
+
+Stops at the first line that doesn't make sense, which is normally
+one that was only half written when SwitchBox stopped.
+"""
+def readJournal(path):
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logging.warning('Stopped reading journal at a broken '
+                                    'entry')
+                    break
+    except FileNotFoundError:
+        pass
+    return records
+
+"""Write a tree to a file, all at once: either the whole new file is
+there afterwards, or the old one still is.
+"""
+def writeAtomically(tree, path):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        tree.write(file, pretty_print=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+"""Whether two elements say the same thing: same tags, attributes and
+children, in the same order. Whitespace between elements doesn't count.
+Either can be None.
+"""
+def sameXML(a, b):
+    if a is None or b is None:
+        return a is b
+    if a.tag != b.tag or dict(a.attrib) != dict(b.attrib) or len(a) != len(b):
+        return False
+    if (a.text or '').strip() != (b.text or '').strip():
+        return False
+    return all(sameXML(childA, childB) for childA, childB in zip(a, b))
+
+
+"""The save file, and (if it's turned on) its journal.
+"""
+class ConfigStore():
+    """Arguments:
+    path -- Where the save file lives
+    journal -- Whether to keep a journal. If not, save() writes the
+        whole file, like SwitchBox always did.
+    """
+    def __init__(self, path, journal=True):
+        self.path = path
+        self.journalPath = path + '.journal'
+        self.useJournal = journal
+        self.tree = None
+        self.sequence = 0      # Number of the last journal entry
+        self.unsaved = []      # Lines waiting for save()
+        # Covers the two above. Edits come from the UI thread, but
+        # saves can happen on another one.
+        self.pending = threading.Lock()
+        self.lock = threading.Lock() # Covers the journal file
+        self.journal = None    # Open for appending
+        self.compactor = None
+        # RowConfigs for the rows in the save file, as loaded
+        self.rows = []
+        # The save file's signature (see filewatch.signature) right 
+        # after we last wrote it
+        self.ownWrite = None
+
+    """Load the save file, along with anything in the journal that
+    hasn't made it into the save file yet.
+
+    Arguments:
+    makeDefault -- Function that returns a new root element, for when
+        there isn't a save file (or it can't be read)
+    num_cols -- Number of channels in a row, the pad channel included.
+        The rows' settings end up in self.rows.
+
+    Returns the tree. Edit it through the store from now on.
+    """
+    def load(self, makeDefault, num_cols):
+        try:
+            self.tree, self.rows = readConfig(self.path, num_cols)
+            logging.info('Successfully read XML')
+        except:
+            logging.warning('Cannot read savefile; Creating new file')
+            self.tree = etree.ElementTree(element=makeDefault())
+            self.rows = None
+            self.writeFile(self.tree)
+
+        root = self.tree.getroot()
+        included = root.attrib.pop(SEQUENCE_ATTRIBUTE, '0')
+        self.sequence = int(included) if included.isdigit() else 0
+        replayed = 0
+        for record in readJournal(self.journalPath):
+            if record.get('n', 0) <= self.sequence:
+                continue
+            try:
+                applyRecord(self.tree, record)
+            except:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                                ": Couldn't replay journal entry " +
+                                str(record.get('n')))
+            self.sequence = record['n']
+            replayed += 1
+        if replayed:
+            logging.warning('Recovered ' + str(replayed) +
+                            ' unsaved changes from the journal')
+        if replayed or self.rows is None:
+            # What was read on the way in is out of date
+            self.rows = [readRowConfig(element, num_cols)
+                         for element in root if element.tag == 'row']
+
+        if self.useJournal:
+            # Start from a clean slate: everything in one file
+            self.writeSnapshot(self.tree)
+            self.journal = open(self.journalPath, 'w', encoding='utf-8')
+            self.compactor = Compactor(self, self.tree)
+        elif replayed:
+            self.writeFile(self.tree)
+            os.remove(self.journalPath)
+        return self.tree
+
+    """Write a tree out as the save file, marked with the last journal
+    entry it includes.
+    """
+    def writeSnapshot(self, tree, sequence=None):
+        root = tree.getroot()
+        root.attrib[SEQUENCE_ATTRIBUTE] = str(
+            self.sequence if sequence is None else sequence)
+        try:
+            self.writeFile(tree)
+        finally:
+            del root.attrib[SEQUENCE_ATTRIBUTE]
+
+    """Write a tree out as the save file, and remember that it was us.
+    """
+    def writeFile(self, tree):
+        writeAtomically(tree, self.path)
+        self.ownWrite = signature(self.path)
+
+    """Whether the save file is just as we last left it, i.e. nobody 
+    else has changed it since.
+    """
+    def isOwnWrite(self):
+        return signature(self.path) == self.ownWrite
+
+    def record(self, operation, element, **fields):
+        if not self.useJournal:
+            return
+        try:
+            fields['at'] = self.tree.getpath(element)
+        except ValueError:
+            # Not in the tree (any more), so not in the save file either
+            return
+        fields['op'] = operation
+        with self.pending:
+            self.sequence += 1
+            fields['n'] = self.sequence
+            self.unsaved.append(fields)
+
+    """Set (or, with a value of None, remove) an attribute.
+    """
+    def set(self, element, key, value):
+        if element.get(key) == value:
+            return
+        if value is None:
+            element.attrib.pop(key, None)
+        else:
+            element.attrib[key] = value
+        self.record('set', element, key=key, value=value)
+
+    """Note a new element, with everything in it. It has to have been
+    added at the end of its parent, like etree.SubElement does.
+    """
+    def added(self, element):
+        if not self.useJournal:
+            return
+        self.record('add', element.getparent(),
+                    xml=etree.tostring(element, encoding='unicode'))
+
+    """Remove an element from its parent.
+    """
+    def remove(self, element):
+        self.record('remove', element)
+        element.getparent().remove(element)
+
+    """Note that an element's been changed in ways too many to list. The
+    whole element goes into the journal.
+    """
+    def rewrote(self, element):
+        if not self.useJournal:
+            return
+        self.record('xml', element,
+                    xml=etree.tostring(element, encoding='unicode'))
+
+    """Save everything edited since last time.
+
+    With the journal on, this can be called from any thread, as long as
+    only one calls it at a time. Without it, the whole tree gets
+    written, so only from the thread that edits it.
+    """
+    def save(self):
+        if not self.useJournal:
+            self.writeFile(self.tree)
+            return
+        with self.pending:
+            records = self.unsaved
+            self.unsaved = []
+        if not records:
+            return
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                        for record in records)
+        with self.lock:
+            self.journal.write(lines)
+            self.journal.flush()
+        self.compactor.put(records)
+
+    """Fold the journal into the save file and stop the background
+    thread. Call when SwitchBox closes.
+    """
+    def close(self):
+        self.save()
+        if self.compactor is not None:
+            self.compactor.finish()
+            self.compactor = None
+
+    """Replace the journal with just the entries after a given one.
+    Called by the Compactor once those entries are in the save file.
+    """
+    def trimJournal(self, sequence):
+        with self.lock:
+            self.journal.close()
+            keep = [record for record in readJournal(self.journalPath)
+                    if record.get('n', 0) > sequence]
+            temporary = self.journalPath + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                for record in keep:
+                    file.write(json.dumps(record, separators=(',', ':')) +
+                               '\n')
+            os.replace(temporary, self.journalPath)
+            self.journal = open(self.journalPath, 'a', encoding='utf-8')
+
+
+"""Folds the journal into the save file in the background.
+
+Keeps its own copy of the tree, and brings it up to date from the same
+entries that go into the journal, so the UI's tree never has to be
+touched from here.
+"""
+class Compactor(threading.Thread):
+    def __init__(self, store, tree):
+        threading.Thread.__init__(self, name='SwitchBox compactor',
+                                  daemon=True)
+        self.store = store
+        parser = etree.XMLParser(remove_blank_text=True)
+        self.tree = etree.ElementTree(etree.fromstring(
+            etree.tostring(tree), parser))
+        self.sequence = store.sequence # Last entry in our tree
+        self.written = store.sequence  # Last entry in the save file
+        self.inbox = queue.SimpleQueue()
+        self.start()
+
+    """Hand over entries that just went into the journal.
+    """
+    def put(self, records):
+        self.inbox.put(records)
+
+    """Compact one last time and stop.
+    """
+    def finish(self):
+        self.inbox.put(None)
+        self.join()
+
+    def catchUp(self, records):
+        for record in records:
+            try:
+                applyRecord(self.tree, record)
+            except:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                                ": Couldn't compact journal entry " +
+                                str(record['n']))
+            self.sequence = record['n']
+
+    def compact(self):
+        if self.sequence == self.written:
+            return
+        try:
+            self.store.writeSnapshot(self.tree, self.sequence)
+            self.store.trimJournal(self.sequence)
+            self.written = self.sequence
+            logging.info('Compacted journal into save file')
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ": Couldn't compact journal")
+
+    def run(self):
+        due = monotonic() + COMPACT_INTERVAL_S
+        while True:
+            try:
+                records = self.inbox.get(timeout=max(0, due - monotonic()))
+            except queue.Empty:
+                self.compact()
+                due = monotonic() + COMPACT_INTERVAL_S
+                continue
+            if records is None:
+                # Pick up anything that came in just before finish()
+                while True:
+                    try:
+                        records = self.inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                    if records is not None:
+                        self.catchUp(records)
+                self.compact()
+                return
+            self.catchUp(records)
+            if self.sequence - self.written >= COMPACT_RECORDS:
+                self.compact()
+                due = monotonic() + COMPACT_INTERVAL_S
@@ -0,0 +1,310 @@
+"""
+Control API for SwitchBox
+
+Lets scripts drive a running SwitchBox over a local socket instead of
+somebody clicking Learn over and over: set bindings, switch channels,
+ask what state everything's in, or hit panic.
+
+Each request is one line of JSON holding a batch of commands, and gets
+one line of JSON back:
+
+    {"commands": [{"cmd": "bind", "row": 1, "channel": 2, "trigger": 20},
+                  {"cmd": "activate", "row": 1, "channel": 2}]}
+    {"ok": true, "results": [null, null]}
+
+The whole batch is checked before any of it is applied, then applied
+all at once: every row it touches gets one new routing table, and the
+save file gets written once. If anything in it is wrong, none of it is
+applied:
+
+    {"ok": false, "error": "Command 2: row 9 doesn't exist"}
+
+A batch SwitchBox is too busy to get to in time is called off, and the
+reply says so; it's safe to send it again.
+
+Commands (rows and channels count from 1, like the window does):
+bind -- row, channel, and trigger and/or fader (a CC number, or null to
+    clear it). Leaving one out leaves it as it is.
+pad -- row, and pad (the pad channel, or null for none)
+activate -- row, channel: switch the row's active channel
+scene -- index: switch to a scene (counting from 1)
+state -- Optionally row. Returns the rows' settings and status, and
+    how many MIDI clients and ports the rig's using.
+panic -- Stop every note on every row
+
+The socket is a Unix socket in SwitchBox's folder, or on systems
+without those, a TCP port on localhost. See switchboxctl.py for a
+client.
+"""
+
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+from paths import PATH_SWITCHBOXFILES
+
+# Where the socket lives. Same folder SwitchBox.py keeps its files in.
+DEFAULT_ADDRESS = os.path.join(PATH_SWITCHBOXFILES, 'control.sock')
+
+# Where to listen instead, if there's no such thing as a Unix socket
+DEFAULT_TCP_ADDRESS = ('127.0.0.1', 47800)
+
+# Longest request line we'll take, in bytes
+MAX_REQUEST = 1024 * 1024
+
+# Fields each command takes, and which of those it needs
+COMMANDS = {
+    'bind': (('row', 'channel', 'trigger', 'fader'), ('row', 'channel')),
+    'pad': (('row', 'pad'), ('row', 'pad')),
+    'activate': (('row', 'channel'), ('row', 'channel')),
+    'scene': (('index',), ('index',)),
+    'state': (('row',), ()),
+    'panic': ((), ()),
+}
+
+# Stands in for a field that was left out, so "leave it alone" and
+# "clear it" (null) aren't the same thing.
+KEEP = 'keep'
+
+"""Something wrong with a request. The message goes back to the client.
+"""
+class ControlError(Exception):
+    pass
+
+"""Make sure a field is a whole number in a range.
+"""
+def checkNumber(value, low, high, what, allowNone=False):
+    if value is None and allowNone:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ControlError(what + ' should be a number')
+    if value < low or value > high:
+        raise ControlError(what + ' ' + str(value) + " doesn't exist"
+                           if what in ('row', 'channel', 'scene')
+                           else what + ' should be ' + str(low) + '-' +
+                           str(high))
+    return value
+
+"""Check a batch of commands and put them in a form that's easy to
+apply.
+
+Arguments:
+commands -- The list of commands, as decoded from JSON
+rows -- How many rows there are
+channels -- How many channels each row has, pad included
+scenes -- How many scenes there are
+
+Returns a list of tuples, with zero-based rows and channels:
+('bind', row, channel, trigger, fader), ('pad', row, padchannel),
+('activate', row, channel), ('scene', index), ('state', row or None),
+('panic',). trigger and fader are KEEP if they were left out.
+
+Raises ControlError if anything's wrong.
+"""
+def parseBatch(commands, rows, channels, scenes):
+    if not isinstance(commands, list):
+        raise ControlError('"commands" should be a list')
+    batch = []
+    for number, command in enumerate(commands, 1):
+        try:
+            if not isinstance(command, dict) or command.get('cmd') not in \
+                    COMMANDS:
+                raise ControlError('unknown command')
+            name = command['cmd']
+            fields, needed = COMMANDS[name]
+            for field in command:
+                if field != 'cmd' and field not in fields:
+                    raise ControlError('unknown field "' + field + '"')
+            for field in needed:
+                if field not in command:
+                    raise ControlError('needs "' + field + '"')
+            row = command.get('row')
+            if row is not None:
+                row = checkNumber(row, 1, rows, 'row') - 1
+            if name == 'bind':
+                channel = checkNumber(command['channel'], 1, channels,
+                                      'channel') - 1
+                trigger = command.get('trigger', KEEP)
+                fader = command.get('fader', KEEP)
+                if trigger is KEEP and fader is KEEP:
+                    raise ControlError('needs "trigger" or "fader"')
+                if trigger is not KEEP:
+                    trigger = checkNumber(trigger, 0, 127, 'trigger', True)
+                    if trigger is not None and channel == channels - 1:
+                        raise ControlError("the pad channel can't have a "
+                                           "trigger")
+                if fader is not KEEP:
+                    fader = checkNumber(fader, 0, 127, 'fader', True)
+                batch.append(('bind', row, channel, trigger, fader))
+            elif name == 'pad':
+                batch.append(('pad', row, checkNumber(command['pad'], 1, 16,
+                                                      'pad', True)))
+            elif name == 'activate':
+                # The pad channel's always on, so it can't be switched to
+                batch.append(('activate', row,
+                              checkNumber(command['channel'], 1,
+                                          channels - 1, 'channel') - 1))
+            elif name == 'scene':
+                batch.append(('scene', checkNumber(command['index'], 1,
+                                                   scenes, 'scene') - 1))
+            elif name == 'state':
+                batch.append(('state', row))
+            else:
+                batch.append(('panic',))
+        except ControlError as error:
+            raise ControlError('Command ' + str(number) + ': ' + str(error))
+    return batch
+
+
+"""Open a listening socket: a Unix socket at a path, or TCP where there
+are no Unix sockets. A socket left over from last time gets cleared
+away.
+
+Arguments:
+address -- Path of the Unix socket, or (host, port) for TCP
+tcpAddress -- Where to listen instead, if there are no Unix sockets
+
+Returns (listener, the address it's listening on). Raises OSError if
+another SwitchBox is listening there already.
+"""
+def listenOn(address, tcpAddress):
+    if isinstance(address, str) and hasattr(socket, 'AF_UNIX'):
+        # A socket left over from last time would be in the way, but
+        # one that answers belongs to a SwitchBox that's still running
+        if os.path.exists(address):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(address)
+            except OSError:
+                os.remove(address)
+            else:
+                raise OSError('Another SwitchBox is listening on ' +
+                              address)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+        os.chmod(address, 0o600)
+    else:
+        if isinstance(address, str):
+            address = tcpAddress
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+    return listener, address
+
+
+"""Listens on the control socket, and hands every batch that comes in
+to a function that applies it.
+"""
+class ControlServer(threading.Thread):
+    """Arguments:
+    address -- Path of the Unix socket, or (host, port) for TCP
+    onBatch -- Function that takes a list of commands (as decoded from
+        JSON) and returns a list of results, or raises ControlError.
+        Called from the server's threads.
+    """
+    def __init__(self, address, onBatch):
+        threading.Thread.__init__(self, name='SwitchBox control',
+                                  daemon=True)
+        self.onBatch = onBatch
+        self.listener, self.address = listenOn(address, DEFAULT_TCP_ADDRESS)
+        self.listener.listen(4)
+        self.running = True
+        self.start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def run(self):
+        while self.running:
+            try:
+                connection, peer = self.listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(connection,),
+                             name='SwitchBox control client',
+                             daemon=True).start()
+
+    """Answer requests on one connection until the client hangs up.
+    """
+    def serve(self, connection):
+        with connection, connection.makefile('rwb') as stream:
+            while self.running:
+                line = stream.readline(MAX_REQUEST + 1)
+                if not line:
+                    break
+                stream.write(json.dumps(self.answer(line)).encode() + b'\n')
+                stream.flush()
+
+    def answer(self, line):
+        if len(line) > MAX_REQUEST:
+            return {'ok': False, 'error': 'Request too long'}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or 'commands' not in request:
+                raise ControlError('Request should have "commands"')
+            return {'ok': True, 'results': self.onBatch(request['commands'])}
+        except ValueError:
+            return {'ok': False, 'error': 'Request is not JSON'}
+        except ControlError as error:
+            return {'ok': False, 'error': str(error)}
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ': Control request failed')
+            return {'ok': False, 'error': exc_type.__name__ + ': ' +
+                    str(exc_obj)}
+
+
+"""Talks to a running SwitchBox. See switchboxctl.py.
+"""
+class ControlClient():
+    """Arguments:
+    address -- Path of the Unix socket, or (host, port) for TCP.
+        Defaults to wherever SwitchBox listens by default.
+    """
+    def __init__(self, address=None):
+        if address is None:
+            address = (DEFAULT_ADDRESS if hasattr(socket, 'AF_UNIX')
+                       else DEFAULT_TCP_ADDRESS)
+        family = socket.AF_UNIX if isinstance(address, str) else \
+            socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(address)
+        self.stream = self.connection.makefile('rwb')
+
+    """Send a batch of commands.
+
+    Returns the list of results, one per command. Raises ControlError
+    if SwitchBox turned the batch down.
+    """
+    def batch(self, commands):
+        self.stream.write(json.dumps({'commands': commands}).encode() +
+                          b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ControlError('SwitchBox hung up')
+        reply = json.loads(line)
+        if not reply.get('ok'):
+            raise ControlError(reply.get('error', 'Unknown error'))
+        return reply['results']
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
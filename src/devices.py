@@ -0,0 +1,143 @@
+"""
+Device identities for SwitchBox
+
+The save file remembers each row's input device by the name the MIDI
+backend showed for it. Those names aren't very stable: ALSA puts client
+and port numbers on the end, which change as things are plugged in, and
+two of the same keyboard look exactly alike. Going by list position is
+worse, since the port list gets reordered all the time.
+
+So a device is known by a fingerprint instead: its name with the
+numbering taken off, plus its ordinal (0 for the first device with that
+name, 1 for the second, and so on). A DeviceRegistry turns fingerprints
+into port indices with a single dictionary lookup, and waits for the
+port list to settle before anybody reconnects, so a flapping USB hub
+doesn't have every row closing and opening its port over and over.
+"""
+
+import re
+from platform import system
+
+# How long the port list has to stay the same before rows reconnect to
+# whatever's changed, in seconds
+SETTLE_S = 1.0
+
+# ALSA: "Keystation 49:Keystation 49 MIDI 1 20:0"
+ALSA_NUMBERS = re.compile(r' \d+:\d+$')
+
+# Windows puts each port's index on the end of its name
+INDEX_NUMBER = re.compile(r' \d+$')
+STRIP_INDEX = system() == 'Windows'
+
+"""A port name without the numbering the backend adds to it.
+"""
+def baseName(portName):
+    name = ALSA_NUMBERS.sub('', portName)
+    if STRIP_INDEX:
+        name = INDEX_NUMBER.sub('', name)
+    return name
+
+"""Fingerprints for every port in a list, in the same order.
+
+Returns a list of (base name, ordinal).
+"""
+def fingerprints(ports):
+    seen = {}
+    result = []
+    for port in ports:
+        base = baseName(port)
+        ordinal = seen.get(base, 0)
+        seen[base] = ordinal + 1
+        result.append((base, ordinal))
+    return result
+
+"""Index every port by its fingerprint.
+
+Returns a dictionary of (base name, ordinal) -> port index.
+"""
+def indexPorts(ports):
+    return {fingerprint: index
+            for index, fingerprint in enumerate(fingerprints(ports))}
+
+"""Find a saved device in a port list.
+
+Arguments:
+ports -- The port names, in port order
+name -- The device's name, as saved
+ordinal -- Which of the devices with that name it was, or None if it
+    wasn't saved
+byFingerprint -- indexPorts(ports), if it's already been worked out
+
+Returns the port index, or None if it isn't plugged in.
+"""
+def findDevice(ports, name, ordinal=None, byFingerprint=None):
+    if name is None:
+        return None
+    if byFingerprint is None:
+        byFingerprint = indexPorts(ports)
+    base = baseName(name)
+    index = byFingerprint.get((base, ordinal or 0))
+    if index is not None:
+        return index
+    # Saved before fingerprints were. An exact name is the next best 
+    # thing. (If an ordinal was saved and isn't there, whatever's left
+    # with that name is somebody else's, so don't take it.)
+    if name in ports:
+        return ports.index(name)
+    return None
+
+
+"""Keeps track of which devices are plugged in, and which ports they're
+on.
+
+Only the UI side updates it. Once a new port list has been applied, the
+lists in it aren't changed again, so they're safe to hand around.
+"""
+class DeviceRegistry():
+    def __init__(self, settle=SETTLE_S):
+        self.settle = settle
+        self.ports = ()       # The port list rows are working from
+        self.byFingerprint = {}
+        self.pending = None   # The latest port list seen
+        self.pendingSince = 0.0
+
+    """Take in a new device scan.
+
+    Arguments:
+    ports -- The port names, in port order
+    now -- The time (any monotonic clock, in seconds)
+
+    Returns True if the rows should catch up with a new port list, once
+    it's been the same for long enough.
+    """
+    def update(self, ports, now):
+        ports = tuple(ports)
+        if ports != self.pending:
+            self.pending = ports
+            self.pendingSince = now
+            return False
+        if ports == self.ports or now - self.pendingSince < self.settle:
+            return False
+        self.apply(ports)
+        return True
+
+    """Use a new port list right away, e.g. one the user just asked for.
+    """
+    def apply(self, ports):
+        self.ports = tuple(ports)
+        self.pending = self.ports
+        self.byFingerprint = indexPorts(self.ports)
+
+    """Look up a saved device.
+
+    Returns its port index, or None if it isn't plugged in.
+    """
+    def find(self, name, ordinal=None):
+        return findDevice(self.ports, name, ordinal, self.byFingerprint)
+
+    """Which of the devices with its name a port is (see fingerprints).
+    """
+    def ordinal(self, index):
+        base = baseName(self.ports[index])
+        return sum(1 for port in self.ports[:index]
+                   if baseName(port) == base)
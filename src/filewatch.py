@@ -0,0 +1,122 @@
+"""
+File watching for SwitchBox
+
+Lets SwitchBox notice when the save file gets changed by something else
+(a text editor, a provisioning script). On Linux this uses inotify, so
+nothing happens until the file actually changes; everywhere else, and
+if inotify isn't available, the file gets checked every so often.
+"""
+
+import os
+import sys
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from time import sleep
+
+# How often to check the file when we can't use inotify, in seconds
+POLL_S = 1.0
+
+# inotify event flags (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+"""Returns something that changes whenever the file does, or None if it
+isn't there.
+"""
+def signature(path):
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return (info.st_ino, info.st_mtime_ns, info.st_size)
+
+"""Open an inotify watch on a directory.
+
+Returns the inotify file descriptor, or None if inotify isn't available.
+"""
+def watchDirectory(directory):
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return None
+        # Watch the directory rather than the file, since editors tend
+        # to replace the file rather than write into it.
+        if libc.inotify_add_watch(fd, os.fsencode(directory),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+"""Calls a function whenever a file changes. The function gets called
+from the watcher's thread, once for each burst of changes.
+"""
+class FileWatcher(threading.Thread):
+    """Arguments:
+    path -- The file to watch
+    onChanged -- Function to call (with no arguments) when it changes
+    """
+    def __init__(self, path, onChanged):
+        threading.Thread.__init__(self, name='SwitchBox file watcher',
+                                  daemon=True)
+        self.path = path
+        self.onChanged = onChanged
+        self.running = True
+        self.fd = watchDirectory(os.path.dirname(os.path.abspath(path)))
+        if self.fd is None:
+            logging.info('Watching ' + path + ' by checking it every ' +
+                         str(POLL_S) + ' s')
+        self.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        if self.fd is not None:
+            self.runInotify()
+        else:
+            self.runPolling()
+
+    def runInotify(self):
+        name = os.fsencode(os.path.basename(self.path))
+        try:
+            while self.running:
+                # Time out now and then, so stop() gets noticed
+                ready, _, _ = select.select([self.fd], [], [], POLL_S)
+                if not ready:
+                    continue
+                data = os.read(self.fd, 64 * 1024)
+                changed = False
+                offset = 0
+                while offset + EVENT.size <= len(data):
+                    wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                    offset += EVENT.size
+                    eventName = data[offset:offset + length].rstrip(b'\0')
+                    offset += length
+                    if eventName == name:
+                        changed = True
+                if changed:
+                    self.onChanged()
+        finally:
+            os.close(self.fd)
+
+    def runPolling(self):
+        last = signature(self.path)
+        while self.running:
+            sleep(POLL_S)
+            current = signature(self.path)
+            if current != last:
+                last = current
+                self.onChanged()
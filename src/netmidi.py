@@ -0,0 +1,408 @@
+"""
+Network MIDI for SwitchBox
+
+Lets a row take its input from, or send its output to, another machine
+over UDP instead of a MIDI device, so racks split across machines don't
+need a separate tool to tunnel MIDI. Set one up in the save file:
+
+    <net in="5004" out="studio-b.local:5004" latency="2"/>
+
+in -- Port (or host:port) to listen on. The row's input comes from
+    here instead of a device.
+out -- host:port to send the row's output to, instead of its virtual
+    port
+latency -- How long (ms) a message can wait for others to go in the
+    same datagram. 0 sends each one straight away.
+
+Either end can be left out. SwitchBox on the other machine takes a row
+with the same port as its "in", and the two talk directly.
+
+Each datagram is a batch of messages:
+
+    'SBM1' -- Magic, 4 bytes
+    sequence -- 4 bytes, big endian, one more than the last datagram's
+    then for each message:
+        length -- 2 bytes, big endian
+        the message's bytes
+
+Sequence numbers let the receiving end count datagrams that went
+missing (and throw away ones that turn up late, after later ones).
+Nothing gets sent again: a note that's late is worse than one that's
+lost.
+
+NetMidiIn and NetMidiOut look enough like rtmidi's MidiIn and MidiOut
+for a row to use them as its ports.
+"""
+
+import sys
+import socket
+import struct
+import logging
+import threading
+from collections import namedtuple
+from time import perf_counter
+
+MAGIC = b'SBM1'
+HEADER = struct.Struct('!4sI')
+LENGTH = struct.Struct('!H')
+
+# Where to listen (or send) if only a host's given
+DEFAULT_PORT = 47900
+
+# Biggest datagram batches get packed into, so they fit in one Ethernet
+# frame. A message bigger than that goes in a datagram on its own.
+MAX_DATAGRAM = 1400
+
+# Biggest datagram there can be, header and length included
+MAX_UDP = 65507
+
+# How long (seconds) a message can wait for company, unless the save
+# file says otherwise
+DEFAULT_LATENCY_S = 0.002
+
+# Receive buffer to ask for, so bursts don't get dropped by the OS
+RECEIVE_BUFFER = 1024 * 1024
+
+SEQUENCE_MOD = 1 << 32
+
+"""A row's network endpoints.
+
+inAddress -- (host, port) to listen on, or None
+outAddress -- (host, port) to send to, or None
+latency -- Batching window, in seconds
+"""
+class NetEndpoint(namedtuple('NetEndpoint', ['inAddress', 'outAddress',
+                                             'latency'])):
+    __slots__ = ()
+
+"""Turn 'host:port', 'host' or 'port' into (host, port).
+
+Raises ValueError if it's nonsense.
+"""
+def parseAddress(text, defaultHost):
+    text = text.strip()
+    if text.isdigit():
+        host, port = defaultHost, text
+    elif ':' in text:
+        host, port = text.rsplit(':', 1)
+    else:
+        host, port = text, str(DEFAULT_PORT)
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError('Not a network address: ' + text)
+    return host, int(port)
+
+"""Read a row's network endpoints out of its XML element.
+
+Returns a NetEndpoint, or None if the row doesn't have one (or it
+doesn't make sense).
+"""
+def readNet(XMLElement):
+    element = XMLElement.find('net')
+    if element is None:
+        return None
+    try:
+        inAddress = outAddress = None
+        if element.get('in'):
+            inAddress = parseAddress(element.get('in'), '0.0.0.0')
+        if element.get('out'):
+            outAddress = parseAddress(element.get('out'), '127.0.0.1')
+    except ValueError:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        logging.warning(str(exc_obj) + ': Ignoring network settings')
+        return None
+    if inAddress is None and outAddress is None:
+        return None
+    latency = element.get('latency', '')
+    try:
+        latency = max(0.0, float(latency) / 1000)
+    except ValueError:
+        latency = DEFAULT_LATENCY_S
+    return NetEndpoint(inAddress, outAddress, latency)
+
+"""What a network input shows up as in the row's device list.
+"""
+def netPortName(address):
+    return 'Network ' + address[0] + ':' + str(address[1])
+
+"""Put messages in a datagram.
+
+Arguments:
+sequence -- The datagram's sequence number
+messages -- The messages, already as bytes
+"""
+def packBatch(sequence, messages):
+    parts = [HEADER.pack(MAGIC, sequence % SEQUENCE_MOD)]
+    for message in messages:
+        parts.append(LENGTH.pack(len(message)))
+        parts.append(message)
+    return b''.join(parts)
+
+"""Take the messages back out of a datagram.
+
+Returns (sequence, messages), with each message a list of ints the way
+rtmidi hands them over. Raises ValueError if it isn't one of ours.
+"""
+def unpackBatch(datagram):
+    if len(datagram) < HEADER.size:
+        raise ValueError('Datagram too short')
+    magic, sequence = HEADER.unpack_from(datagram)
+    if magic != MAGIC:
+        raise ValueError('Not a SwitchBox datagram')
+    messages = []
+    offset = HEADER.size
+    while offset < len(datagram):
+        if offset + LENGTH.size > len(datagram):
+            raise ValueError('Datagram cut short')
+        length, = LENGTH.unpack_from(datagram, offset)
+        offset += LENGTH.size
+        if not length or offset + length > len(datagram):
+            raise ValueError('Datagram cut short')
+        messages.append(list(datagram[offset:offset + length]))
+        offset += length
+    return sequence, messages
+
+
+"""Sends a row's output to another machine. Stands in for rtmidi's
+MidiOut.
+
+Messages sent within the latency window of the first one waiting go
+out together in one datagram, unless there are too many to fit. The
+window's timed from a thread of its own, so send_message never waits
+on it. Safe to call from any thread.
+"""
+class NetMidiOut():
+    """Arguments:
+    address -- (host, port) to send to
+    latency -- Batching window, in seconds
+    """
+    def __init__(self, address, latency=DEFAULT_LATENCY_S):
+        self.address = address
+        self.latency = latency
+        self.portName = None
+        self.sock = None
+        self.sequence = 0
+        self.batch = []
+        self.batchBytes = HEADER.size
+        self.deadline = None
+        self.condition = threading.Condition()
+        self.flusher = None
+        # For the benchmarks and anybody curious
+        self.datagrams = 0
+        self.messages = 0
+
+    def open_virtual_port(self, name=None):
+        if self.sock is not None:
+            raise RuntimeError('Port already open')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(self.address)
+        self.portName = name
+        if self.latency > 0:
+            self.flusher = threading.Thread(target=self.run,
+                                            name='SwitchBox net out',
+                                            daemon=True)
+            self.flusher.start()
+        return self
+
+    def set_port_name(self, name):
+        self.portName = name
+
+    def is_port_open(self):
+        return self.sock is not None
+
+    def send_message(self, message):
+        data = bytes(message)
+        if HEADER.size + LENGTH.size + len(data) > MAX_UDP:
+            raise ValueError('Message too long to send over the network: ' +
+                             str(len(data)) + ' bytes')
+        with self.condition:
+            if self.sock is None:
+                raise RuntimeError('Port not open')
+            size = LENGTH.size + len(data)
+            if self.batch and self.batchBytes + size > MAX_DATAGRAM:
+                self.flush()
+            self.batch.append(data)
+            self.batchBytes += size
+            if self.latency <= 0 or self.batchBytes >= MAX_DATAGRAM:
+                self.flush()
+            elif self.deadline is None:
+                self.deadline = perf_counter() + self.latency
+                self.condition.notify()
+
+    """Send whatever's waiting. Hold self.condition.
+    """
+    def flush(self):
+        if not self.batch:
+            return
+        datagram = packBatch(self.sequence, self.batch)
+        self.sequence = (self.sequence + 1) % SEQUENCE_MOD
+        self.datagrams += 1
+        self.messages += len(self.batch)
+        self.batch = []
+        self.batchBytes = HEADER.size
+        self.deadline = None
+        try:
+            self.sock.send(datagram)
+        except OSError:
+            # Nobody listening (yet), or the network's down. Either way
+            # it's gone; the other end will see the gap.
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.info(exc_type.__name__ + ': ' + str(exc_obj) +
+                         ': Lost a datagram to ' + str(self.address))
+
+    """Send batches as their windows run out.
+    """
+    def run(self):
+        with self.condition:
+            while self.sock is not None:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                left = self.deadline - perf_counter()
+                if left > 0:
+                    self.condition.wait(left)
+                    continue
+                self.flush()
+
+    def close_port(self):
+        with self.condition:
+            if self.sock is None:
+                return
+            self.flush()
+            self.sock.close()
+            self.sock = None
+            self.portName = None
+            self.condition.notify()
+
+    def delete(self):
+        self.close_port()
+
+
+"""Takes a row's input from another machine. Stands in for rtmidi's
+MidiIn.
+
+Its only "device" is the address it listens on. The callback gets each
+message the way rtmidi's would, ((message, delta time), data), from
+the receiving thread.
+"""
+class NetMidiIn():
+    """Arguments:
+    address -- (host, port) to listen on
+    """
+    def __init__(self, address):
+        self.address = address
+        self.name = netPortName(address)
+        self.sock = None
+        self.receiver = None
+        self.callback = None
+        self.data = None
+        self.ignoring = (True, True, True)
+        self.last = None
+        # Next sequence number expected from each sender
+        self.expected = {}
+        # Datagrams that never turned up, and ones that came too late
+        self.lost = 0
+        self.late = 0
+        self.received = 0
+
+    def get_ports(self):
+        return [self.name]
+
+    def get_port_count(self):
+        return 1
+
+    def open_port(self, port=0, name=None):
+        if self.sock is not None:
+            raise RuntimeError('Port already open')
+        if port != 0:
+            raise ValueError('Invalid port number: ' + str(port))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            RECEIVE_BUFFER)
+        except OSError:
+            pass
+        sock.bind(self.address)
+        self.sock = sock
+        self.receiver = threading.Thread(target=self.run, args=(sock,),
+                                         name='SwitchBox net in',
+                                         daemon=True)
+        self.receiver.start()
+        return self
+
+    def is_port_open(self):
+        return self.sock is not None
+
+    def set_callback(self, func, data=None):
+        self.callback = func
+        self.data = data
+
+    def cancel_callback(self):
+        self.callback = None
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        self.ignoring = (sysex, timing, active_sense)
+
+    def run(self, sock):
+        while True:
+            try:
+                datagram, sender = sock.recvfrom(MAX_UDP)
+            except OSError:
+                break
+            try:
+                sequence, messages = unpackBatch(datagram)
+            except ValueError:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                logging.info(str(exc_obj) + ': Ignoring datagram from ' +
+                             str(sender))
+                continue
+            if not self.checkSequence(sender, sequence):
+                continue
+            self.received += 1
+            for message in messages:
+                self.deliver(message)
+
+    """Keep track of a sender's sequence numbers. Returns False if the
+    datagram's late (or a repeat) and should be thrown away.
+    """
+    def checkSequence(self, sender, sequence):
+        expected = self.expected.get(sender)
+        if expected is not None:
+            ahead = (sequence - expected) % SEQUENCE_MOD
+            if ahead >= SEQUENCE_MOD // 2:
+                self.late += 1
+                return False
+            if ahead:
+                self.lost += ahead
+                logging.warning('Lost ' + str(ahead) + ' datagrams from ' +
+                                str(sender))
+        self.expected[sender] = (sequence + 1) % SEQUENCE_MOD
+        return True
+
+    def deliver(self, message):
+        sysex, timing, sense = self.ignoring
+        status = message[0]
+        if ((sysex and status == 0xF0) or
+                (timing and status in (0xF1, 0xF8)) or
+                (sense and status == 0xFE)):
+            return
+        now = perf_counter()
+        delta = 0.0 if self.last is None else now - self.last
+        self.last = now
+        callback = self.callback
+        if callback is not None:
+            callback((message, delta), self.data)
+
+    def close_port(self):
+        sock = self.sock
+        if sock is None:
+            return
+        self.sock = None
+        # Wakes the receiving thread up so it can finish
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def delete(self):
+        self.close_port()
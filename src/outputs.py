@@ -0,0 +1,196 @@
+"""
+Shared output ports for SwitchBox
+
+Every row used to make its own MidiOut for its virtual port, and a new
+one every time it was renamed (a keystroke at a time), and never let go
+of a deleted row's. Every one of those is a sequencer client the MIDI
+system has to keep track of, and the DAW sees each rename as the old
+port going away and a new one turning up.
+
+An OutputManager hands out the rows' output ports instead, and keeps
+hold of the backend clients behind them:
+
+- A rename changes the port's name where it is (set_port_name), so it
+  keeps its client and whatever it's connected to.
+- A port that's let go of because its row was deleted is kept open for
+  a while as a spare, renamed to SPARE_NAME (so it shows up as one), in
+  case the row comes back under the same name: it gets its own port
+  back, connections and all. A row with any other name gets a port of
+  its own. A renamed port keeps its connections, so handing a spare to
+  a different row would quietly send its MIDI to whatever the deleted
+  row was plugged into. rtmidi can't disconnect a port, so spares are
+  only ever their old row's.
+- stats() says how many clients and ports the rig is holding on to.
+
+rtmidi gives every client exactly one port, so that's as few as it
+gets: one client per row, plus up to SPARE_PORTS spares. Renaming
+only works on ALSA and JACK (see RENAMING_APIS); anywhere else, renames
+open a new port like before, and ports that are let go of get closed.
+"""
+
+import threading
+from ports import openOutPort, closePort
+
+# What clients and spare ports are called
+CLIENT_NAME = 'SwitchBox'
+SPARE_NAME = 'Spare (SwitchBox)'
+
+# How many ports to keep as spares
+SPARE_PORTS = 4
+
+# Backend APIs that can rename a port that's open (names of rtmidi's
+# API_ constants)
+RENAMING_APIS = ('API_LINUX_ALSA', 'API_UNIX_JACK')
+
+"""A row's output port, handed out by an OutputManager.
+
+Looks enough like an rtmidi.MidiOut for a RowElement to use it. Sending
+goes straight to the backend's port, so it's no slower than one.
+"""
+class SharedOutPort():
+    def __init__(self, manager):
+        self.manager = manager
+        self.port = None
+        self.name = None
+
+    def open_virtual_port(self, name):
+        self.port = self.manager.acquire(name)
+        self.name = name
+        self.send_message = self.port.send_message
+
+    def send_message(self, message):
+        raise RuntimeError('Port not open')
+
+    """Whether set_port_name() really renames this port.
+    """
+    def canRename(self):
+        return self.port is not None and self.manager.canRename(self.port)
+
+    def set_port_name(self, name):
+        self.port.set_port_name(name)
+        self.name = name
+
+    def is_port_open(self):
+        return self.port is not None
+
+    def close_port(self):
+        if self.port is None:
+            return
+        port = self.port
+        self.port = None
+        del self.send_message
+        self.manager.release(port, self.name)
+
+    def delete(self):
+        self.close_port()
+
+
+"""Hands out output ports, and keeps the backend clients behind them
+for reuse.
+"""
+class OutputManager():
+    """Arguments:
+    backend -- The MIDI backend module (normally rtmidi)
+    spares -- How many ports that have been let go of to keep
+    """
+    def __init__(self, backend, spares=SPARE_PORTS):
+        self.backend = backend
+        self.spareLimit = spares
+        self.renamingApis = set(getattr(backend, api) for api in RENAMING_APIS
+                                if hasattr(backend, api))
+        # Ports are handed out from the PortOpener's threads and let go
+        # of from the UI thread
+        self.lock = threading.Lock()
+        self.inUse = 0
+        # (name it had, port) for each spare, oldest first
+        self.spares = []
+        self.made = 0
+        self.reused = 0
+
+    """A new, unopened output port. Opening it gets it a backend port.
+    """
+    def port(self):
+        return SharedOutPort(self)
+
+    def makeClient(self):
+        return self.backend.MidiOut(name=CLIENT_NAME)
+
+    """Whether a backend port can be renamed while it's open.
+    """
+    def canRename(self, port):
+        if not hasattr(port, 'set_port_name'):
+            return False
+        try:
+            return port.get_current_api() in self.renamingApis
+        except AttributeError:
+            return False
+
+    """Get an open backend port called name: the spare that had that
+    name, or failing that, a new client.
+    """
+    def acquire(self, name):
+        with self.lock:
+            spare = None
+            for n, (oldName, port) in enumerate(self.spares):
+                if oldName == name:
+                    spare = self.spares.pop(n)[1]
+                    break
+            if spare is not None:
+                self.inUse += 1
+                self.reused += 1
+        if spare is not None:
+            spare.set_port_name(name)
+            return spare
+        port = openOutPort(self.makeClient, name)
+        with self.lock:
+            self.inUse += 1
+            self.made += 1
+        return port
+
+    """Take a backend port back. It's kept as a spare if there's room
+    and it can be renamed, and closed if not.
+
+    Arguments:
+    port -- The backend port
+    name -- What it was called
+    """
+    def release(self, port, name):
+        isSpare = self.canRename(port)
+        if isSpare:
+            port.set_port_name(SPARE_NAME)
+        toClose = port
+        with self.lock:
+            self.inUse -= 1
+            if isSpare:
+                self.spares.append((name, port))
+                toClose = None
+                if len(self.spares) > self.spareLimit:
+                    toClose = self.spares.pop(0)[1]
+        if toClose is not None:
+            closePort(toClose)
+
+    """How many OS resources the ports are using.
+
+    Returns a dict of:
+    clients -- Backend clients held (each has one port)
+    inUse -- How many of those are rows' ports
+    spares -- How many are spares
+    made -- Clients made so far
+    reused -- Ports handed out by reusing a spare
+    """
+    def stats(self):
+        with self.lock:
+            return {'clients': self.inUse + len(self.spares),
+                    'inUse': self.inUse,
+                    'spares': len(self.spares),
+                    'made': self.made,
+                    'reused': self.reused}
+
+    """Close the spares. Rows' ports get closed as their rows do.
+    """
+    def stop(self):
+        with self.lock:
+            spares = self.spares
+            self.spares = []
+        for name, port in spares:
+            closePort(port)
@@ -0,0 +1,143 @@
+"""
+Panic for SwitchBox
+
+When notes get stuck on stage, panic shuts up every row at once. For
+each output port it sends, in one go:
+
+- a Note Off for every note we know is still held, for synths that
+  don't listen to the messages below
+- All Notes Off, All Sound Off and Reset All Controllers (which lets
+  go of the sustain pedal too) on every channel the port has used
+
+Each row keeps a NoteTracker on its way out, which is how we know what's
+held and which channels have been used. The messages all get worked
+out before the first one goes out, and the sending happens on the
+PanicButton's own thread, so nothing waits on the window.
+"""
+
+import sys
+import logging
+import threading
+from time import perf_counter
+
+# Number of MIDI channels
+CHANNELS = 16
+
+# All Notes Off, All Sound Off, Reset All Controllers
+PANIC_CONTROLLERS = (123, 120, 121)
+
+# The messages that reset each channel, made once. Nothing changes them
+# on the way out, so the same ones can be sent every time.
+CHANNEL_RESETS = tuple(tuple([0xB0 | channel, controller, 0]
+                             for controller in PANIC_CONTROLLERS)
+                       for channel in range(CHANNELS))
+
+"""Keeps track of the notes held and the channels used on one output.
+
+The notes are kept as channel * 128 + note, in a set. Only the thread
+sending to the output should wrap() it; panic can read it from
+anywhere.
+"""
+class NoteTracker():
+    """Arguments:
+    tracking -- False if the messages going out can't be seen (e.g.
+        they're routed in another process). Panic then resets all 16
+        channels, and can't send any Note Offs.
+    """
+    def __init__(self, tracking=True):
+        self.held = set()
+        self.used = bytearray(CHANNELS)
+        if not tracking:
+            self.used[:] = b'\x01' * CHANNELS
+
+    """Wrap a send function so everything it sends is tracked.
+    """
+    def wrap(self, send):
+        held = self.held
+        used = self.used
+
+        def tracked(message):
+            status = message[0]
+            if status < 0xF0:
+                used[status & 0x0F] = 1
+                kind = status & 0xF0
+                if kind == 0x90 and message[2]:
+                    held.add(((status & 0x0F) << 7) | message[1])
+                elif kind == 0x80 or kind == 0x90:
+                    held.discard(((status & 0x0F) << 7) | message[1])
+            send(message)
+        return tracked
+
+    """Everything it takes to silence this output: Note Offs first,
+    then the channel resets. The notes are forgotten, since they're
+    about to be let go of.
+    """
+    def panicMessages(self):
+        # list() copies the set in one go, even if the MIDI thread's
+        # adding to it.
+        keys = list(self.held)
+        self.held.difference_update(keys)
+        messages = [[0x80 | (key >> 7), key & 0x7F, 0] for key in keys]
+        used = self.used
+        for channel in range(CHANNELS):
+            if used[channel]:
+                messages.extend(CHANNEL_RESETS[channel])
+        return messages
+
+
+"""Sends panic to every output on its own thread, whenever press() is
+called. Pressing it again before it's done just runs it once more.
+"""
+class PanicButton(threading.Thread):
+    """Arguments:
+    targets -- Function that returns a list of (send, NoteTracker)
+        pairs, one per output port. Called from the panic thread.
+    """
+    def __init__(self, targets):
+        threading.Thread.__init__(self, name='SwitchBox panic',
+                                  daemon=True)
+        self.targets = targets
+        self.pressed = threading.Event()
+        self.running = True
+        self.start()
+
+    """Panic. Safe to call from any thread, including MIDI callbacks.
+    """
+    def press(self):
+        self.pressed.set()
+
+    def stop(self):
+        self.running = False
+        self.pressed.set()
+
+    """Send panic to every output right now, on this thread.
+
+    Returns how many messages went out, and how long it took (seconds).
+    """
+    def fire(self):
+        start = perf_counter()
+        batches = [(send, tracker.panicMessages())
+                   for send, tracker in self.targets()]
+        sent = 0
+        for send, messages in batches:
+            for message in messages:
+                try:
+                    send(message)
+                except:
+                    # A port that's gone shouldn't stop the rest
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.warning(exc_type.__name__ + ': ' +
+                                    str(exc_obj) + ": Couldn't send panic")
+                    break
+                sent += 1
+        return sent, perf_counter() - start
+
+    def run(self):
+        while True:
+            self.pressed.wait()
+            self.pressed.clear()
+            if not self.running:
+                return
+            sent, elapsed = self.fire()
+            logging.warning('Panic! Sent {0} messages in {1:.3f} ms'.format(
+                sent, elapsed * 1000))
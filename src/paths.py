@@ -0,0 +1,28 @@
+"""
+Where SwitchBox keeps its files
+
+The window, the terminal front end and the control API all work out of
+the same folder, so they all get it from here.
+"""
+
+import os
+from platform import system
+
+# Location of user's home path
+PATH_HOME = os.path.expanduser('~')
+
+# Where SwitchBox stores its temporary files
+if system() == 'Darwin':
+    PATH_SWITCHBOXFILES = PATH_HOME + '/Library/Application Support/SwitchBox'
+else:
+    PATH_SWITCHBOXFILES = PATH_HOME + '/SwitchBox'
+
+# Location of persistent settings file
+PATH_CURRENT_XML = PATH_SWITCHBOXFILES + '/current.xml'
+
+"""Make the folder SwitchBox keeps its files in, if it isn't there yet
+(the first time SwitchBox runs on a machine).
+"""
+def makeFilesFolder():
+    if not os.path.isdir(PATH_SWITCHBOXFILES):
+        os.makedirs(PATH_SWITCHBOXFILES)
@@ -0,0 +1,202 @@
+"""
+Port opening for SwitchBox
+
+Opening a row's ports means making a couple of backend clients, opening
+a virtual output, looking through the devices that are plugged in and
+reconnecting to the one the row was using last time. Any of that can be
+slow (USB enumeration especially), and doing it row after row made
+startup take longer with every row in the save file.
+
+A PortOpener does it on a small pool of threads instead. Rows come up
+with their widgets straight away, and light up whenever their ports are
+ready.
+"""
+
+import sys
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from routing import applyFilter
+from devices import findDevice
+
+"""A row's freshly opened ports.
+
+inport -- The MidiIn, open on the saved device if it was found
+outport -- The output port, with its virtual port open
+devices -- The input devices that were there, in port order
+device -- Index of the device inport is open on, or None
+error -- What went wrong, as text, or None
+"""
+RowPorts = namedtuple('RowPorts', ['inport', 'outport', 'devices', 'device',
+                                   'error'])
+
+"""Open one row's ports. Safe to call from any thread.
+
+Arguments:
+backend -- The MIDI backend module (normally rtmidi)
+makeOutPort -- Function that makes the row's output port
+portName -- Name for the row's virtual output port
+savedDevice -- Name of the input device to reconnect to, or None
+savedOrdinal -- Which of the devices with that name it was (see 
+    devices.fingerprints), or None
+filters -- The row's MidiFilter, for the backend to apply
+devices -- The input devices, if they've been looked up already
+makeInPort -- Function that makes the row's input port, if it isn't
+    one of the backend's (see netmidi.py). It lists its own devices.
+
+Returns a RowPorts.
+"""
+def openRowPorts(backend, makeOutPort, portName, savedDevice, savedOrdinal,
+                 filters, devices=None, makeInPort=None):
+    inport = None
+    outport = None
+    device = None
+    try:
+        if makeInPort is None:
+            inport = backend.MidiIn()
+        else:
+            inport = makeInPort()
+        applyFilter(inport, filters)
+        outport = makeOutPort()
+        outport.open_virtual_port(portName)
+        if devices is None or makeInPort is not None:
+            devices = inport.get_ports()
+        device = findDevice(devices, savedDevice, savedOrdinal)
+        if device is not None:
+            inport.open_port(device)
+        return RowPorts(inport, outport, devices, device, None)
+    except:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        error = exc_type.__name__ + ': ' + str(exc_obj)
+        logging.warning(str(exc_tb.tb_lineno) + ':' + error +
+                        ": Couldn't open ports for " + portName)
+        return RowPorts(inport, outport, devices or [], None, error)
+
+
+"""Open an output port under a new name, e.g. for a row that's been
+renamed. If the port can't be opened, its backend client is let go of
+before the error's passed on, instead of whenever it gets collected.
+
+Arguments:
+makeOutPort -- Function that makes the port
+portName -- Name for the virtual port
+"""
+def openOutPort(makeOutPort, portName):
+    port = makeOutPort()
+    try:
+        port.open_virtual_port(portName)
+    except:
+        closePort(port)
+        raise
+    return port
+
+"""Give an output port a new name, e.g. for a row that's been renamed.
+Ports that can be renamed where they are (see outputs.py) are, and keep
+their connections. Anything else gets a new port opened under the new
+name, for the caller to swap in before closing the old one.
+
+Arguments:
+port -- The port to rename
+makeOutPort -- Function that makes a new port, if it comes to that
+portName -- The new name for the virtual port
+
+Returns the port to use from now on.
+"""
+def renameOutPort(port, makeOutPort, portName):
+    canRename = getattr(port, 'canRename', None)
+    if canRename is not None and canRename():
+        port.set_port_name(portName)
+        return port
+    return openOutPort(makeOutPort, portName)
+
+"""Close a port that's been replaced, and let go of its backend client
+right away.
+"""
+def closePort(port):
+    if port.is_port_open():
+        port.close_port()
+    # Ports living in a routing process don't have a client here
+    delete = getattr(port, 'delete', None)
+    if delete is not None:
+        delete()
+
+"""Point a row's input port at a device (e.g. the same one, after it's
+been unplugged and plugged back in).
+
+Arguments:
+inport -- The row's input port
+index -- The device's port number
+callback -- The row's MIDI callback
+"""
+def reopenInPort(inport, index, callback):
+    inport.close_port()
+    inport.open_port(index)
+    inport.set_callback(callback, None)
+
+
+"""Opens rows' ports on a pool of threads.
+"""
+class PortOpener():
+    """Arguments:
+    backend -- The MIDI backend module (normally rtmidi)
+    threads -- How many ports to open at once
+    """
+    def __init__(self, backend, threads):
+        self.backend = backend
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads),
+                                       thread_name_prefix='SwitchBox ports')
+        # One look through the devices, shared by everything opened
+        # while it's still fresh, instead of one per row.
+        self.scan = None
+        # Backend client for looking through the devices, and a lock
+        # so only one thread uses it at a time
+        self.scanner = None
+        self.scanLock = threading.Lock()
+
+    """Look through the input devices (once) for the rows being opened.
+    """
+    def scanDevices(self):
+        if self.scan is None:
+            self.scan = self.pool.submit(self.listDevices)
+        return self.scan
+
+    def listDevices(self):
+        with self.scanLock:
+            if self.scanner is None:
+                self.scanner = self.backend.MidiIn()
+            return self.scanner.get_ports()
+    
+    """Forget the shared device scan, so the next row opened looks
+    again. Call once startup's done; devices come and go after that.
+    """
+    def rescan(self):
+        self.scan = None
+
+    """Open a row's ports in the background.
+
+    Arguments are as for openRowPorts, plus:
+    onOpened -- Function that gets the RowPorts. Called from one of
+        the pool's threads.
+    """
+    def open(self, makeOutPort, portName, savedDevice, savedOrdinal, filters,
+             onOpened, makeInPort=None):
+        scan = self.scanDevices()
+
+        def job():
+            try:
+                devices = scan.result()
+            except:
+                devices = None
+            return openRowPorts(self.backend, makeOutPort, portName,
+                                savedDevice, savedOrdinal, filters, devices,
+                                makeInPort)
+
+        def done(future):
+            onOpened(future.result())
+        self.pool.submit(job).add_done_callback(done)
+
+    """Stop the pool. Anything not opened yet is dropped.
+    """
+    def stop(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
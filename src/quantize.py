@@ -0,0 +1,360 @@
+"""
+Quantized channel switching for SwitchBox
+
+Normally a trigger switches the active channel the moment it comes in,
+so a pedal pressed a little early cuts the last bar off on the old
+sound. A row that follows MIDI clock can hold the switch back until the
+next beat or bar instead. Set it up in the save file:
+
+    <quantize to="bar" beats="4"/>
+
+to -- 'beat' or 'bar'
+beats -- Beats in a bar (default 4)
+
+The row keeps count of the clock (24 ticks a beat), and goes back to
+the top on a Start, or to wherever a Song Position Pointer says. When
+a trigger comes in, it works out when the next boundary is due from how
+fast the clock's been coming, and has the same scheduler that does
+fixed output latency (see timing.py) call for the switch right on time.
+The switch itself is handed to the row's routing thread, like everything
+else that changes the row's channel. If the boundary's tick gets here
+before that, the switch happens then. Rows that don't have a routing
+thread of ours (inline or process routing; see workers.py) always wait
+for the tick.
+
+Triggers go through right away, same as ever, when there isn't a clock
+to go by: nothing for a while (CLOCK_TIMEOUT_S), or a Stop. A trigger
+just after a boundary (within GRACE_TICKS) was meant for that one, and
+goes through right away too.
+
+Every scheduled switch is timed against the tick it was meant to land
+on, and the figures go in the row's timing report. Switches the tick
+did itself are just counted: there's nothing to time them against but
+the tick they happened on.
+"""
+
+import threading
+from collections import namedtuple
+from time import perf_counter
+from timing import LatencyStats, sharedScheduler
+
+QUANTIZE_BEAT = 'beat'
+QUANTIZE_BAR = 'bar'
+
+# MIDI clock ticks in a beat, and in each step of a Song Position
+# Pointer (a sixteenth note)
+TICKS_PER_BEAT = 24
+TICKS_PER_POSITION = 6
+
+# No clock for this long (seconds) means it's stopped
+CLOCK_TIMEOUT_S = 0.5
+
+# A trigger this many ticks after a boundary switches right away
+GRACE_TICKS = 2
+
+# How much each tick counts towards the tempo, which is smoothed over
+# about a beat so one late tick doesn't throw the timing off
+TEMPO_SMOOTHING = 1 / TICKS_PER_BEAT
+
+"""A row's quantize setting.
+
+to -- QUANTIZE_BEAT or QUANTIZE_BAR
+beats -- Beats in a bar
+"""
+class Quantize(namedtuple('Quantize', ['to', 'beats'])):
+    __slots__ = ()
+
+"""Read a row's quantize setting out of its XML element.
+
+Returns a Quantize, or None if the row doesn't have one (or it doesn't
+make sense).
+"""
+def readQuantize(XMLElement):
+    element = XMLElement.find('quantize')
+    if element is None:
+        return None
+    to = element.get('to', QUANTIZE_BAR)
+    beats = element.get('beats', '4')
+    if (to not in (QUANTIZE_BEAT, QUANTIZE_BAR) or not beats.isdigit() or
+            not 1 <= int(beats) <= 32):
+        return None
+    return Quantize(to, int(beats))
+
+"""A switch waiting for its boundary.
+
+channel -- The channel to switch to, from zero
+switch -- The dispatch function's switch, which takes the channel
+boundary -- The tick it should happen on
+due -- When that tick's expected, on the perf_counter clock, or None
+    if it's being left to the tick itself
+serial -- Which request it was, so a scheduled switch that's been
+    overtaken knows to do nothing
+"""
+Pending = namedtuple('Pending', ['channel', 'switch', 'boundary', 'due',
+                                 'serial'])
+
+
+"""Follows a row's MIDI clock, and holds trigger switches back to the
+next boundary.
+
+tick() and transport() are only called by the thread routing the row,
+and have to be quick: tick() runs 24 times a beat. Every switch happens
+on that thread too; the output scheduler only says when.
+"""
+class ClockTracker():
+    """Arguments:
+    quantize -- The row's Quantize
+    onRoutingThread -- Function that runs a function on the thread
+        routing the row (see workers.RoutingWorkers.caller), or None if
+        there isn't one, in which case switches wait for their tick
+    """
+    def __init__(self, quantize, onRoutingThread=None):
+        self.quantize = quantize
+        self.step = TICKS_PER_BEAT * (quantize.beats
+                                      if quantize.to == QUANTIZE_BAR else 1)
+        self.onRoutingThread = onRoutingThread
+        self.ticks = -1       # Where the last tick was, from the top
+        self.lastTick = None  # When it came in
+        self.period = None    # Seconds between ticks, smoothed
+        self.running = True   # Until a Stop says otherwise
+        self.lock = threading.Lock()
+        self.pending = None   # The Pending switch, if there is one
+        self.serial = 0
+        # (boundary, when it switched) for the last switch, until its
+        # tick comes in and it can be timed
+        self.measuring = None
+        # How far scheduled switches were from their tick, either way
+        self.offBeat = LatencyStats()
+        self.early = 0        # How many of those went before the tick
+        self.onTick = 0       # Switches the tick did itself
+        # How late the scheduler was, against when it was asked for
+        self.schedulerLate = LatencyStats()
+        self.immediate = 0    # Triggers that couldn't be quantized
+
+    """A clock tick (0xF8) came in.
+    """
+    def tick(self):
+        now = perf_counter()
+        last = self.lastTick
+        self.lastTick = now
+        self.ticks += 1
+        if last is not None:
+            gap = now - last
+            if gap > CLOCK_TIMEOUT_S:
+                self.period = None
+            elif self.period is None:
+                self.period = gap
+            else:
+                self.period += (gap - self.period) * TEMPO_SMOOTHING
+        if self.pending is not None or self.measuring is not None:
+            self.reachedTick(now)
+
+    """See whether the tick that just came in is one something's
+    waiting on.
+    """
+    def reachedTick(self, now):
+        switch = None
+        with self.lock:
+            pending = self.pending
+            if pending is not None and self.ticks >= pending.boundary:
+                # Got here before the scheduler did
+                self.pending = None
+                switch = pending
+            measuring = self.measuring
+            if measuring is not None and self.ticks >= measuring[0]:
+                self.measuring = None
+        if switch is not None:
+            # No figure for this one: it's on the tick by definition
+            switch.switch(switch.channel)
+            self.onTick += 1
+        elif measuring is not None and self.ticks == measuring[0]:
+            error = measuring[1] - now
+            if error < 0:
+                self.early += 1
+            self.offBeat.add(abs(error))
+
+    """A Start (0xFA), Continue (0xFB), Stop (0xFC) or Song Position
+    Pointer (0xF2) came in.
+    """
+    def transport(self, message):
+        status = message[0]
+        if status == 0xFC:
+            self.running = False
+            # Nothing to wait for now
+            self.flush()
+            return
+        if status == 0xFA:
+            self.ticks = -1
+        elif status == 0xF2 and len(message) > 2:
+            self.ticks = ((message[2] << 7) | message[1]) * \
+                TICKS_PER_POSITION - 1
+        self.running = True
+        # Whatever was waiting goes on the next boundary from here, and
+        # that tick has to do it; the scheduler's guess is off now
+        with self.lock:
+            self.measuring = None
+            pending = self.pending
+            if pending is not None:
+                self.serial += 1
+                self.pending = pending._replace(
+                    boundary=self.nextBoundary(), due=None,
+                    serial=self.serial)
+
+    """The first boundary after the last tick.
+    """
+    def nextBoundary(self):
+        return self.ticks - self.ticks % self.step + self.step
+
+    """Whether there's a clock to go by.
+    """
+    def isSynced(self, now):
+        return (self.running and self.period is not None and
+                now - self.lastTick < CLOCK_TIMEOUT_S)
+
+    """Hold a trigger's switch back to the next boundary.
+
+    Arguments:
+    channel -- The channel to switch to, from zero
+    switch -- Function that switches to a channel
+
+    Returns False if it should happen right away instead.
+    """
+    def request(self, channel, switch):
+        now = perf_counter()
+        if not self.isSynced(now):
+            self.immediate += 1
+            self.cancel()
+            return False
+        position = self.ticks % self.step
+        if self.ticks >= 0 and position < GRACE_TICKS:
+            self.immediate += 1
+            self.cancel()
+            return False
+        boundary = self.nextBoundary()
+        with self.lock:
+            pending = self.pending
+            if pending is not None and pending.boundary == boundary:
+                # Changed its mind before the boundary. The latest one
+                # wins, and the switch that's scheduled already does it.
+                self.pending = pending._replace(channel=channel,
+                                                switch=switch)
+                return True
+            self.serial += 1
+            due = None
+            if self.onRoutingThread is not None:
+                due = self.lastTick + (boundary - self.ticks) * self.period
+            self.pending = Pending(channel, switch, boundary, due,
+                                   self.serial)
+        if due is not None:
+            sharedScheduler().schedule(due, self.due, self.serial, None)
+        return True
+
+    """A scheduled switch's time has come. Runs on the output
+    scheduler's thread, so it only passes the switch on to the routing
+    thread.
+
+    Arguments:
+    serial -- Which request it was scheduled for
+    """
+    def due(self, serial):
+        self.onRoutingThread(self.fire, serial)
+
+    """Switch, if the switch that was scheduled for now is still
+    waiting. Runs on the routing thread.
+
+    Arguments:
+    serial -- Which request it was scheduled for
+    """
+    def fire(self, serial):
+        now = perf_counter()
+        with self.lock:
+            pending = self.pending
+            if pending is None or pending.serial != serial:
+                return
+            self.pending = None
+            self.measuring = (pending.boundary, now)
+        # Counts getting here from the scheduler's thread, too
+        self.schedulerLate.add(now - pending.due)
+        pending.switch(pending.channel)
+
+    """Forget the switch that's waiting, e.g. because the channel was
+    changed some other way.
+    """
+    def cancel(self):
+        with self.lock:
+            self.pending = None
+
+    """Do the switch that's waiting right now, if there is one.
+    """
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = None
+            self.measuring = None
+        if pending is not None:
+            self.immediate += 1
+            pending.switch(pending.channel)
+
+    """The tempo, in beats per minute, or None without a clock.
+    """
+    def tempo(self):
+        period = self.period
+        if period is None or period <= 0:
+            return None
+        return 60 / (period * TICKS_PER_BEAT)
+
+    """The figures, for the control API. Times are in milliseconds.
+    """
+    def stats(self):
+        tempo = self.tempo()
+        return {'to': self.quantize.to,
+                'beats': self.quantize.beats,
+                'bpm': round(tempo, 1) if tempo is not None else None,
+                'switches': self.offBeat.count + self.onTick,
+                'immediate': self.immediate,
+                'onTick': self.onTick,
+                'early': self.early,
+                'meanMs': self.offBeat.mean * 1000,
+                'worstMs': self.offBeat.worst * 1000,
+                'schedulerLateMs': self.schedulerLate.mean * 1000}
+
+    """One line of text for humans.
+    """
+    def summary(self):
+        tempo = self.tempo()
+        text = 'Quantized to the {0} ({1})'.format(
+            self.quantize.to,
+            'no clock' if tempo is None else '{0:.1f} BPM'.format(tempo))
+        if self.offBeat.count == 0:
+            if self.onTick == 0:
+                return text + ', no switches yet'
+            return text + ': {0} switches, all on the tick'.format(
+                self.onTick)
+        return text + (': {0} scheduled switches, off the beat by mean '
+                       '{1:.3f} ms, worst {2:.3f} ms ({3} early), '
+                       'scheduler late by mean {4:.3f} ms; {5} on the '
+                       'tick').format(
+                           self.offBeat.count, self.offBeat.mean * 1000,
+                           self.offBeat.worst * 1000, self.early,
+                           self.schedulerLate.mean * 1000, self.onTick)
+
+"""Get the clock tracker a row's dispatch function should use.
+
+Like the voice allocator (see voices.allocatorFor), it belongs to the
+row, so the count carries on when the routing table's swapped for
+another. It only gets replaced when the setting itself changes.
+
+Arguments:
+row -- The row (or whatever the dispatch function works for). Its
+    onRoutingThread, if it has one, lets switches be scheduled.
+quantize -- The routing table's Quantize, or None
+"""
+def clockFor(row, quantize):
+    if quantize is None:
+        return None
+    tracker = getattr(row, 'clock', None)
+    if tracker is None or tracker.quantize != quantize:
+        tracker = ClockTracker(quantize,
+                               getattr(row, 'onRoutingThread', None))
+        row.clock = tracker
+    return tracker
@@ -0,0 +1,628 @@
+"""
+Routing tables for SwitchBox
+
+Everything the MIDI callback needs to know about a row's bindings is
+boiled down into a RowRouting: a small, immutable set of lookup tables
+indexed directly by CC or note number. The UI builds a new one whenever
+something changes and swaps it in, so the callback never has to walk
+the ColumnElements or touch the XML to make a routing decision.
+"""
+
+from collections import namedtuple
+from voices import DROP, allocatorFor
+from quantize import clockFor
+
+# Number of distinct CC numbers/note numbers a MIDI message can carry
+MIDI_VALUES = 128
+
+# What an input filter can do with a kind of message:
+# drop -- Throw it away, at the MIDI backend if it knows how.
+# pass -- Send it out exactly the way it came in.
+# route -- Send it out on the row's active channel, like keys and CCs.
+#     Only makes sense for channel messages (aftertouch, program 
+#     change); anything else is passed through as-is.
+FILTER_DROP = 'drop'
+FILTER_PASS = 'pass'
+FILTER_ROUTE = 'route'
+
+"""What a row does with the kinds of messages it doesn't route itself.
+
+clock -- MIDI clock and timecode (0xF8, 0xF1)
+sense -- Active Sensing (0xFE)
+sysex -- System Exclusive (0xF0 ... 0xF7)
+at -- Aftertouch, both polyphonic (0xAn) and channel pressure (0xDn)
+pc -- Program Change (0xCn)
+
+Each one is FILTER_DROP, FILTER_PASS or FILTER_ROUTE.
+"""
+class MidiFilter(namedtuple('MidiFilter', ['clock', 'sense', 'sysex', 'at',
+                                           'pc'])):
+    __slots__ = ()
+
+# What rows do unless told otherwise. The clock, Active Sensing and 
+# SysEx settings match what rtmidi does on its own.
+DEFAULT_FILTER = MidiFilter(FILTER_DROP, FILTER_DROP, FILTER_DROP, 
+                            FILTER_PASS, FILTER_PASS)
+
+"""An immutable routing table for one row.
+
+triggers -- Tuple of 128 entries. Entry n is the (zero-based) channel
+    that CC n activates, or None.
+faders -- Tuple of 128 entries. Entry n is the (zero-based) channel
+    that CC n is forwarded to as a fader, or None.
+keymap -- Tuple of 128 entries. Entry n is the (zero-based) channel a
+    split sends note n to, or None to follow the active channel.
+padchannel -- The pad channel as the user typed it (starting from 1),
+    or None.
+splits -- The splits the keymap was built from, as (low, high, channel)
+    tuples with a zero-based channel. Kept around for saving.
+channel -- The (zero-based) channel the row should switch to when this
+    table is put into service, or None to stay on the current channel.
+listenChannel -- The (zero-based) channel waiting to learn a binding,
+    or None if the row isn't listening.
+listenFor -- 'T' if it's learning a trigger, 'F' for a fader, or None.
+filters -- The row's MidiFilter
+panic -- CC number that sets off panic (any value but 0), or None
+voices -- The row's VoicePool (see voices.py), or None to send keys to
+    the active channel
+quantize -- The row's Quantize (see quantize.py), or None to switch
+    channels the moment a trigger comes in
+"""
+class RowRouting(namedtuple('RowRouting', ['triggers', 'faders', 'keymap',
+                                           'padchannel', 'splits',
+                                           'channel', 'listenChannel',
+                                           'listenFor', 'filters',
+                                           'panic', 'voices',
+                                           'quantize'])):
+    __slots__ = ()
+
+"""Build a RowRouting out of a row's settings.
+
+When two channels are bound to the same CC, the one that comes later
+wins, same as the old column-by-column search in the MIDI callback.
+
+Arguments:
+bindings -- Iterable of (channel, trigger, fader) tuples, where channel
+    starts from zero and trigger/fader are CC numbers or None.
+padchannel -- The pad channel (starting from 1), or None.
+splits -- Iterable of (low, high, channel) tuples, channel from zero.
+channel -- Channel to switch to when the table is activated, or None.
+listenChannel -- Channel (from zero) that's learning a binding, or None
+listenFor -- 'T' or 'F' for what it's learning, or None
+filters -- The row's MidiFilter
+panic -- CC number that sets off panic, or None
+voices -- The row's VoicePool, or None
+quantize -- The row's Quantize, or None
+"""
+def buildRouting(bindings, padchannel=None, splits=(), channel=None,
+                 listenChannel=None, listenFor=None, 
+                 filters=DEFAULT_FILTER, panic=None, voices=None,
+                 quantize=None):
+    triggers = [None] * MIDI_VALUES
+    faders = [None] * MIDI_VALUES
+    keymap = [None] * MIDI_VALUES
+    for whichChannel, trigger, fader in bindings:
+        if trigger is not None and 0 <= trigger < MIDI_VALUES:
+            triggers[trigger] = whichChannel
+        if fader is not None and 0 <= fader < MIDI_VALUES:
+            faders[fader] = whichChannel
+    splits = tuple(splits)
+    # Earlier splits take priority if they overlap, so fill backwards.
+    for low, high, whichChannel in reversed(splits):
+        for note in range(max(low, 0), min(high, MIDI_VALUES - 1) + 1):
+            keymap[note] = whichChannel
+    return RowRouting(tuple(triggers), tuple(faders), tuple(keymap),
+                      padchannel, splits, channel, listenChannel, listenFor,
+                      filters, panic, voices, quantize)
+
+# A row with nothing bound to it. Used until a row has loaded its
+# settings, since MIDI can show up before the constructor finishes.
+EMPTY_ROUTING = buildRouting(())
+
+"""Read keyboard splits out of a row's XML element.
+
+A split looks like <split lo="0" hi="47" chan="2"/>, which sends every
+key from note 0 to note 47 to channel 2 no matter which channel is
+active. Anything malformed is skipped.
+
+Arguments:
+XMLElement -- The XML element of a row (or a row inside a scene)
+num_cols -- Number of channels in the row, for range checking.
+
+Returns a list of (low, high, channel) tuples with zero-based channels.
+"""
+def readSplits(XMLElement, num_cols):
+    splits = []
+    for element in XMLElement:
+        if element.tag != 'split':
+            continue
+        low = element.get('lo', '')
+        high = element.get('hi', '')
+        chan = element.get('chan', '')
+        if (low.isdigit() and high.isdigit() and chan.isdigit() and
+            int(chan) - 1 in range(num_cols) and int(low) <= int(high)):
+            splits.append((int(low), int(high), int(chan) - 1))
+    return splits
+
+"""Read a row's input filter out of its XML element.
+
+The filter looks like <filter clock="drop" sense="drop" sysex="pass" 
+at="route" pc="pass"/>. Anything left out (or nonsense) gets the default.
+
+Arguments:
+XMLElement -- The XML element of a row
+"""
+def readFilter(XMLElement):
+    element = XMLElement.find('filter')
+    if element is None:
+        return DEFAULT_FILTER
+    settings = []
+    for field, default in zip(MidiFilter._fields, DEFAULT_FILTER):
+        value = element.get(field)
+        if value not in (FILTER_DROP, FILTER_PASS, FILTER_ROUTE):
+            value = default
+        settings.append(value)
+    return MidiFilter(*settings)
+
+"""Push as much of a filter as possible down to the MIDI backend.
+
+rtmidi can throw away SysEx, clock and Active Sensing before they ever
+make it to Python. Everything else has to be filtered by the dispatch 
+function. Backends that can't filter at all are left alone.
+
+Arguments:
+inport -- The row's input port
+filters -- The row's MidiFilter
+"""
+def applyFilter(inport, filters):
+    try:
+        inport.ignore_types(sysex=filters.sysex == FILTER_DROP,
+                            timing=filters.clock == FILTER_DROP,
+                            active_sense=filters.sense == FILTER_DROP)
+    except AttributeError:
+        pass
+
+"""The filter the MIDI backend should apply for a row: the row's own,
+except that a row that quantizes its switches has to see the clock,
+whatever it does with it afterwards.
+
+Arguments:
+filters -- The row's MidiFilter
+quantize -- The row's Quantize, or None
+"""
+def backendFilter(filters, quantize):
+    if quantize is None or filters.clock != FILTER_DROP:
+        return filters
+    return filters._replace(clock=FILTER_PASS)
+
+"""Read channel bindings out of a row's XML element.
+
+Arguments:
+XMLElement -- The XML element of a row (or a row inside a scene)
+num_cols -- Number of channels in the row. The last one is the pad.
+
+Returns a tuple (bindings, padchannel), where bindings is a list of
+(channel, trigger, fader) tuples with zero-based channels.
+"""
+def readBindings(XMLElement, num_cols):
+    bindings = []
+    padchannel = None
+    for element in XMLElement:
+        if element.tag != 'ch':
+            continue
+        chan = element.get('chan')
+        trig = element.get('t')
+        fade = element.get('f')
+        pad = element.get('pad')
+        if chan is None or not chan.isdigit():
+            continue
+        if int(chan) - 1 not in range(num_cols):
+            continue
+        isPad = int(chan) == num_cols
+        trigger = (int(trig) if trig is not None and trig.isdigit()
+                   and not isPad else None)
+        fader = int(fade) if fade is not None and fade.isdigit() else None
+        if isPad and pad is not None and pad.isdigit():
+            padchannel = int(pad)
+        bindings.append((int(chan) - 1, trigger, fader))
+    return bindings, padchannel
+
+"""Make a dispatch function that routes by looking everything up as it
+goes, message by message.
+
+This is the straightforward way of doing things, and does exactly what
+the compiled version (see compileDispatch) does. It's kept around so the
+two can be compared, and for when ROUTING_COMPILE is switched off.
+
+Arguments:
+routing -- The RowRouting to route with
+row -- The object the dispatch function works for. It needs:
+    activeChannel -- zero-based channel, read and written
+    voices -- the row's VoiceAllocator, if it has a voice pool. Set by
+        the dispatch function.
+    onLearnReceived(routing, cc) -- a CC arrived while listening
+    onTriggered() -- a trigger changed activeChannel
+    clock -- the row's ClockTracker, if it quantizes switches. Set by
+        the dispatch function.
+    onFaderMoved(channel) -- a fader was sent to channel
+    onSceneRequested(index, scenes) -- a message asked for a scene
+    onPanicRequested() -- the panic CC arrived
+send -- Function that sends a message (a list of ints) out
+scenes -- The SceneBook to watch for scene changes, or None
+
+Returns a function that takes a MIDI message (a list of ints).
+"""
+def genericDispatch(routing, row, send, scenes=None):
+    filters = routing.filters
+    voices = allocatorFor(row, routing.voices)
+    clock = clockFor(row, routing.quantize)
+
+    # Trigger switches, right away or on the beat
+    def switch(target):
+        send([(0b1011 << 4) + row.activeChannel, 123, 0])
+        row.activeChannel = target
+        row.onTriggered()
+
+    # Pitch bend, pressure and CCs, when the row has a voice pool: to
+    # the channel of the note they're about, or else to all of them.
+    def express(channel, data):
+        target = voices.expression(channel)
+        if target is None:
+            for target in voices.channels:
+                send([(data[0] << 4) + target] + data[1:])
+        else:
+            data[0] = (data[0] << 4) + target
+            send(data)
+
+    def dispatch(message):
+        status = message[0]
+
+        # The clock keeps count even while learning
+        if clock is not None:
+            if status == 0xF8:
+                clock.tick()
+            elif (status == 0xFA or status == 0xFB or status == 0xFC or
+                  status == 0xF2):
+                clock.transport(message)
+
+        if routing.listenChannel is not None:
+            if status >> 4 == 0b1011:
+                row.onLearnReceived(routing, message[1])
+            return
+
+        # SysEx, clock and the rest of the system messages don't have a
+        # channel, so there's nothing to re-route. They go straight out
+        # (or get dropped) as the very same object that came in, which
+        # matters when it's a 64 KB patch dump.
+        if status >= 0xF0:
+            if status == 0xF0 and filters.sysex == FILTER_DROP:
+                return
+            if (status == 0xF8 or status == 0xF1) and filters.clock == FILTER_DROP:
+                return
+            if status == 0xFE and filters.sense == FILTER_DROP:
+                return
+            send(message)
+            return
+
+        channel = status & 0x0F
+        data = [status >> 4] + message[1:]
+
+        if (scenes is not None and data[0] == 0b1100 and
+              len(data) > 1 and scenes.byProgram[data[1]] is not None):
+            row.onSceneRequested(scenes.byProgram[data[1]], scenes)
+
+        elif (scenes is not None and data[0] == 0b1011 and
+              data[1] == scenes.cc):
+            if data[2] < len(scenes):
+                row.onSceneRequested(data[2], scenes)
+
+        elif data[0] == 0b1011 and data[1] == routing.panic:
+            if data[2]:
+                row.onPanicRequested()
+
+        elif channel + 1 == routing.padchannel:
+            pass
+
+        elif data[0] == 0b1011:
+            foundTrigger = routing.triggers[data[1]]
+            foundFader = routing.faders[data[1]]
+            if foundTrigger is not None:
+                if clock is None or not clock.request(foundTrigger, switch):
+                    switch(foundTrigger)
+            elif foundFader is not None:
+                data[0] = (data[0] << 4) + foundFader
+                send(data)
+                row.onFaderMoved(foundFader)
+            elif voices is not None:
+                express(channel, data)
+            else:
+                data[0] = (data[0] << 4) + row.activeChannel
+                send(data)
+
+        elif data[0] == 0b1000 or data[0] == 0b1001:
+            target = routing.keymap[data[1]]
+            if target is None and voices is not None:
+                if data[0] == 0b1001 and data[2]:
+                    target = voices.noteOn(channel, data[1], send)
+                else:
+                    target = voices.noteOff(channel, data[1])
+                    if target == DROP:
+                        return
+            if target is None:
+                target = row.activeChannel
+            data[0] = (data[0] << 4) + target
+            send(data)
+
+        elif ((data[0] == 0b1010 or data[0] == 0b1101) and
+              voices is not None):
+            if filters.at != FILTER_DROP:
+                if data[0] == 0b1010:
+                    target = routing.keymap[data[1]]
+                    if target is None:
+                        target = voices.noteChannel(channel, data[1])
+                    if target is None:
+                        target = row.activeChannel
+                    data[0] = (data[0] << 4) + target
+                    send(data)
+                else:
+                    express(channel, data)
+
+        elif data[0] == 0b1010 or data[0] == 0b1101:
+            if filters.at == FILTER_ROUTE:
+                # Poly aftertouch follows its key through splits
+                target = None
+                if data[0] == 0b1010:
+                    target = routing.keymap[data[1]]
+                if target is None:
+                    target = row.activeChannel
+                data[0] = (data[0] << 4) + target
+                send(data)
+            elif filters.at == FILTER_PASS:
+                send(message)
+
+        elif data[0] == 0b1100:
+            if filters.pc == FILTER_ROUTE:
+                data[0] = (data[0] << 4) + row.activeChannel
+                send(data)
+            elif filters.pc == FILTER_PASS:
+                send(message)
+
+        elif data[0] == 0b1110 and voices is not None:
+            express(channel, data)
+
+        else:
+            send(message)
+    return dispatch
+
+"""Compile a RowRouting into a dispatch function made just for it.
+
+Instead of checking every feature on every message, this writes out the
+source for a function that only contains the checks this particular
+table needs: a row without a pad channel never looks for one, a row
+without faders never looks up a fader, a row without splits sends keys
+straight to the active channel, and so on. A row that's listening for a
+binding gets a function that does nothing but listen. Only a row that
+quantizes its switches (see quantize.py) keeps count of the clock.
+
+Nothing gets copied on the way through. System messages (SysEx and 
+friends) are sent on as the same object that came in, and re-routed 
+channel messages just get their status byte changed in place. That 
+means the message passed in must not be used again afterwards; the 
+lists rtmidi hands its callbacks are brand new every time, so that's
+fine.
+
+Takes the same arguments and returns the same kind of function as
+genericDispatch, so the two can be swapped for each other. The routing
+table and scenes get baked into the function, so a new one has to be
+compiled whenever either one changes.
+"""
+def compileDispatch(routing, row, send, scenes=None):
+    lines = ['def dispatch(message):',
+             '    status = message[0]']
+
+    if routing.quantize is not None:
+        # The clock keeps count even while learning
+        lines += ['    if status >= 0xF0:',
+                  '        if status == 0xF8:',
+                  '            tick()',
+                  '        elif (status == 0xFA or status == 0xFB or '
+                  'status == 0xFC or',
+                  '              status == 0xF2):',
+                  '            transport(message)']
+
+    if routing.listenChannel is not None:
+        # Listening swallows everything. CCs get learned.
+        lines += ['    if status & 0xF0 == 0xB0:',
+                  '        learned(routing, message[1])']
+        return _buildDispatch(lines, routing, row, send, scenes)
+
+    filters = routing.filters
+    hasPrograms = (scenes is not None and
+                   any(index is not None for index in scenes.byProgram))
+    hasSceneCC = scenes is not None and scenes.cc is not None
+    hasTriggers = any(target is not None for target in routing.triggers)
+    hasFaders = any(target is not None for target in routing.faders)
+    hasSplits = any(target is not None for target in routing.keymap)
+    hasVoices = routing.voices is not None
+
+    # System messages first, before anything looks at channels. The 
+    # backend usually drops the unwanted ones already (see applyFilter),
+    # but not every backend can.
+    lines += ['    if status >= 0xF0:']
+    if filters.sysex == FILTER_DROP:
+        lines += ['        if status == 0xF0:',
+                  '            return']
+    if filters.clock == FILTER_DROP:
+        lines += ['        if status == 0xF8 or status == 0xF1:',
+                  '            return']
+    if filters.sense == FILTER_DROP:
+        lines += ['        if status == 0xFE:',
+                  '            return']
+    lines += ['        send(message)',
+              '        return',
+              '    kind = status & 0xF0']
+
+    if hasPrograms:
+        lines += ['    if kind == 0xC0 and len(message) > 1:',
+                  '        index = byProgram[message[1]]',
+                  '        if index is not None:',
+                  '            scene(index, scenes)',
+                  '            return']
+    if hasSceneCC:
+        lines += ['    if kind == 0xB0 and message[1] == %d:' % scenes.cc,
+                  '        if message[2] < %d:' % len(scenes),
+                  '            scene(message[2], scenes)',
+                  '        return']
+    if routing.panic is not None:
+        lines += ['    if kind == 0xB0 and message[1] == %d:' % routing.panic,
+                  '        if message[2]:',
+                  '            panic()',
+                  '        return']
+    if routing.padchannel is not None and 1 <= routing.padchannel <= 16:
+        lines += ['    if status & 0x0F == %d:' % (routing.padchannel - 1),
+                  '        return']
+
+    lines += ['    if kind == 0xB0:']
+    if hasTriggers:
+        lines += ['        target = triggers[message[1]]',
+                  '        if target is not None:']
+        if routing.quantize is not None:
+            lines += ['            if quantized(target, switch):',
+                      '                return']
+        lines += ['            send([0xB0 | row.activeChannel, 123, 0])',
+                  '            row.activeChannel = target',
+                  '            triggered()',
+                  '            return']
+    if hasFaders:
+        lines += ['        target = faders[message[1]]',
+                  '        if target is not None:',
+                  '            message[0] = 0xB0 | target',
+                  '            send(message)',
+                  '            faded(target)',
+                  '            return']
+    if hasVoices:
+        lines += _expressionLines('        ')
+    else:
+        lines += ['        message[0] = 0xB0 | row.activeChannel',
+                  '        send(message)']
+    lines += ['    elif kind == 0x90 or kind == 0x80:']
+    if hasVoices:
+        indent = '        '
+        if hasSplits:
+            lines += ['        target = keymap[message[1]]',
+                      '        if target is None:']
+            indent += '    '
+        lines += [indent + line for line in [
+            'if kind == 0x90 and message[2]:',
+            '    target = voiceOn(status & 0x0F, message[1], send)',
+            'else:',
+            '    target = voiceOff(status & 0x0F, message[1])',
+            '    if target is None:',
+            '        target = row.activeChannel',
+            '    elif target < 0:',
+            '        return']]
+        lines += ['        message[0] = kind | target']
+    elif hasSplits:
+        lines += ['        target = keymap[message[1]]',
+                  '        if target is None:',
+                  '            target = row.activeChannel',
+                  '        message[0] = kind | target']
+    else:
+        lines += ['        message[0] = kind | row.activeChannel']
+    lines += ['        send(message)']
+
+    if hasVoices and filters.at != FILTER_DROP:
+        # Aftertouch follows its note, wherever it went
+        lines += ['    elif kind == 0xA0:']
+        if hasSplits:
+            lines += ['        target = keymap[message[1]]',
+                      '        if target is None:',
+                      '            target = voiceNote(status & 0x0F, '
+                      'message[1])']
+        else:
+            lines += ['        target = voiceNote(status & 0x0F, message[1])']
+        lines += ['        if target is None:',
+                  '            target = row.activeChannel',
+                  '        message[0] = 0xA0 | target',
+                  '        send(message)',
+                  '    elif kind == 0xD0:']
+        lines += _expressionLines('        ')
+    elif filters.at == FILTER_ROUTE:
+        lines += ['    elif kind == 0xA0:']
+        if hasSplits:
+            lines += ['        target = keymap[message[1]]',
+                      '        if target is None:',
+                      '            target = row.activeChannel',
+                      '        message[0] = 0xA0 | target']
+        else:
+            lines += ['        message[0] = 0xA0 | row.activeChannel']
+        lines += ['        send(message)',
+                  '    elif kind == 0xD0:',
+                  '        message[0] = 0xD0 | row.activeChannel',
+                  '        send(message)']
+    elif filters.at == FILTER_DROP:
+        lines += ['    elif kind == 0xA0 or kind == 0xD0:',
+                  '        return']
+    if filters.pc == FILTER_ROUTE:
+        lines += ['    elif kind == 0xC0:',
+                  '        message[0] = 0xC0 | row.activeChannel',
+                  '        send(message)']
+    elif filters.pc == FILTER_DROP:
+        lines += ['    elif kind == 0xC0:',
+                  '        return']
+    if hasVoices:
+        lines += ['    elif kind == 0xE0:']
+        lines += _expressionLines('        ')
+    lines += ['    else:',
+              '        send(message)']
+    return _buildDispatch(lines, routing, row, send, scenes)
+
+"""Lines that send pitch bend, pressure or a CC on to wherever the voice
+pool says: the channel of the note it's about, or all of them.
+"""
+def _expressionLines(indent):
+    return [indent + line for line in [
+        'target = express(status & 0x0F)',
+        'if target is None:',
+        '    for target in pool:',
+        '        send([kind | target] + message[1:])',
+        '    return',
+        'message[0] = kind | target',
+        'send(message)']]
+
+"""Turn the lines written by compileDispatch into an actual function.
+"""
+def _buildDispatch(lines, routing, row, send, scenes):
+    voices = allocatorFor(row, routing.voices)
+    clock = clockFor(row, routing.quantize)
+
+    def switch(target):
+        send([0xB0 | row.activeChannel, 123, 0])
+        row.activeChannel = target
+        row.onTriggered()
+    namespace = {'routing': routing,
+                 'triggers': routing.triggers,
+                 'faders': routing.faders,
+                 'keymap': routing.keymap,
+                 'byProgram': scenes.byProgram if scenes is not None
+                              else None,
+                 'scenes': scenes,
+                 'row': row,
+                 'send': send,
+                 'learned': row.onLearnReceived,
+                 'triggered': row.onTriggered,
+                 'faded': row.onFaderMoved,
+                 'scene': row.onSceneRequested,
+                 'panic': row.onPanicRequested,
+                 'voiceOn': voices.noteOn if voices else None,
+                 'voiceOff': voices.noteOff if voices else None,
+                 'voiceNote': voices.noteChannel if voices else None,
+                 'express': voices.expression if voices else None,
+                 'pool': voices.channels if voices else None,
+                 'tick': clock.tick if clock else None,
+                 'transport': clock.transport if clock else None,
+                 'quantized': clock.request if clock else None,
+                 'switch': switch}
+    exec(compile('\n'.join(lines), '<SwitchBox dispatch>', 'exec'),
+         namespace)
+    return namespace['dispatch']
@@ -0,0 +1,223 @@
+"""
+Scenes and setlists for SwitchBox
+
+A scene is a snapshot of the whole rig for one song: every row's trigger
+and fader bindings, pad channel, keyboard splits and active channel.
+Scenes are kept in setlist order in the save file, under <scenes>.
+
+Each scene is compiled into RowRoutings as soon as it's loaded, so
+switching scenes on stage is nothing more than handing every row a
+table that already exists.
+"""
+
+from collections import namedtuple
+from lxml import etree
+from routing import MIDI_VALUES, buildRouting, readBindings, readSplits
+
+"""Everything a scene remembers about a single row.
+
+bindings -- Tuple of (channel, trigger, fader), with zero-based channels
+padchannel -- The pad channel (starting from 1), or None
+splits -- Tuple of (low, high, channel), with zero-based channels
+channel -- The (zero-based) active channel, or None to leave it alone
+"""
+class SceneRow(namedtuple('SceneRow', ['bindings', 'padchannel', 'splits',
+                                       'channel'])):
+    __slots__ = ()
+
+    """Compile this row's settings into a RowRouting.
+    """
+    def routing(self):
+        return buildRouting(self.bindings, padchannel=self.padchannel,
+                            splits=self.splits, channel=self.channel)
+
+
+"""A named scene. Belongs in a SceneBook.
+
+Scenes don't change once they've been created; to edit one, make a new
+one and put it in a new SceneBook.
+"""
+class Scene():
+    """Create a scene and compile its routing tables.
+
+    Arguments:
+    name -- What the user calls this scene (string)
+    rows -- A SceneRow (or None, to leave that row alone) for each row
+    program -- Program Change number (0-127) that recalls this scene,
+        or None.
+    key -- Tk key name (e.g. 'F5') of the hotkey for this scene, or None
+    """
+    def __init__(self, name, rows, program=None, key=None):
+        self.name = name
+        self.rows = tuple(rows)
+        self.program = program
+        self.key = key
+        # The precompiled tables that actually get swapped in
+        self.table = tuple(row.routing() if row is not None else None
+                           for row in self.rows)
+
+    """Load a scene from its XML element.
+
+    Arguments:
+    element -- A <scene> XML element
+    num_cols -- Number of channels per row, pad included
+    """
+    @classmethod
+    def fromXML(cls, element, num_cols):
+        rows = []
+        for rowElement in element:
+            if rowElement.tag != 'row':
+                continue
+            bindings, padchannel = readBindings(rowElement, num_cols)
+            active = rowElement.get('active', '')
+            channel = (int(active) - 1 if active.isdigit() and
+                       int(active) - 1 in range(num_cols) else None)
+            rows.append(SceneRow(tuple(bindings), padchannel,
+                                 tuple(readSplits(rowElement, num_cols)),
+                                 channel))
+        program = element.get('pc', '')
+        program = (int(program) if program.isdigit() and
+                   int(program) < MIDI_VALUES else None)
+        return cls(element.get('name', 'Scene'), rows, program=program,
+                   key=element.get('key'))
+
+    """Write this scene out as a new <scene> under the given parent.
+
+    Arguments:
+    parent -- The <scenes> XML element
+    num_cols -- Number of channels per row, pad included
+    """
+    def toXML(self, parent, num_cols):
+        element = etree.SubElement(parent, 'scene')
+        element.attrib['name'] = self.name
+        if self.program is not None:
+            element.attrib['pc'] = str(self.program)
+        if self.key is not None:
+            element.attrib['key'] = self.key
+        for row in self.rows:
+            rowElement = etree.SubElement(element, 'row')
+            if row is None:
+                continue
+            if row.channel is not None:
+                rowElement.attrib['active'] = str(row.channel + 1)
+            writeRowConfig(rowElement, row.bindings, row.padchannel,
+                           row.splits, num_cols)
+        return element
+
+
+"""Write bindings and splits into a row's XML element.
+
+This is the same layout RowElements use, so a scene's rows and the
+live rows can be read with the same functions.
+
+Arguments:
+rowElement -- The XML element to write into. Should be empty of <ch>
+    and <split> elements.
+bindings -- Tuple of (channel, trigger, fader), with zero-based channels
+padchannel -- The pad channel (starting from 1), or None
+splits -- Tuple of (low, high, channel), with zero-based channels
+num_cols -- Number of channels per row, pad included
+"""
+def writeRowConfig(rowElement, bindings, padchannel, splits, num_cols):
+    wrotePad = False
+    for channel, trigger, fader in bindings:
+        if trigger is None and fader is None and (
+                channel != num_cols - 1 or padchannel is None):
+            continue
+        chElement = etree.SubElement(rowElement, 'ch')
+        chElement.attrib['chan'] = str(channel + 1)
+        if trigger is not None:
+            chElement.attrib['t'] = str(trigger)
+        if fader is not None:
+            chElement.attrib['f'] = str(fader)
+        if channel == num_cols - 1 and padchannel is not None:
+            chElement.attrib['pad'] = str(padchannel)
+            wrotePad = True
+    if padchannel is not None and not wrotePad:
+        chElement = etree.SubElement(rowElement, 'ch')
+        chElement.attrib['chan'] = str(num_cols)
+        chElement.attrib['pad'] = str(padchannel)
+    for low, high, channel in splits:
+        splitElement = etree.SubElement(rowElement, 'split')
+        splitElement.attrib['lo'] = str(low)
+        splitElement.attrib['hi'] = str(high)
+        splitElement.attrib['chan'] = str(channel + 1)
+
+
+"""The setlist: every scene, in order, plus how they get recalled.
+
+A SceneBook is never modified after it's made. The MIDI callback reads
+whichever one the App is holding, and the App swaps in a new one when
+the user adds or removes a scene.
+"""
+class SceneBook():
+    """Create a scene book.
+
+    Arguments:
+    scenes -- Scenes in setlist order
+    cc -- CC number whose value selects a scene by position, or None
+    """
+    def __init__(self, scenes=(), cc=None):
+        self.scenes = tuple(scenes)
+        self.cc = cc
+        # Program Change number -> position in setlist. Looked up
+        # directly from the MIDI callback.
+        byProgram = [None] * MIDI_VALUES
+        for index, scene in reversed(list(enumerate(self.scenes))):
+            if scene.program is not None:
+                byProgram[scene.program] = index
+        self.byProgram = tuple(byProgram)
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def __getitem__(self, index):
+        return self.scenes[index]
+
+    """Load the setlist from the <scenes> element, if there is one.
+
+    Arguments:
+    element -- The <scenes> XML element, or None
+    num_cols -- Number of channels per row, pad included
+    """
+    @classmethod
+    def fromXML(cls, element, num_cols):
+        if element is None:
+            return cls()
+        cc = element.get('cc', '')
+        cc = int(cc) if cc.isdigit() and int(cc) < MIDI_VALUES else None
+        return cls([Scene.fromXML(scenes, num_cols) for scenes in element
+                    if scenes.tag == 'scene'], cc=cc)
+
+    """Replace the <scenes> element under root with this setlist.
+
+    Arguments:
+    root -- The root element of the save file
+    num_cols -- Number of channels per row, pad included
+    current -- Position of the current scene, or None
+
+    Returns the new <scenes> element.
+    """
+    def toXML(self, root, num_cols, current=None):
+        old = root.find('scenes')
+        if old is not None:
+            root.remove(old)
+        element = etree.SubElement(root, 'scenes')
+        if self.cc is not None:
+            element.attrib['cc'] = str(self.cc)
+        if current is not None:
+            element.attrib['cur'] = str(current)
+        for scene in self.scenes:
+            scene.toXML(element, num_cols)
+        return element
+
+    """Return a new SceneBook with a scene added to the end.
+    """
+    def withScene(self, scene):
+        return SceneBook(self.scenes + (scene,), cc=self.cc)
+
+    """Return a new SceneBook without the scene at the given position.
+    """
+    def withoutScene(self, index):
+        return SceneBook(self.scenes[:index] + self.scenes[index + 1:],
+                         cc=self.cc)
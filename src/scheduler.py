@@ -0,0 +1,254 @@
+"""
+Background work for SwitchBox
+
+Device scans and saving used to run one after another off Tk's after()
+timer, right on the UI thread, so one slow USB scan held up saving and
+drawing both. A Scheduler runs that kind of work instead, as asyncio
+tasks on an event loop with a thread of its own, and leaves the UI
+thread to draw. The same loop runs with or without a window.
+
+Every job gets:
+priority -- PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW. When more
+    jobs are waiting than can run at once, the highest priority goes
+    first (oldest first among equals).
+timeout -- Seconds it gets before it's given up on. A job that's given
+    up on gets logged, and its Future gets a TimeoutError. A plain
+    function can't be stopped partway, so it's left to finish on its
+    own, but it stops holding anything else up.
+key -- Jobs with the same key never run at the same time, and never
+    pile up: one that's submitted while another is still waiting just
+    shares its result. That's what keeps saves in order, and keeps a
+    slow scan from being queued up again and again.
+
+Plain functions run on a small pool of threads (they're mostly
+blocking file and USB calls); coroutine functions run on the loop
+itself. Anything that needs to touch the widgets afterwards should go
+through App.postToUI.
+"""
+
+import sys
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+"""One piece of work waiting for (or having) a turn.
+"""
+class Job():
+    __slots__ = ('priority', 'order', 'name', 'function', 'args',
+                 'timeout', 'key', 'futures')
+
+    def __init__(self, priority, order, name, function, args, timeout,
+                 key):
+        self.priority = priority
+        self.order = order
+        self.name = name
+        self.function = function
+        self.args = args
+        self.timeout = timeout
+        self.key = key
+        self.futures = [Future()]
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+    def finish(self, result=None, error=None):
+        for future in self.futures:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+"""Something submitted with Scheduler.every(). cancel() it to stop it
+coming round again.
+"""
+class Repeating():
+    def __init__(self, future):
+        self.future = future
+
+    def cancel(self):
+        self.future.cancel()
+
+
+"""Runs jobs on an asyncio event loop in a thread of its own.
+"""
+class Scheduler(threading.Thread):
+    """Arguments:
+    workers -- How many jobs can run at once
+    """
+    def __init__(self, workers=2):
+        threading.Thread.__init__(self, name='SwitchBox scheduler',
+                                  daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.slots = max(1, workers)
+        # Twice the threads, so jobs that were given up on but are still
+        # going don't leave the rest waiting for a thread
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.slots * 2, thread_name_prefix='SwitchBox job')
+        # Everything below is only touched from the loop's thread
+        self.waiting = []   # Heap of Jobs
+        self.queued = {}    # Key -> its waiting Job
+        self.busyKeys = set()
+        self.busy = 0
+        self.repeating = set()
+        self.idle = None
+        self.order = itertools.count()
+        self.accepting = True
+        ready = threading.Event()
+        self.loop.call_soon(ready.set)
+        self.start()
+        ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    """Run a function (or coroutine function) in the background. Safe to
+    call from any thread.
+
+    Arguments:
+    function -- What to run, and args its arguments
+    priority -- See above
+    timeout -- Seconds before it's given up on, or None to wait forever
+    key -- See above. None for a job that can run alongside anything.
+    name -- What to call it in the log
+
+    Returns a concurrent.futures.Future for its result.
+    """
+    def submit(self, function, *args, priority=PRIORITY_NORMAL, timeout=None,
+               key=None, name=None):
+        job = Job(priority, next(self.order),
+                  name or getattr(function, '__name__', 'job'), function,
+                  args, timeout, key)
+        if not self.accepting:
+            job.finish(error=RuntimeError('Scheduler is stopped'))
+        else:
+            self.loop.call_soon_threadsafe(self.enqueue, job)
+        return job.futures[0]
+
+    """Run a function every so often, starting now. Runs never overlap:
+    if the last one's still going when the next is due, they share.
+
+    Arguments:
+    interval -- Seconds between runs
+    The rest are as for submit().
+
+    Returns a Repeating.
+    """
+    def every(self, interval, function, *args, priority=PRIORITY_NORMAL,
+              timeout=None, name=None):
+        key = ('every', next(self.order))
+
+        async def repeat():
+            while True:
+                self.enqueue(Job(priority, next(self.order),
+                                 name or function.__name__, function, args,
+                                 timeout, key))
+                await asyncio.sleep(interval)
+
+        async def start():
+            task = asyncio.ensure_future(repeat())
+            self.repeating.add(task)
+            try:
+                await task
+            finally:
+                self.repeating.discard(task)
+        return Repeating(asyncio.run_coroutine_threadsafe(start(), self.loop))
+
+    def enqueue(self, job):
+        if job.key is not None and job.key in self.queued:
+            self.queued[job.key].futures.extend(job.futures)
+            return
+        if job.key is not None:
+            self.queued[job.key] = job
+        heapq.heappush(self.waiting, job)
+        self.idle.clear()
+        self.pump()
+
+    """Start as many waiting jobs as there are free slots for.
+    """
+    def pump(self):
+        blocked = []
+        while self.waiting and self.busy < self.slots:
+            job = heapq.heappop(self.waiting)
+            if job.key is not None and job.key in self.busyKeys:
+                blocked.append(job)
+                continue
+            if job.key is not None:
+                del self.queued[job.key]
+                self.busyKeys.add(job.key)
+            self.busy += 1
+            self.loop.create_task(self.runJob(job))
+        for job in blocked:
+            heapq.heappush(self.waiting, job)
+        if not self.waiting and not self.busy and not self.busyKeys:
+            self.idle.set()
+
+    async def runJob(self, job):
+        result = error = None
+        work = None
+        try:
+            if asyncio.iscoroutinefunction(job.function):
+                work = asyncio.ensure_future(job.function(*job.args))
+                result = await asyncio.wait_for(work, job.timeout)
+            else:
+                work = self.loop.run_in_executor(self.executor, job.function,
+                                                 *job.args)
+                result = await asyncio.wait_for(asyncio.shield(work),
+                                                job.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(job.name + ' took longer than ' +
+                            str(job.timeout) + ' s; not waiting for it')
+            error = TimeoutError(job.name + ' timed out')
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ': ' + job.name + ' failed')
+            error = exc_obj
+        self.busy -= 1
+        if job.key is not None:
+            if work is not None and not work.done():
+                # Still going on its thread, so same-key jobs wait on it
+                work.add_done_callback(lambda done: self.release(job.key))
+            else:
+                self.busyKeys.discard(job.key)
+        job.finish(result, error)
+        self.pump()
+
+    def release(self, key):
+        self.busyKeys.discard(key)
+        self.pump()
+
+    async def drain(self):
+        for task in list(self.repeating):
+            task.cancel()
+        await self.idle.wait()
+
+    """Stop taking jobs, let the ones already submitted finish (for up
+    to timeout seconds), then stop the loop. Safe to call from any
+    thread but the loop's.
+    """
+    def stop(self, timeout=5):
+        if not self.accepting:
+            return
+        self.accepting = False
+        try:
+            asyncio.run_coroutine_threadsafe(self.drain(),
+                                             self.loop).result(timeout)
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ': Background jobs still going at shutdown')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join(timeout)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,369 @@
+"""
+Soak test for SwitchBox
+
+Runs a rig against the stand-in MIDI backend for a whole show's worth
+of (sped up) use: playing, renaming rows a keystroke at a time (which
+swaps the output port on every key), devices dropping out and being
+reconnected, Learn over and over, and saving all the while. Along the
+way it keeps an eye on what the process is holding on to:
+
+- memory: RSS, and Python's own allocations (tracemalloc)
+- open file descriptors
+- threads
+- the stand-in backend's clients and open ports
+
+Everything's measured once the rig has warmed up, and again at the
+end. If anything grew more than its threshold (see LIMITS), the soak
+fails, and shows where tracemalloc saw the most growth.
+
+    python3 ./soak.py                        (an 8-hour show)
+    python3 ./soak.py --hours 1 --rows 4 --mode thread
+
+Exits with 1 if it failed. No Tk or MIDI system needed.
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import namedtuple
+from lxml import etree
+import standin
+from routing import DEFAULT_FILTER, compileDispatch
+from ports import openRowPorts, renameOutPort, closePort, reopenInPort
+from workers import RoutingWorkers
+from panic import NoteTracker
+from state import ChannelState, RowState
+from config import ConfigStore
+
+# Channels per row (the pad channel's one more)
+CHANNELS = 9
+
+# What happens in each minute of the show: messages each row plays,
+# and every how many minutes a row gets renamed, reconnected and has a
+# channel Learned. Saves happen every minute.
+MESSAGES_PER_MINUTE = 600
+RENAME_EVERY = 3
+RECONNECT_EVERY = 5
+LEARN_EVERY = 2
+
+# Every how many minutes to take a sample, and how far into the show
+# the baseline gets taken (as a fraction of it)
+SAMPLE_EVERY = 30
+WARMUP = 0.1
+
+# How much each thing can grow from the baseline to the end
+LIMITS = {'rss': 32 * 1024 * 1024,   # Bytes
+          'traced': 4 * 1024 * 1024, # Bytes
+          'fds': 4,
+          'threads': 2,
+          'clients': 0,
+          'ports': 0}
+
+"""What the process was holding on to at one point in the show.
+Anything that couldn't be measured here is None.
+"""
+Sample = namedtuple('Sample', ['minute', 'rss', 'traced', 'fds', 'threads',
+                               'clients', 'ports'])
+
+"""The process's resident memory, in bytes.
+"""
+def residentMemory():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+"""How many files (sockets, pipes...) the process has open.
+"""
+def openFiles():
+    for directory in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(directory))
+        except OSError:
+            pass
+    return None
+
+def takeSample(minute):
+    with standin.lock:
+        clients = standin.counts['clients']
+        ports = standin.counts['ports']
+    return Sample(minute, residentMemory(),
+                  tracemalloc.get_traced_memory()[0], openFiles(),
+                  threading.active_count(), clients, ports)
+
+"""Make a mix of traffic that looks like somebody playing, with the
+occasional channel switch.
+"""
+def playing(count, minute):
+    messages = []
+    for n in range(count):
+        note = 36 + (n * 7 + minute) % 48
+        which = n % 20
+        if which < 14:
+            messages.append([0x90, note, 100] if which % 2 == 0
+                            else [0x80, note, 0])
+        elif which < 18:
+            messages.append([0xB0, 1, n % 128])
+        elif which == 18:
+            messages.append([0xE0, 0, 64])
+        else:
+            # Triggers are bound to CCs 20 and up
+            messages.append([0xB0, 20 + (n // 20) % CHANNELS, 127])
+    return messages
+
+
+"""A row, without the widgets: it goes through the same motions with
+its ports, routing and save file element as a RowElement does.
+"""
+class SoakRow():
+    def __init__(self, number, workers, store, element):
+        self.number = number
+        self.workers = workers
+        self.store = store
+        self.element = element
+        self.device = 'Keyboard %d' % number
+        self.state = RowState(self)
+        self.state.channels = [ChannelState(channel + 1, 0)
+                               for channel in range(CHANNELS + 1)]
+        for channel in self.state.channels[:CHANNELS]:
+            channel.trigger = 19 + channel.channel
+        self.notes = NoteTracker()
+        self.listenChannel = None
+        self.dispatch = None
+        self.callback = workers.attach(self)
+        ports = openRowPorts(standin, lambda: workers.outPort(self),
+                             self.portName(), self.device, None,
+                             DEFAULT_FILTER)
+        if ports.error is not None:
+            raise RuntimeError(ports.error)
+        self.inport = ports.inport
+        self.outport = ports.outport
+        self.publishRouting()
+        self.inport.set_callback(self.callback, None)
+
+    def portName(self):
+        return self.element.get('name', '') + ' (SwitchBox)'
+
+    def publishRouting(self):
+        listenFor = 'F' if self.listenChannel is not None else None
+        routing = self.state.routing(listenChannel=self.listenChannel,
+                                     listenFor=listenFor)
+        self.dispatch = compileDispatch(
+            routing, self.state, self.notes.wrap(self.outport.send_message))
+
+    # What the routing workers call
+    def onReceived(self, event, data=None):
+        self.dispatch(event[0])
+
+    def route(self, message, delta, arrival):
+        self.dispatch(message)
+
+    # What the dispatch functions call
+    def onLearnReceived(self, routing, cc):
+        self.learned = cc
+
+    def onTriggered(self):
+        pass
+
+    def onFaderMoved(self, channel):
+        pass
+
+    def onSceneRequested(self, index, scenes):
+        pass
+
+    def onPanicRequested(self):
+        pass
+
+    def play(self, messages):
+        for message in messages:
+            self.inport.play(message)
+
+    """Type a new name in, one key at a time. Every key saves and
+    renames the output port (or swaps it for a new one), same as the
+    name box does.
+    """
+    def rename(self, name):
+        for length in range(1, len(name) + 1):
+            self.store.set(self.element, 'name', name[:length])
+            self.store.save()
+            oldport = self.outport
+            self.outport = renameOutPort(oldport,
+                                         lambda: self.workers.outPort(self),
+                                         self.portName())
+            if self.outport is not oldport:
+                self.publishRouting()
+                closePort(oldport)
+
+    """Unplug the device, plug it back in (at the end of the port list),
+    and reconnect to it.
+    """
+    def reconnect(self):
+        standin.unplug(self.device)
+        standin.plug(self.device)
+        reopenInPort(self.inport, standin.devices.index(self.device),
+                     self.callback)
+
+    """Learn a new fader for a channel, the way the L button does.
+    """
+    def learn(self, channel, cc):
+        self.listenChannel = channel
+        self.publishRouting()
+        self.learned = None
+        self.inport.play([0xB0, cc, 64])
+        self.waitForRouting()
+        self.listenChannel = None
+        self.state.channels[channel].fader = self.learned
+        self.publishRouting()
+        self.store.set(self.element[channel], 'f', str(self.learned))
+        self.store.save()
+
+    """Wait for a routing thread to get through what's been played.
+    """
+    def waitForRouting(self):
+        deadline = time.perf_counter() + 1.0
+        while (self.learned is None and
+               time.perf_counter() < deadline):
+            time.sleep(0.0005)
+
+    def close(self):
+        self.workers.detach(self)
+        closePort(self.inport)
+        closePort(self.outport)
+
+
+"""Run a show. Returns the samples taken.
+
+Arguments:
+hours -- How long the show is
+rows -- How many rows the rig has
+mode -- Routing mode, 'inline' or 'thread'
+onSample -- Function that gets each Sample as it's taken
+"""
+def soak(hours, rows, mode, onSample):
+    directory = tempfile.mkdtemp()
+    standin.devices[:] = ['Keyboard %d' % n for n in range(rows)]
+    store = ConfigStore(os.path.join(directory, 'soak.xml'))
+
+    def makeDefault():
+        root = etree.Element('swr')
+        for n in range(rows):
+            row = etree.SubElement(root, 'row', name='Row %d' % n)
+            for channel in range(CHANNELS + 1):
+                etree.SubElement(row, 'ch', chan=str(channel + 1))
+        return root
+    tree = store.load(makeDefault, CHANNELS + 1)
+    workers = RoutingWorkers(mode, 0, 1024, standin)
+    rig = [SoakRow(n, workers, store, element)
+           for n, element in enumerate(tree.getroot())]
+
+    minutes = int(hours * 60)
+    samples = []
+    try:
+        for minute in range(minutes + 1):
+            traffic = playing(MESSAGES_PER_MINUTE, minute)
+            for row in rig:
+                row.play(traffic)
+                if (minute + row.number) % RENAME_EVERY == 0:
+                    row.rename('Row %d take %d' % (row.number, minute))
+                if (minute + row.number) % RECONNECT_EVERY == 0:
+                    row.reconnect()
+                if (minute + row.number) % LEARN_EVERY == 0:
+                    row.learn(minute % CHANNELS, 40 + minute % 40)
+            store.save()
+            if minute % SAMPLE_EVERY == 0 or minute == minutes:
+                sample = takeSample(minute)
+                samples.append(sample)
+                onSample(sample)
+    finally:
+        for row in rig:
+            row.close()
+        workers.stop()
+        store.close()
+        shutil.rmtree(directory)
+        standin.devices[:] = []
+    return samples
+
+"""Compare the end of the show with how things were once it warmed up.
+
+Returns a list of (what, baseline, end, limit) for everything that
+grew too much.
+"""
+def checkGrowth(baseline, end):
+    failures = []
+    for what, limit in LIMITS.items():
+        before = getattr(baseline, what)
+        after = getattr(end, what)
+        if before is None or after is None:
+            continue
+        if after - before > limit:
+            failures.append((what, before, after, limit))
+    return failures
+
+def describe(value, what):
+    if value is None:
+        return '-'
+    if what in ('rss', 'traced'):
+        return '%.1f MB' % (value / 1024 / 1024)
+    return str(value)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run SwitchBox for hours against a stand-in MIDI '
+                    'backend, and check nothing leaks.')
+    parser.add_argument('--hours', type=float, default=8,
+                        help='How long the show is (default 8)')
+    parser.add_argument('--rows', type=int, default=8,
+                        help='How many rows the rig has (default 8)')
+    parser.add_argument('--mode', choices=('inline', 'thread'),
+                        default='inline', help='Routing mode')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    tracemalloc.start()
+    fields = Sample._fields
+    print(' '.join('%10s' % field for field in fields))
+    state = {'baseline': None, 'snapshot': None}
+    warmup = int(args.hours * 60 * WARMUP)
+
+    def onSample(sample):
+        print(' '.join('%10s' % describe(value, field)
+                       for field, value in zip(fields, sample)))
+        sys.stdout.flush()
+        if state['baseline'] is None and sample.minute >= warmup:
+            state['baseline'] = sample
+            state['snapshot'] = tracemalloc.take_snapshot()
+
+    start = time.perf_counter()
+    samples = soak(args.hours, args.rows, args.mode, onSample)
+    end = samples[-1]
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    print('Soaked %g hours of show in %.0f s' % (
+        args.hours, time.perf_counter() - start))
+
+    failures = checkGrowth(state['baseline'] or samples[0], end)
+    for what, before, after, limit in failures:
+        print('FAIL: %s grew from %s to %s (limit %s)' % (
+            what, describe(before, what), describe(after, what),
+            describe(limit, what)))
+    if failures and state['snapshot'] is not None:
+        print('Biggest growth, by line:')
+        for stat in snapshot.compare_to(state['snapshot'], 'lineno')[:5]:
+            print('   ', stat)
+    if failures:
+        return 1
+    print('OK: nothing grew past its limit')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
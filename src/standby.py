@@ -0,0 +1,432 @@
+"""
+Hot standby for SwitchBox
+
+If SwitchBox dies mid-show, every virtual port goes with it, and so
+does every row's active channel. A standby is a second SwitchBox that
+keeps up with the running one (the primary) and takes over its ports
+the moment it's gone:
+
+    python3 ./standby.py
+
+The primary runs a MirrorServer on a local socket. Every HEARTBEAT_S it
+sends each standby one line of JSON: a snapshot of its routing state
+(see App.mirrorSnapshot) if anything's changed since the last one, or
+just a heartbeat if nothing has. The standby takes over the moment
+the primary hangs up, which is what happens when its process dies. It
+opens each row's virtual port and input device, and routes from the
+last snapshot it got, active channels and held notes included.
+
+A primary that's still there but quiet might only be stuck for a bit:
+parsing a big save file or collecting garbage can hold it up for tens
+of milliseconds. So the standby gives it TIMEOUT_S, well past anything
+like that, before deciding it's hung. Then it takes over, but stays
+connected and says so (FENCE). If the primary comes back, it reads
+that, closes its ports and stops mirroring, so there's only ever one
+of each port routing.
+
+The standby routes without a window: no scenes, no learning, no
+latency compensation and no network rows, just every row's bindings,
+splits, filters and voice pools. It keeps going until it's stopped
+with Ctrl+C; quit it before starting SwitchBox again, or there'll be
+two of every port.
+"""
+
+import os
+import sys
+import json
+import select
+import socket
+import logging
+import threading
+from time import perf_counter
+from control import DEFAULT_ADDRESS as CONTROL_ADDRESS, listenOn
+from routing import MidiFilter, buildRouting, compileDispatch
+from voices import VoicePool
+from ports import openRowPorts, closePort
+from panic import NoteTracker, PanicButton
+from state import RowState
+
+# Where the primary listens for standbys, next to the control socket
+DEFAULT_ADDRESS = os.path.join(os.path.dirname(CONTROL_ADDRESS),
+                               'mirror.sock')
+
+# Where to listen instead, if there's no such thing as a Unix socket
+DEFAULT_TCP_ADDRESS = ('127.0.0.1', 47801)
+
+# How often the primary sends something (seconds), and how long the
+# standby waits to hear from it before deciding it's hung. That's many
+# times SwitchBox's own watchdog budget (50 ms): a stall that long is
+# something to log, not something to take over for.
+HEARTBEAT_S = 0.01
+TIMEOUT_S = 1.0
+
+HEARTBEAT = b'{}\n'
+
+# What a standby that took over from a quiet primary sends it
+FENCE = b'{"takenOver": true}\n'
+
+"""Sends the primary's routing state to every standby that connects.
+"""
+class MirrorServer(threading.Thread):
+    """Arguments:
+    address -- Path of the Unix socket, or (host, port) for TCP
+    snapshot -- Function that returns the routing state, as something
+        json.dumps() can take. Called from the server's thread, and
+        only while a standby's listening.
+    onFenced -- Function to call if a standby says it's taken over,
+        which means we were stuck for a while and should close our
+        ports. Called from the server's thread, once.
+    """
+    def __init__(self, address, snapshot, onFenced=None):
+        threading.Thread.__init__(self, name='SwitchBox mirror',
+                                  daemon=True)
+        self.snapshot = snapshot
+        self.onFenced = onFenced
+        self.listener, self.address = listenOn(address, DEFAULT_TCP_ADDRESS)
+        self.listener.listen(4)
+        self.listener.settimeout(HEARTBEAT_S)
+        self.standbys = []
+        self.last = None
+        self.running = True
+        self.start()
+
+    def stop(self):
+        self.running = False
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+        for standby in self.standbys:
+            standby.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def run(self):
+        beat = perf_counter()
+        while self.running:
+            try:
+                connection, peer = self.listener.accept()
+            except socket.timeout:
+                pass
+            except OSError:
+                break
+            else:
+                connection.settimeout(TIMEOUT_S)
+                self.standbys.append(connection)
+                # Catch it up with a whole snapshot straight away
+                self.last = None
+                logging.info('A standby is following us')
+            if perf_counter() >= beat:
+                beat = perf_counter() + HEARTBEAT_S
+                self.beat()
+
+    """Send the state to every standby if it's changed, or otherwise
+    just a heartbeat.
+    """
+    def beat(self):
+        if not self.standbys:
+            return
+        if self.readStandbys():
+            return
+        line = HEARTBEAT
+        try:
+            state = json.dumps(self.snapshot()).encode() + b'\n'
+            if state != self.last:
+                self.last = line = state
+        except:
+            # Still alive, even if the snapshot isn't working out
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ": Couldn't take a snapshot for the standby")
+        for standby in list(self.standbys):
+            try:
+                standby.sendall(line)
+            except OSError:
+                standby.close()
+                self.standbys.remove(standby)
+                logging.info('A standby went away')
+
+    """See whether any standby has taken over from us while we weren't
+    answering. If one has, stand aside.
+
+    Returns True if we've been fenced off.
+    """
+    def readStandbys(self):
+        try:
+            readable = select.select(self.standbys, [], [], 0)[0]
+        except (OSError, ValueError):
+            readable = []
+        for standby in readable:
+            try:
+                data = standby.recv(4096)
+            except OSError:
+                data = b''
+            if FENCE[:-1] in data:
+                logging.warning('A standby took over while we were stuck; '
+                                'standing aside')
+                self.stop()
+                if self.onFenced is not None:
+                    self.onFenced()
+                return True
+            if not data:
+                standby.close()
+                self.standbys.remove(standby)
+                logging.info('A standby went away')
+        return False
+
+
+"""Follows a primary's MirrorServer.
+"""
+class MirrorClient():
+    """Arguments:
+    address -- Path of the Unix socket, or (host, port) for TCP
+
+    Raises OSError if there's no primary there.
+    """
+    def __init__(self, address):
+        if isinstance(address, str) and not hasattr(socket, 'AF_UNIX'):
+            address = DEFAULT_TCP_ADDRESS
+        family = socket.AF_UNIX if isinstance(address, str) else \
+            socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(address)
+        self.connection.settimeout(TIMEOUT_S)
+        # Whether the primary went quiet, rather than hanging up
+        self.quiet = False
+
+    """Hand every snapshot to a function until the primary's gone.
+    If it only went quiet, the connection stays open for fence().
+
+    Arguments:
+    onSnapshot -- Function that gets each snapshot, decoded
+
+    Returns why the primary's considered gone, as text.
+    """
+    def follow(self, onSnapshot):
+        waiting = b''
+        while True:
+            try:
+                data = self.connection.recv(65536)
+            except socket.timeout:
+                self.quiet = True
+                return 'nothing from it for ' + str(TIMEOUT_S) + ' s'
+            except OSError:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                self.connection.close()
+                return str(exc_obj)
+            if not data:
+                self.connection.close()
+                return 'it hung up'
+            lines = (waiting + data).split(b'\n')
+            waiting = lines.pop()
+            for line in lines:
+                if line and line != HEARTBEAT[:-1]:
+                    onSnapshot(json.loads(line))
+
+    """Tell a quiet primary we've taken over, then wait for it to
+    come back and hang up (or for close()). Anything else it sends
+    is old news.
+    """
+    def fence(self):
+        try:
+            self.connection.settimeout(None)
+            self.connection.sendall(FENCE)
+            while self.connection.recv(65536):
+                pass
+        except OSError:
+            pass
+        self.connection.close()
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+
+"""One row, routing headless after a takeover.
+"""
+class StandbyRow():
+    """Arguments:
+    snapshot -- The row's part of the primary's snapshot
+    panic -- The panic CC, or None
+    onPanic -- Function to call when the panic CC comes in
+    """
+    def __init__(self, snapshot, panic, onPanic):
+        self.snapshot = snapshot
+        self.onPanic = onPanic
+        self.state = RowState(self)
+        self.state.activeChannel = snapshot['active']
+        self.state.padchannel = snapshot['pad']
+        self.state.splits = [tuple(split) for split in snapshot['splits']]
+        self.state.filters = MidiFilter(*snapshot['filters'])
+        voices = snapshot['voices']
+        self.state.voicePool = VoicePool(*voices) if voices else None
+        self.routing = buildRouting(
+            [tuple(binding) for binding in snapshot['bindings']],
+            padchannel=self.state.padchannel, splits=self.state.splits,
+            filters=self.state.filters, panic=panic,
+            voices=self.state.voicePool)
+        # Notes the primary left held, so panic can let go of them
+        self.notes = NoteTracker()
+        self.notes.held.update(snapshot['held'])
+        for key in snapshot['held']:
+            self.notes.used[key >> 7] = 1
+        self.inport = None
+        self.outport = None
+        self.dispatch = None
+
+    """Open our ports (through backend) and start routing. Returns
+    what went wrong, as text, or None.
+    """
+    def open(self, backend, devices):
+        snapshot = self.snapshot
+        ports = openRowPorts(backend, backend.MidiOut,
+                             snapshot['name'] + ' (SwitchBox)',
+                             snapshot['dev'], snapshot['ord'],
+                             self.state.filters, devices)
+        self.inport = ports.inport
+        self.outport = ports.outport
+        if ports.error is not None:
+            return ports.error
+        send = self.notes.wrap(ports.outport.send_message)
+        self.dispatch = compileDispatch(self.routing, self.state, send)
+        self.inport.set_callback(self.onReceived, None)
+        if ports.device is None:
+            return "Can't find " + str(snapshot['dev'])
+        return None
+
+    def onReceived(self, event, data=None):
+        self.dispatch(event[0])
+
+    def close(self):
+        for port in (self.inport, self.outport):
+            if port is not None:
+                closePort(port)
+        self.inport = None
+        self.outport = None
+
+    # The hooks dispatch functions call. Nobody's watching, so most
+    # of them have nothing to do.
+    def onLearnReceived(self, routing, cc):
+        pass
+
+    def onTriggered(self):
+        pass
+
+    def onFaderMoved(self, channel):
+        pass
+
+    def onSceneRequested(self, index, scenes):
+        pass
+
+    def onPanicRequested(self):
+        self.onPanic()
+
+
+"""Follows a primary, and takes over its ports when it's gone.
+"""
+class Standby():
+    """Arguments:
+    backend -- The MIDI backend module (normally rtmidi)
+    address -- Where the primary's MirrorServer listens
+    """
+    def __init__(self, backend, address=DEFAULT_ADDRESS):
+        self.backend = backend
+        self.address = address
+        self.snapshot = None
+        self.client = None
+        self.stopped = False
+        self.rows = []
+        self.panicButton = None
+        # Set once the first snapshot's in, and once we've taken over
+        self.following = threading.Event()
+        self.tookOver = threading.Event()
+
+    def onSnapshot(self, snapshot):
+        self.snapshot = snapshot
+        self.following.set()
+
+    """Follow the primary until it's gone, then take over. If it only
+    went quiet, stay connected afterwards, until it comes back and hears
+    it's been fenced off (or stop()).
+
+    Returns why the primary's considered gone. Raises OSError if
+    there's no primary to follow.
+    """
+    def run(self):
+        self.client = MirrorClient(self.address)
+        reason = self.client.follow(self.onSnapshot)
+        if self.stopped:
+            return 'stopped'
+        logging.warning('Primary is gone (' + reason + '); taking over')
+        self.takeOver()
+        if self.client.quiet:
+            self.client.fence()
+        return reason
+
+    """Open every row's ports and route from the last snapshot.
+
+    Returns how long it took, in seconds.
+    """
+    def takeOver(self):
+        start = perf_counter()
+        snapshot = self.snapshot
+        if snapshot is None:
+            logging.warning('Never heard what to route; nothing to take over')
+            self.tookOver.set()
+            return 0.0
+        self.panicButton = PanicButton(self.panicTargets)
+        self.rows = [StandbyRow(row, snapshot['panic'],
+                                self.panicButton.press)
+                     for row in snapshot['rows']]
+        # One look through the devices for every row
+        scanner = self.backend.MidiIn()
+        devices = scanner.get_ports()
+        scanner.delete()
+        for row in self.rows:
+            error = row.open(self.backend, devices)
+            if error is not None:
+                logging.warning(row.snapshot['name'] + ': ' + error)
+        elapsed = perf_counter() - start
+        logging.warning('Took over {0} rows in {1:.1f} ms'.format(
+            len(self.rows), elapsed * 1000))
+        self.tookOver.set()
+        return elapsed
+
+    def panicTargets(self):
+        return [(row.outport.send_message, row.notes) for row in self.rows
+                if row.outport is not None and row.outport.is_port_open()]
+
+    def stop(self):
+        self.stopped = True
+        if self.client is not None:
+            self.client.close()
+        if self.panicButton is not None:
+            self.panicButton.stop()
+        for row in self.rows:
+            row.close()
+
+
+def main():
+    import rtmidi
+    logging.basicConfig(level=logging.INFO)
+    address = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS
+    standby = Standby(rtmidi, address)
+    try:
+        standby.run()
+    except OSError:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        logging.warning(str(exc_obj) + ': No SwitchBox to follow at ' +
+                        address)
+        return 1
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    standby.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Stand-in MIDI backend for SwitchBox
+
+Looks enough like python-rtmidi (MidiIn, MidiOut and the bits of their
+API SwitchBox uses) to run SwitchBox's engine without a MIDI system,
+a sound card or any devices plugged in. Used by the benchmarks.
+
+Real backends take their time over some calls (opening a client,
+enumerating USB devices), so each call can be made to take as long as
+it would on a slow machine; see DELAYS_S. Devices can be plugged and
+unplugged with plug() and unplug(), and messages can be played into an
+input with MidiIn.play().
+"""
+
+import threading
+from time import perf_counter, sleep
+
+"""How long (seconds) each backend call takes. Change these to play
+at being a slower or faster machine.
+"""
+DELAYS_S = {
+    'client': 0.0,   # Making a MidiIn/MidiOut
+    'scan': 0.0,     # get_ports()
+    'open': 0.0,     # open_port()
+    'virtual': 0.0,  # open_virtual_port()
+    'close': 0.0,    # close_port()
+}
+
+# Which of rtmidi's APIs to play at being. Only ALSA and JACK can rename
+# ports that are open.
+API_UNSPECIFIED = 0
+API_MACOSX_CORE = 1
+API_LINUX_ALSA = 2
+API_UNIX_JACK = 3
+API_WINDOWS_MM = 4
+api = API_LINUX_ALSA
+
+# Names of the devices that are plugged in, in port order
+devices = []
+
+# Everything the backend's keeping track of, for spotting leaks
+lock = threading.Lock()
+counts = {'clients': 0, 'ports': 0}
+
+def wait(call):
+    if DELAYS_S[call]:
+        sleep(DELAYS_S[call])
+
+def count(what, change):
+    with lock:
+        counts[what] += change
+
+"""Plug in a device. It shows up at the end of the port list.
+"""
+def plug(name):
+    devices.append(name)
+
+"""Unplug a device.
+"""
+def unplug(name):
+    if name in devices:
+        devices.remove(name)
+
+"""Common parts of MidiIn and MidiOut.
+"""
+class MidiBase():
+    def __init__(self, rtapi=None, name=None, *args, **kwargs):
+        wait('client')
+        count('clients', 1)
+        self.clientName = name
+        self.portName = None
+        self.deleted = False
+
+    def get_ports(self):
+        wait('scan')
+        return list(devices)
+
+    def get_port_count(self):
+        return len(devices)
+
+    def open_port(self, port=0, name=None):
+        if self.portName is not None:
+            raise RuntimeError('Port already open')
+        wait('open')
+        if port not in range(len(devices)):
+            raise ValueError('Invalid port number: ' + str(port))
+        self.portName = devices[port]
+        count('ports', 1)
+        return self
+
+    def open_virtual_port(self, name=None):
+        if self.portName is not None:
+            raise RuntimeError('Port already open')
+        wait('virtual')
+        self.portName = name
+        count('ports', 1)
+        return self
+
+    def close_port(self):
+        if self.portName is None:
+            return
+        wait('close')
+        self.portName = None
+        count('ports', -1)
+
+    def is_port_open(self):
+        return self.portName is not None
+
+    def get_current_api(self):
+        return api
+
+    def set_port_name(self, name):
+        if api not in (API_LINUX_ALSA, API_UNIX_JACK):
+            raise NotImplementedError("Can't rename ports on this API")
+        self.portName = name
+
+    def set_client_name(self, name):
+        self.clientName = name
+
+    def delete(self):
+        if self.deleted:
+            return
+        self.close_port()
+        self.deleted = True
+        count('clients', -1)
+
+    def __del__(self):
+        try:
+            self.delete()
+        except:
+            pass
+
+
+"""Stand-in for rtmidi.MidiIn.
+"""
+class MidiIn(MidiBase):
+    def __init__(self, *args, **kwargs):
+        MidiBase.__init__(self, *args, **kwargs)
+        self.callback = None
+        self.data = None
+        self.ignoring = (True, True, True)
+        self.last = None
+
+    def set_callback(self, func, data=None):
+        self.callback = func
+        self.data = data
+
+    def cancel_callback(self):
+        self.callback = None
+
+    def ignore_types(self, sysex=True, timing=True, active_sense=True):
+        self.ignoring = (sysex, timing, active_sense)
+
+    """Play a message into this input, as if the device sent it. The
+    callback gets it in the calling thread.
+
+    Returns True if the callback got it, False if it was ignored.
+    """
+    def play(self, message):
+        sysex, timing, sense = self.ignoring
+        status = message[0]
+        if ((sysex and status == 0xF0) or
+                (timing and status in (0xF1, 0xF8)) or
+                (sense and status == 0xFE)):
+            return False
+        now = perf_counter()
+        delta = 0.0 if self.last is None else now - self.last
+        self.last = now
+        callback = self.callback
+        if callback is None or self.portName is None:
+            return False
+        callback((list(message), delta), self.data)
+        return True
+
+
+"""Stand-in for rtmidi.MidiOut. Remembers everything sent, so the
+benchmarks can check it.
+"""
+class MidiOut(MidiBase):
+    def __init__(self, *args, **kwargs):
+        MidiBase.__init__(self, *args, **kwargs)
+        self.sent = 0
+        self.lastSent = None
+
+    def send_message(self, message):
+        if self.portName is None:
+            raise RuntimeError('Port not open')
+        self.sent += 1
+        self.lastSent = message
@@ -0,0 +1,162 @@
+"""
+Engine state for SwitchBox
+
+The settings the routing engine works from (bindings, the active
+channel, the pad channel and so on) used to live right on ColumnElement
+and RowElement, in the same instance dictionaries as a dozen or so Tk
+widgets each. These classes hold just that state, in __slots__, and
+the engine works with them directly. ColumnElement and RowElement are
+views on top: their old attribute names still work, and read and write
+straight through to their state (see stateProperty).
+"""
+
+from routing import DEFAULT_FILTER, buildRouting
+
+# Column types: a normal channel, or the pad channel
+COL_NORMAL, COL_PAD = 0, 1
+
+# What a channel's status light shows
+LED_OFF = 0        # Nothing to do, or disabled while another one learns
+LED_IDLE = 1       # Ready to go, but not the active channel
+LED_ACTIVE = 2     # The active channel (pad channels always are)
+LED_LISTENING = 3  # Learning a binding
+LED_ERROR = 4      # Bound in a way that can't work
+
+"""Make a property that reads and writes an attribute of self.state, so
+the widget classes can keep their attribute names.
+"""
+def stateProperty(name):
+    def get(self):
+        return getattr(self.state, name)
+
+    def set(self, value):
+        setattr(self.state, name, value)
+    return property(get, set)
+
+
+"""One channel's settings.
+
+channel -- The channel's number, from 1
+type -- COL_NORMAL or COL_PAD
+trigger, fader -- CC numbers, or None
+padchannel -- The pad channel typed into a pad column, or None
+isActive -- Whether it's the row's active channel
+isDisabled -- Whether another channel is busy learning a binding
+listening -- Whether it's learning a binding itself
+"""
+class ChannelState():
+    __slots__ = ('channel', 'type', 'trigger', 'fader', 'padchannel',
+                 'isActive', 'isDisabled', 'listening')
+
+    def __init__(self, channel, type):
+        self.channel = channel
+        self.type = type
+        self.trigger = None
+        self.fader = None
+        self.padchannel = None
+        self.isActive = False
+        self.isDisabled = False
+        self.listening = False
+
+
+"""What a channel's status light should show, and what's wrong with it,
+if anything. The front ends do the showing.
+
+Arguments:
+state -- The channel's ChannelState
+
+Returns (one of the LED_ constants, error message or None).
+"""
+def channelStatus(state):
+    if state.listening:
+        return LED_LISTENING, 'is listening'
+    # If a channel has no fader and no trigger, that's fine. It just 
+    # won't do anything.
+    if state.fader is None and state.trigger is None:
+        return LED_OFF, None
+    if state.isDisabled:
+        return LED_OFF, None
+    if (state.type == COL_PAD and state.padchannel is None and
+            state.fader is None):
+        return LED_OFF, None
+    # A channel has to have a trigger. If there's also a fader paired,
+    # it can't be re-routed, which is a problem.
+    if state.trigger is None and state.type == COL_NORMAL:
+        return LED_ERROR, 'has a Fader, but no Trigger'
+    # A pad channel only works when it has a channel number assigned.
+    # Otherwise, it wouldn't make sense to have a fader paired since it
+    # would never be re-routed.
+    if state.type == COL_PAD and state.padchannel is None:
+        return LED_ERROR, 'has a Fader, but no Pad Channel.'
+    # Because pad channels are always active
+    if state.type == COL_PAD or state.isActive:
+        return LED_ACTIVE, None
+    return LED_IDLE, None
+
+
+"""One row's settings, plus what its dispatch functions need: this is
+the "row" they work for (see genericDispatch in routing.py).
+
+channels -- The row's ChannelStates, the pad channel's last
+activeChannel -- Channel keys go to, from zero. The MIDI path reads and
+    writes this one.
+padchannel -- The pad channel (from 1), or None
+splits -- Keyboard splits, as (low, high, channel) tuples
+filters -- The row's MidiFilter
+voicePool -- The row's VoicePool, or None
+voices -- The row's VoiceAllocator. Set by the dispatch functions.
+quantize -- The row's Quantize, or None
+clock -- The row's ClockTracker. Set by the dispatch functions.
+onRoutingThread -- Function that runs a function on the thread routing
+    the row, or None if it doesn't have one (see
+    workers.RoutingWorkers.caller)
+
+The on... hooks are the owning row's, handed over when it's made.
+"""
+class RowState():
+    __slots__ = ('channels', 'activeChannel', 'padchannel', 'splits',
+                 'filters', 'voicePool', 'voices', 'quantize', 'clock',
+                 'onRoutingThread', 'onLearnReceived',
+                 'onTriggered', 'onFaderMoved', 'onSceneRequested',
+                 'onPanicRequested')
+
+    """Arguments:
+    owner -- The object whose hooks the dispatch functions should call
+    """
+    def __init__(self, owner):
+        self.channels = []
+        self.activeChannel = 0
+        self.padchannel = None
+        self.splits = []
+        self.filters = DEFAULT_FILTER
+        self.voicePool = None
+        self.voices = None
+        self.quantize = None
+        self.clock = None
+        self.onRoutingThread = None
+        self.onLearnReceived = owner.onLearnReceived
+        self.onTriggered = owner.onTriggered
+        self.onFaderMoved = owner.onFaderMoved
+        self.onSceneRequested = owner.onSceneRequested
+        self.onPanicRequested = owner.onPanicRequested
+
+    """Every channel's binding, as (channel, trigger, fader) tuples with
+    zero-based channels.
+    """
+    def bindings(self):
+        return tuple((state.channel - 1, state.trigger, state.fader)
+                     for state in self.channels)
+
+    """Build a RowRouting from these settings.
+
+    Arguments:
+    listenChannel, listenFor -- What the row's learning, if anything
+    panic -- The rig's panic CC, or None
+    """
+    def routing(self, listenChannel=None, listenFor=None, panic=None):
+        return buildRouting(self.bindings(), padchannel=self.padchannel,
+                            splits=self.splits,
+                            listenChannel=listenChannel,
+                            listenFor=listenFor, filters=self.filters,
+                            panic=panic, voices=self.voicePool,
+                            quantize=self.quantize)
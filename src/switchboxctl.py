@@ -0,0 +1,145 @@
+"""
+switchboxctl: drive a running SwitchBox from the command line
+
+    python switchboxctl.py state
+    python switchboxctl.py bind 1 2 --trigger 20 --fader 7
+    python switchboxctl.py bind 1 2 --trigger none
+    python switchboxctl.py activate 1 2
+    python switchboxctl.py scene 3
+    python switchboxctl.py panic
+    python switchboxctl.py batch setlist.json
+
+Rows, channels and scenes count from 1, like the window does. A batch
+file holds a JSON list of commands (see control.py), which all get
+applied at once, or not at all. Use - to read it from stdin.
+
+Scripts can also use ControlClient from control.py directly.
+"""
+
+import sys
+import json
+import argparse
+from control import ControlClient, ControlError
+
+"""A CC number, or "none" to clear the binding
+"""
+def ccNumber(text):
+    if text.lower() == 'none':
+        return None
+    return int(text)
+
+"""Print the state of the rig in a way that's easy to read.
+"""
+def printState(state):
+    if state['scene'] is not None:
+        print('Scene: ' + state['scene'])
+    for row in state['rows']:
+        print('Row ' + str(row['row']) + ' ' + row['name'] + ' (' +
+              (row['device'] or 'no device') +
+              ('' if row['connected'] else ', not connected') + ')')
+        for binding in row['bindings']:
+            isPad = binding['channel'] == len(row['bindings'])
+            line = '  ' + ('PAD' if isPad else 'CH ' + str(binding['channel']))
+            if binding['channel'] == row['channel']:
+                line += ' (active)'
+            if isPad and row['pad'] is not None:
+                line += ' channel ' + str(row['pad'])
+            if binding['trigger'] is not None:
+                line += ' trigger CC' + str(binding['trigger'])
+            if binding['fader'] is not None:
+                line += ' fader CC' + str(binding['fader'])
+            print(line)
+        quantize = row.get('quantize')
+        if quantize is not None:
+            print('  Quantized to the ' + quantize['to'] + ' (' +
+                  (str(quantize['bpm']) + ' BPM' if quantize['bpm'] is not None
+                   else 'no clock') + '): ' + str(quantize['switches']) +
+                  ' switches, off the beat by ' +
+                  '%.3f ms mean, %.3f ms worst' % (quantize['meanMs'],
+                                                   quantize['worstMs']))
+        if row['error'] is not None:
+            print('  ' + row['error'])
+    resources = state.get('resources')
+    if resources is not None:
+        outputs = resources['outputs']
+        print('MIDI: ' + str(resources['inputs']) + ' inputs (' +
+              str(resources['connected']) + ' connected), ' +
+              str(outputs['clients']) + ' output clients (' +
+              str(outputs['spares']) + ' spare)')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Drive a running SwitchBox.')
+    parser.add_argument('--socket', help='Where SwitchBox is listening: '
+                        'a socket path, or host:port')
+    parser.add_argument('--json', action='store_true',
+                        help='Print results as JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    state = commands.add_parser('state', help="Show every row's settings")
+    state.add_argument('row', type=int, nargs='?')
+    bind = commands.add_parser('bind', help='Bind CCs to a channel')
+    bind.add_argument('row', type=int)
+    bind.add_argument('channel', type=int)
+    # Left out means leave it as it is
+    bind.add_argument('--trigger', type=ccNumber, default=argparse.SUPPRESS)
+    bind.add_argument('--fader', type=ccNumber, default=argparse.SUPPRESS)
+    pad = commands.add_parser('pad', help='Set the pad channel')
+    pad.add_argument('row', type=int)
+    pad.add_argument('pad', type=ccNumber)
+    activate = commands.add_parser('activate',
+                                   help='Switch the active channel')
+    activate.add_argument('row', type=int)
+    activate.add_argument('channel', type=int)
+    scene = commands.add_parser('scene', help='Switch to a scene')
+    scene.add_argument('index', type=int)
+    commands.add_parser('panic', help='Stop every note')
+    batch = commands.add_parser('batch', help='Send commands from a file')
+    batch.add_argument('file')
+    args = parser.parse_args()
+
+    if args.command == 'batch':
+        if args.file == '-':
+            request = json.load(sys.stdin)
+        else:
+            with open(args.file) as file:
+                request = json.load(file)
+        # Either a bare list, or a whole request
+        if isinstance(request, dict):
+            request = request.get('commands', [])
+    elif args.command == 'bind':
+        command = {'cmd': 'bind', 'row': args.row, 'channel': args.channel}
+        for option in ('trigger', 'fader'):
+            if hasattr(args, option):
+                command[option] = getattr(args, option)
+        request = [command]
+    elif args.command == 'pad':
+        request = [{'cmd': 'pad', 'row': args.row, 'pad': args.pad}]
+    else:
+        command = {'cmd': args.command}
+        for field in ('row', 'channel', 'index'):
+            if getattr(args, field, None) is not None:
+                command[field] = getattr(args, field)
+        request = [command]
+
+    address = args.socket
+    if address is not None and ':' in address and '/' not in address:
+        host, port = address.rsplit(':', 1)
+        address = (host, int(port))
+    try:
+        with ControlClient(address) as client:
+            results = client.batch(request)
+    except ControlError as error:
+        sys.exit('SwitchBox said no: ' + str(error))
+    except OSError as error:
+        sys.exit("Couldn't reach SwitchBox: " + str(error))
+
+    for result in results:
+        if result is None:
+            continue
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            printState(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Timing for SwitchBox
+
+Keeps track of how long messages take to get through a row, and how
+much that wobbles (jitter). Every message is stamped with a monotonic
+clock the moment the MIDI backend hands it over, and again once it's
+been sent out.
+
+Rows can also run with a fixed output latency. Instead of sending each
+message as soon as it's routed, it's scheduled to go out a set time
+after it was played, going by the backend's own timestamps. Spend a
+millisecond or two of latency, and a busy computer's hiccups mostly
+stop showing up as jitter.
+"""
+
+import heapq
+import logging
+import threading
+from time import perf_counter, sleep
+
+# The scheduler sleeps until this long before a message is due, then
+# keeps checking the clock until it's time. Seconds.
+SPIN_S = 0.0005
+
+# If a port goes quiet for longer than this (seconds), its clock gets
+# lined up with ours again, in case the two have drifted apart.
+RESYNC_GAP_S = 2.0
+
+"""Running latency and jitter figures for a stream of messages.
+
+Only one thread should be adding to it. Anyone can read it; a figure
+might be one message behind, which is fine for a readout.
+"""
+class LatencyStats():
+    def __init__(self):
+        self.reset()
+
+    """Forget everything measured so far.
+    """
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0     # Sum of squared differences from the mean
+        self.worst = 0.0
+        self.jitter = 0.0 # Smoothed difference between neighbours
+        self.last = None
+
+    """Add one measurement, in seconds.
+    """
+    def add(self, latency):
+        self.count += 1
+        difference = latency - self.mean
+        self.mean += difference / self.count
+        self.m2 += difference * (latency - self.mean)
+        if latency > self.worst:
+            self.worst = latency
+        # Same smoothing RTP uses for its jitter estimate
+        if self.last is not None:
+            self.jitter += (abs(latency - self.last) - self.jitter) / 16
+        self.last = latency
+
+    """Standard deviation of the measurements, in seconds.
+    """
+    def deviation(self):
+        if self.count < 2:
+            return 0.0
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    """One line of text for humans, in milliseconds.
+    """
+    def summary(self):
+        if self.count == 0:
+            return 'no messages yet'
+        return ('{0} msgs, mean {1:.3f} ms, worst {2:.3f} ms, '
+                'std dev {3:.3f} ms, jitter {4:.3f} ms').format(
+                    self.count, self.mean * 1000, self.worst * 1000,
+                    self.deviation() * 1000, self.jitter * 1000)
+
+
+"""Sends messages at the times they're scheduled for.
+
+One scheduler thread serves every row running with a fixed latency,
+and every row holding a channel switch back to the beat (see
+quantize.py).
+"""
+class OutputScheduler(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self, name='SwitchBox output scheduler',
+                                  daemon=True)
+        # Heap of (due, order, send, message, timing, arrival)
+        self.queue = []
+        self.order = 0  # Keeps messages due at the same time in order
+        self.condition = threading.Condition()
+        self.start()
+
+    """Have a message sent at a given time.
+
+    Arguments:
+    due -- When to send it, on the perf_counter clock
+    send -- Function that sends it
+    message -- The message
+    timing -- The RowTiming to report back to once it's gone out, or
+        None
+    arrival -- When the message arrived, on the perf_counter clock, for
+        the RowTiming
+    """
+    def schedule(self, due, send, message, timing=None, arrival=None):
+        with self.condition:
+            self.order += 1
+            heapq.heappush(self.queue, (due, self.order, send, message,
+                                        timing, arrival))
+            # Only wake up if this one's due before whatever we were
+            # waiting on.
+            if self.queue[0][1] == self.order:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                due = self.queue[0][0]
+                wait = due - perf_counter() - SPIN_S
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+            # Close enough to spin the rest of the way
+            while perf_counter() < due:
+                sleep(0)
+            with self.condition:
+                if not self.queue or self.queue[0][0] > due:
+                    continue
+                due, order, send, message, timing, arrival = heapq.heappop(
+                    self.queue)
+            try:
+                send(message)
+            except:
+                logging.warning("Couldn't send scheduled message")
+            if timing is not None:
+                timing.sent(message, due, arrival)
+
+# Made the first time a row asks for a fixed latency
+scheduler = None
+
+"""Get the output scheduler, starting it if it isn't running yet.
+"""
+def sharedScheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = OutputScheduler()
+    return scheduler
+
+
+"""Timing for one row: when its messages came in, how long they took
+to go out, and (optionally) holding them back to a fixed latency.
+"""
+class RowTiming():
+    """Arguments:
+    fixedLatency -- Seconds from when a message was played to when it
+        should be sent, or None to send everything right away.
+    """
+    def __init__(self, fixedLatency=None):
+        self.fixedLatency = fixedLatency
+        # From arriving in Python to being sent out, for messages the
+        # routing thread sent itself
+        self.latency = LatencyStats()
+        # The same, for messages the output scheduler sent. Each thread
+        # has its own, since only one thread can add to a LatencyStats.
+        self.scheduledLatency = LatencyStats()
+        # From the backend's timestamp to arriving in Python, relative
+        # to the quickest one we've seen. Shows how much the backend
+        # and the interpreter are holding messages up.
+        self.delivery = LatencyStats()
+        # Messages that were already overdue by the time they were
+        # routed, in fixed latency mode
+        self.late = 0
+        self.reset()
+
+    """Start over, e.g. when the input port is opened again.
+    """
+    def reset(self):
+        self.backendTime = None # Backend's clock, added up from deltas
+        self.offset = None      # Our clock minus the backend's, at best
+        self.arrival = 0.0      # When the current message arrived
+        self.latency.reset()
+        self.scheduledLatency.reset()
+        self.delivery.reset()
+        self.late = 0
+
+    """Note that a message has arrived.
+
+    Called in whatever thread routes the message, right before the
+    dispatch function gets it.
+
+    Arguments:
+    delta -- Seconds since the previous message, per the MIDI backend
+    arrival -- perf_counter() when the backend handed it over
+    """
+    def arrived(self, delta, arrival):
+        if self.backendTime is None or delta > RESYNC_GAP_S:
+            self.backendTime = 0.0
+            self.offset = arrival
+        else:
+            self.backendTime += delta
+        offset = arrival - self.backendTime
+        if offset < self.offset:
+            self.offset = offset
+        self.delivery.add(offset - self.offset)
+        self.arrival = arrival
+
+    """Called by the output scheduler once a scheduled message has
+    actually gone out.
+
+    Arguments:
+    message -- The message that was sent
+    due -- When it was scheduled for
+    arrival -- When it arrived. Not self.arrival: messages have come
+        in since.
+    """
+    def sent(self, message, due, arrival):
+        self.scheduledLatency.add(perf_counter() - arrival)
+
+    """Wrap a send function so messages get timed (and scheduled, if
+    there's a fixed latency).
+
+    Arguments:
+    send -- The function that actually sends a message
+
+    Returns a function that takes a message.
+    """
+    def wrap(self, send):
+        if self.fixedLatency is None:
+            latency = self.latency
+
+            def timedSend(message):
+                send(message)
+                latency.add(perf_counter() - self.arrival)
+            return timedSend
+
+        outputs = sharedScheduler()
+
+        def scheduledSend(message):
+            due = self.offset + self.backendTime + self.fixedLatency
+            if due <= perf_counter():
+                self.late += 1
+                send(message)
+                self.latency.add(perf_counter() - self.arrival)
+            else:
+                outputs.schedule(due, send, message, self, self.arrival)
+        return scheduledSend
+
+    """One line of text describing this row's timing, for humans.
+    """
+    def summary(self):
+        text = 'Latency: ' + self.latency.summary()
+        text += '\nDelivery jitter: {0:.3f} ms'.format(
+            self.delivery.jitter * 1000)
+        if self.fixedLatency is not None:
+            text += '\nScheduled: ' + self.scheduledLatency.summary()
+            text += '\nFixed latency {0:.1f} ms, {1} late'.format(
+                self.fixedLatency * 1000, self.late)
+        return text
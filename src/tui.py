@@ -0,0 +1,800 @@
+"""
+Terminal front end for SwitchBox
+
+The window needs Tk and a display, which a rack machine you SSH into
+doesn't have, and Tk's widgets are most of what SwitchBox uses in
+memory and CPU anyway. tui.py runs the same rig from the same save file
+in a terminal instead:
+
+    python3 ./tui.py
+
+Every row shows its status light, name and device, and under that each
+channel's light (same colors as the window's) and its trigger/fader
+CCs. The first thing that's wrong goes down the bottom, same as the
+window's status bar. Routing, the routing modes, saving and following
+devices as they come and go all work just like the window's. Scenes
+and the control API are window-only for now.
+
+Keys:
+Up/Down, Left/Right -- Pick a row, and a channel in it
+Space or Enter -- Make the channel the active one
+t, f -- Learn the channel's trigger or fader (press again to cancel)
+x -- Clear the channel's bindings
+d -- Pick the row's input device
+! -- Panic: stop every note on every row
+q -- Quit
+
+The screen's drawn no more than MAX_FPS times a second, and only when
+something's changed. Only the parts of it that changed get written to
+the terminal, so it's light on a slow SSH link too.
+
+Run it instead of SwitchBox.py, not alongside it: they'd both open
+every row's ports, and both write the save file.
+"""
+
+import os
+import sys
+import queue
+import curses
+import logging
+from time import monotonic, perf_counter
+from lxml import etree
+from paths import PATH_SWITCHBOXFILES, PATH_CURRENT_XML, makeFilesFolder
+from routing import EMPTY_ROUTING, backendFilter, compileDispatch
+from scenes import SceneBook
+from workers import RoutingWorkers
+from ports import PortOpener, reopenInPort, closePort
+from devices import DeviceRegistry, fingerprints
+from config import ConfigStore
+from panic import NoteTracker, PanicButton
+from state import (ChannelState, RowState, stateProperty, channelStatus,
+                   COL_NORMAL, COL_PAD, LED_OFF, LED_IDLE, LED_ACTIVE,
+                   LED_LISTENING, LED_ERROR)
+from netmidi import NetMidiIn, NetMidiOut, netPortName
+from scheduler import Scheduler, PRIORITY_HIGH, PRIORITY_LOW
+
+# Same log file as SwitchBox.py (the folder and save file come from
+# paths.py)
+LOG_FILE = os.path.join(PATH_SWITCHBOXFILES, 'switcheroo.log')
+LOG_FORMAT = ('%(asctime)s %(levelname)s in module %(module)s:'
+              '%(lineno)d: %(message)s')
+
+# Channels per row (the pad channel's one more)
+NUM_COLS = 9
+
+# Most times a second the screen gets drawn. It's also how often work
+# handed over by the MIDI callbacks gets picked up.
+MAX_FPS = 20
+
+# How often to look for new devices, and how long a channel's light
+# stays lit when its fader moves, in seconds
+INTERVAL_CHECKNEW_S = 0.5
+INTERVAL_BLINK_S = 0.06
+
+# See SwitchBox.py for what these do
+ROUTING_MODE = 'inline'
+ROUTING_SHARDS = 0
+ROUTING_QUEUE_SIZE = 4096
+PORT_THREADS = 4
+SCHEDULER_WORKERS = 2
+SCAN_TIMEOUT_S = 10
+SAVE_TIMEOUT_S = 5
+CONFIG_JOURNAL = True
+PANIC_CC = None
+LOG_LEVEL = logging.WARN
+
+# How many characters each channel gets across the screen, and how many
+# lines each row takes
+CELL_WIDTH = 7
+ROW_LINES = 3
+
+"""A row, without the widgets: its ports, routing and bindings, and
+what it has to say for itself on screen.
+"""
+class TerminalRow():
+    activeChannel = stateProperty('activeChannel')
+
+    """Arguments:
+    upper -- The TerminalApp
+    number -- The row's number, from 1
+    config -- The row's RowConfig, from the ConfigStore
+    """
+    def __init__(self, upper, number, config):
+        self.upper = upper
+        self.number = number
+        self.XMLElement = config.element
+        self.net = config.net
+        self.state = RowState(self)
+        self.state.channels = [ChannelState(channel + 1, COL_NORMAL)
+                               for channel in range(NUM_COLS)]
+        self.state.channels.append(ChannelState(NUM_COLS + 1, COL_PAD))
+        for channel, trigger, fader in config.bindings:
+            self.state.channels[channel].trigger = trigger
+            self.state.channels[channel].fader = fader
+        self.state.padchannel = config.padchannel
+        self.state.channels[-1].padchannel = config.padchannel
+        self.state.channels[0].isActive = True
+        self.state.splits = list(config.splits)
+        self.state.filters = config.filters
+        self.state.voicePool = config.voices
+        self.state.quantize = config.quantize
+
+        self.notes = NoteTracker(tracking=ROUTING_MODE != 'process')
+        self.inport = None
+        self.outport = None
+        self.portError = None
+        self.inports = []
+        self.connectedName = None
+        # (channel from zero, 'T' or 'F') while learning a binding
+        self.learning = None
+        # Channel -> when its light stops blinking
+        self.blinks = {}
+        self.midiCallback = upper.workers.attach(self)
+        self.state.onRoutingThread = upper.workers.caller(self)
+        self.routing = EMPTY_ROUTING
+        self.dispatch = self.makeDispatch(EMPTY_ROUTING)
+        self.publishRouting()
+
+        onOpened = lambda ports: upper.postToUI(self.onPortsReady, ports)
+        filters = backendFilter(config.filters, config.quantize)
+        if self.hasNetInput():
+            upper.portOpener.open(
+                self.makeOutPort, self.portName(),
+                netPortName(self.net.inAddress), None, filters,
+                onOpened, makeInPort=lambda: NetMidiIn(self.net.inAddress))
+        else:
+            upper.portOpener.open(self.makeOutPort, self.portName(),
+                                  config.device, config.ordinal,
+                                  filters, onOpened)
+
+    def name(self):
+        name = self.XMLElement.get('name', '')
+        return name if name.strip() != '' else 'Row ' + str(self.number)
+
+    def portName(self):
+        return self.name() + ' (SwitchBox)'
+
+    def hasNetInput(self):
+        return self.net is not None and self.net.inAddress is not None
+
+    def makeOutPort(self):
+        if (self.net is not None and self.net.outAddress is not None and
+                ROUTING_MODE != 'process'):
+            return NetMidiOut(self.net.outAddress, self.net.latency)
+        return self.upper.workers.outPort(self)
+
+    """Put our freshly opened ports into service (see PortOpener).
+    """
+    def onPortsReady(self, ports):
+        self.inport = ports.inport
+        self.outport = ports.outport
+        if self.inport is None or self.outport is None:
+            self.portError = "Couldn't open MIDI ports"
+            self.upper.changed()
+            return
+        self.publishRouting()
+        self.inport.set_callback(self.midiCallback, None)
+        self.inports = list(ports.devices)
+        if not self.upper.devices.ports and not self.hasNetInput():
+            self.upper.devices.apply(ports.devices)
+        if ports.device is not None:
+            self.connectedName = self.inports[ports.device]
+        self.upper.changed()
+
+    def makeDispatch(self, routing):
+        if self.outport is None:
+            send = lambda message: None
+        else:
+            send = self.notes.wrap(self.outport.send_message)
+        return compileDispatch(routing, self.state, send, self.upper.scenes)
+
+    """Build a new routing table from our settings and put it into
+    service, same as RowElement.publishRouting().
+    """
+    def publishRouting(self):
+        listenChannel, listenFor = self.learning or (None, None)
+        routing = self.state.routing(listenChannel=listenChannel,
+                                     listenFor=listenFor,
+                                     panic=self.upper.panicCC)
+        self.routing = routing
+        self.dispatch = self.makeDispatch(routing)
+        if self.outport is not None:
+            self.upper.workers.publish(self, routing, self.upper.scenes)
+
+    # What the routing workers call
+    def onReceived(self, event, data=None):
+        self.dispatch(event[0])
+
+    def route(self, message, delta, arrival):
+        self.dispatch(message)
+
+    # What the dispatch functions call. Anything for the screen goes
+    # through postToUI, same as in the window.
+    def onLearnReceived(self, routing, cc):
+        self.upper.postToUI(self.onLearned, routing, cc)
+
+    def onTriggered(self):
+        self.upper.postToUI(self.showActiveChannel)
+
+    def onFaderMoved(self, channel):
+        self.upper.postToUI(self.blink, channel)
+
+    def onSceneRequested(self, index, scenes):
+        pass
+
+    def onPanicRequested(self):
+        self.upper.panic()
+
+    def showActiveChannel(self):
+        for n, channel in enumerate(self.state.channels):
+            channel.isActive = n == self.activeChannel
+        self.upper.changed()
+
+    def blink(self, channel):
+        self.blinks[channel] = monotonic() + INTERVAL_BLINK_S
+        self.upper.changed()
+
+    """Switch the active channel, as if its trigger had come in.
+    """
+    def activateChannel(self, channel):
+        previous = self.activeChannel
+        if channel == previous or channel >= NUM_COLS:
+            return
+        self.activeChannel = channel
+        if self.outport is not None:
+            self.upper.workers.publish(
+                self, self.routing._replace(channel=channel),
+                self.upper.scenes)
+            # Same stuck note precaution as when a trigger does it
+            self.outport.send_message([(0b1011 << 4) + previous, 123, 0])
+        self.showActiveChannel()
+
+    """Start (or, if it's already going, cancel) learning a binding.
+
+    Arguments:
+    channel -- Which channel, from zero
+    what -- 'T' for its trigger, 'F' for its fader
+    """
+    def learn(self, channel, what):
+        if self.learning == (channel, what):
+            self.stopLearning()
+            return
+        if self.connectedName is None and not self.hasNetInput():
+            return
+        if what == 'T' and self.state.channels[channel].type == COL_PAD:
+            return
+        self.learning = (channel, what)
+        for n, state in enumerate(self.state.channels):
+            state.listening = n == channel
+            state.isDisabled = n != channel
+        self.publishRouting()
+        self.upper.changed()
+
+    def stopLearning(self):
+        self.learning = None
+        for state in self.state.channels:
+            state.listening = False
+            state.isDisabled = False
+        self.publishRouting()
+        self.upper.changed()
+
+    """Called on the UI side when a CC comes in while learning.
+    """
+    def onLearned(self, routing, cc):
+        if self.learning != (routing.listenChannel, routing.listenFor):
+            logging.info('Stale binding, ignoring')
+            return
+        channel, what = self.learning
+        state = self.state.channels[channel]
+        if what == 'T':
+            state.trigger = cc
+        else:
+            state.fader = cc
+        self.stopLearning()
+        self.saveChannel(channel)
+
+    """Clear a channel's trigger and fader.
+    """
+    def clearChannel(self, channel):
+        if self.learning is not None:
+            self.stopLearning()
+        state = self.state.channels[channel]
+        state.trigger = None
+        state.fader = None
+        self.publishRouting()
+        self.saveChannel(channel)
+        self.upper.changed()
+
+    """Find this row's element for a channel, making one if there isn't
+    one yet.
+    """
+    def channelElement(self, channel):
+        for element in self.XMLElement:
+            if element.tag == 'ch' and element.get('chan') == str(channel):
+                return element
+        element = etree.SubElement(self.XMLElement, 'ch')
+        element.attrib['chan'] = str(channel)
+        self.upper.store.added(element)
+        return element
+
+    def saveChannel(self, channel):
+        state = self.state.channels[channel]
+        store = self.upper.store
+        element = self.channelElement(state.channel)
+        if state.type == COL_NORMAL:
+            store.set(element, 't', str(state.trigger)
+                      if state.trigger is not None else None)
+        store.set(element, 'f',
+                  str(state.fader) if state.fader is not None else None)
+        self.upper.saveFile()
+
+    """Open the input on one of the devices, and save it as ours.
+
+    Arguments:
+    index -- The device's port number
+    """
+    def selectDevice(self, index):
+        if not self.openPort(index):
+            return
+        store = self.upper.store
+        store.set(self.XMLElement, 'dev', self.inports[index])
+        ordinal = fingerprints(self.inports)[index][1]
+        store.set(self.XMLElement, 'ord', str(ordinal) if ordinal else None)
+        self.upper.saveFile()
+
+    def openPort(self, index):
+        if self.inport is None:
+            return False
+        try:
+            reopenInPort(self.inport, index, self.midiCallback)
+            self.connectedName = self.inports[index]
+            return True
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(str(exc_tb.tb_lineno) + ':' +
+                            exc_type.__name__ + ': ' + str(exc_obj) +
+                            ": Couldn't open port")
+            self.connectedName = None
+            return False
+        finally:
+            self.upper.changed()
+
+    def savedOrdinal(self):
+        ordinal = self.XMLElement.get('ord', '')
+        return int(ordinal) if ordinal.isdigit() else None
+
+    """Catch up with the App's DeviceRegistry after the devices change,
+    same as RowElement.followDevices().
+    """
+    def followDevices(self):
+        if self.hasNetInput() or self.inport is None:
+            return
+        registry = self.upper.devices
+        self.inports = list(registry.ports)
+        index = registry.find(self.XMLElement.get('dev'),
+                              self.savedOrdinal())
+        if index is None:
+            self.connectedName = None
+        elif (registry.ports[index] != self.connectedName or
+                not self.inport.is_port_open()):
+            if not self.openPort(index):
+                logging.warning("Couldn't auto-reconnect to device!")
+        self.upper.changed()
+
+    """What the row's status light shows, and what's wrong with it, same
+    as RowElement.updateAll() works out.
+
+    Returns (one of the LED_ constants, error message or None).
+    """
+    def status(self):
+        if self.portError is not None:
+            return LED_ERROR, self.portError
+        if self.inport is None:
+            return LED_LISTENING, 'Opening MIDI ports...'
+        if self.connectedName is None and not self.hasNetInput():
+            return LED_ERROR, 'Not connected to MIDI Device'
+        for state in self.state.channels:
+            led, errmsg = channelStatus(state)
+            if errmsg is not None:
+                return LED_ACTIVE, (('CH ' + str(state.channel) + ' ')
+                                    if state.type == COL_NORMAL
+                                    else 'PAD ') + errmsg
+        return LED_ACTIVE, None
+
+    """What a channel's light shows right now, blinks included.
+    """
+    def channelLight(self, channel, now):
+        if self.connectedName is None and not self.hasNetInput():
+            return LED_OFF
+        led = channelStatus(self.state.channels[channel])[0]
+        if led in (LED_OFF, LED_IDLE) and self.blinks.get(channel, 0) > now:
+            return LED_ACTIVE
+        return led
+
+    def close(self):
+        self.upper.workers.detach(self)
+        for port in (self.inport, self.outport):
+            if port is not None:
+                closePort(port)
+
+
+"""Keeps track of what's on the terminal, so each frame only writes
+the cells that changed.
+"""
+class Screen():
+    def __init__(self, window):
+        self.window = window
+        self.shown = {}   # (y, x) -> (text, attributes)
+
+    """Put a frame up.
+
+    Arguments:
+    cells -- Dictionary of (y, x) -> (text, attributes)
+
+    Returns how many cells had to be written.
+    """
+    def show(self, cells):
+        if cells.keys() != self.shown.keys():
+            # The layout's changed (or the terminal's been resized), so
+            # start from a clean slate
+            self.window.erase()
+            self.shown = {}
+        height, width = self.window.getmaxyx()
+        written = 0
+        for (y, x), cell in cells.items():
+            if self.shown.get((y, x)) == cell:
+                continue
+            written += 1
+            text, attributes = cell
+            if y >= height or x >= width:
+                continue
+            try:
+                self.window.addstr(y, x, text[:width - x], attributes)
+            except curses.error:
+                # Writing the bottom right corner moves the cursor off
+                # the screen, which curses complains about after it's
+                # done it
+                pass
+        self.shown = cells
+        if written:
+            self.window.noutrefresh()
+            curses.doupdate()
+        return written
+
+
+"""Keeps the last warning logged, to show on the bottom line when
+nothing else needs to be.
+"""
+class LastWarning(logging.Handler):
+    def __init__(self, onWarning):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.onWarning = onWarning
+        self.message = None
+
+    def emit(self, record):
+        self.message = record.getMessage()
+        self.onWarning()
+
+
+"""The rig, in a terminal.
+"""
+class TerminalApp():
+    """Arguments:
+    window -- The curses window to draw in
+    backend -- The MIDI backend module (normally rtmidi)
+    path -- The save file
+    """
+    def __init__(self, window, backend, path=PATH_CURRENT_XML):
+        # On a machine SwitchBox has never run on, there's nowhere to
+        # put the save file yet
+        if path == PATH_CURRENT_XML:
+            makeFilesFolder()
+        self.window = window
+        self.screen = Screen(window)
+        self.attributes = self.setUpColors()
+        self.uiQueue = queue.SimpleQueue()
+        self.isChanged = True
+        self.isRunning = True
+        self.selectedRow = 0
+        self.selectedChannel = 0
+        self.topRow = 0
+        # (row, highlighted device) while the device list is up
+        self.picking = None
+        self.warnings = LastWarning(self.changed)
+        logging.getLogger().addHandler(self.warnings)
+
+        self.scenes = SceneBook()
+        self.workers = RoutingWorkers(ROUTING_MODE, ROUTING_SHARDS,
+                                      ROUTING_QUEUE_SIZE, backend)
+        self.scheduler = Scheduler(SCHEDULER_WORKERS)
+        self.store = ConfigStore(path, journal=CONFIG_JOURNAL)
+        self.panicButton = PanicButton(self.panicTargets)
+        self.portOpener = PortOpener(backend, PORT_THREADS)
+        self.devices = DeviceRegistry()
+
+        def makeDefault():
+            root = etree.Element('swr')
+            root.set('title', 'Auto-Generated Save File')
+            etree.SubElement(root, 'row')
+            return root
+        tree = self.store.load(makeDefault, NUM_COLS + 1)
+        panic = tree.getroot().get('panic', '')
+        self.panicCC = (int(panic) if panic.isdigit() and int(panic) < 128
+                        else PANIC_CC)
+        self.rowlist = [TerminalRow(self, number + 1, config)
+                        for number, config in enumerate(self.store.rows)]
+        self.portOpener.rescan()
+        self.scanning = self.scheduler.every(
+            INTERVAL_CHECKNEW_S, self.scanDevices, priority=PRIORITY_LOW,
+            timeout=SCAN_TIMEOUT_S, name='Device scan')
+
+    """Work out the attributes for each kind of light, in color if the
+    terminal has it.
+    """
+    def setUpColors(self):
+        attributes = {LED_OFF: curses.A_DIM, LED_IDLE: curses.A_NORMAL,
+                      LED_ACTIVE: curses.A_REVERSE,
+                      LED_LISTENING: curses.A_BOLD | curses.A_BLINK,
+                      LED_ERROR: curses.A_BOLD | curses.A_UNDERLINE}
+        if not curses.has_colors():
+            return attributes
+        curses.start_color()
+        try:
+            curses.use_default_colors()
+            background = -1
+        except curses.error:
+            background = curses.COLOR_BLACK
+        for pair, color in ((1, curses.COLOR_GREEN), (2, curses.COLOR_YELLOW),
+                            (3, curses.COLOR_RED)):
+            curses.init_pair(pair, color, background)
+        attributes.update({
+            LED_IDLE: curses.color_pair(1),
+            LED_ACTIVE: curses.color_pair(1) | curses.A_REVERSE |
+                curses.A_BOLD,
+            LED_LISTENING: curses.color_pair(2) | curses.A_REVERSE,
+            LED_ERROR: curses.color_pair(3) | curses.A_BOLD})
+        return attributes
+
+    """Hand a function to the UI to run on its next tick. Safe to call
+    from anywhere.
+    """
+    def postToUI(self, function, *args):
+        self.uiQueue.put((function, args))
+
+    """Say the screen needs drawing again.
+    """
+    def changed(self):
+        self.isChanged = True
+
+    def saveFile(self):
+        if self.store.useJournal:
+            self.scheduler.submit(self.store.save, priority=PRIORITY_HIGH,
+                                  timeout=SAVE_TIMEOUT_S, key='save',
+                                  name='Save')
+            return
+        try:
+            self.store.save()
+        except:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            logging.warning(exc_type.__name__ + ': ' + str(exc_obj) +
+                            ": Couldn't save")
+
+    def scanDevices(self):
+        self.postToUI(self.onDevicesScanned, self.portOpener.listDevices())
+
+    def onDevicesScanned(self, ports):
+        if self.devices.update(ports, perf_counter()):
+            for row in self.rowlist:
+                row.followDevices()
+
+    def panic(self):
+        self.panicButton.press()
+
+    def panicTargets(self):
+        return [(row.outport.send_message, row.notes)
+                for row in list(self.rowlist) if row.outport is not None]
+
+    """Run until it's quit.
+    """
+    def run(self):
+        self.window.timeout(int(1000 / MAX_FPS))
+        nextFrame = 0.0
+        while self.isRunning:
+            key = self.window.getch()
+            if key != -1:
+                self.onKey(key)
+            while True:
+                try:
+                    function, args = self.uiQueue.get_nowait()
+                except queue.Empty:
+                    break
+                function(*args)
+            now = monotonic()
+            if self.isChanged and now >= nextFrame:
+                self.isChanged = False
+                nextFrame = now + 1 / MAX_FPS
+                self.screen.show(self.frame(now))
+
+    def onKey(self, key):
+        self.changed()
+        if key == curses.KEY_RESIZE:
+            self.screen.shown = {}
+            return
+        if self.picking is not None:
+            self.onPickerKey(key)
+            return
+        row = self.rowlist[self.selectedRow] if self.rowlist else None
+        if key in (ord('q'), ord('Q')):
+            self.isRunning = False
+        elif key == ord('!'):
+            self.panic()
+        elif row is None:
+            return
+        elif key == curses.KEY_UP:
+            self.selectedRow = max(0, self.selectedRow - 1)
+        elif key == curses.KEY_DOWN:
+            self.selectedRow = min(len(self.rowlist) - 1,
+                                   self.selectedRow + 1)
+        elif key == curses.KEY_LEFT:
+            self.selectedChannel = max(0, self.selectedChannel - 1)
+        elif key == curses.KEY_RIGHT:
+            self.selectedChannel = min(NUM_COLS, self.selectedChannel + 1)
+        elif key in (ord(' '), ord('\n'), curses.KEY_ENTER):
+            row.activateChannel(self.selectedChannel)
+        elif key in (ord('t'), ord('T')):
+            row.learn(self.selectedChannel, 'T')
+        elif key in (ord('f'), ord('F')):
+            row.learn(self.selectedChannel, 'F')
+        elif key in (ord('x'), ord('X')):
+            row.clearChannel(self.selectedChannel)
+        elif key in (ord('d'), ord('D')):
+            if row.inport is not None and not row.hasNetInput():
+                # Look again now, so the list's what's plugged in now
+                self.devices.apply(self.portOpener.listDevices())
+                for rows in self.rowlist:
+                    rows.followDevices()
+                devices = self.devices.ports
+                current = (devices.index(row.connectedName)
+                           if row.connectedName in devices else 0)
+                self.picking = (row, current)
+
+    def onPickerKey(self, key):
+        row, current = self.picking
+        devices = self.devices.ports
+        if key == curses.KEY_UP:
+            self.picking = (row, max(0, current - 1))
+        elif key == curses.KEY_DOWN:
+            self.picking = (row, min(len(devices) - 1, current + 1))
+        elif key in (ord('\n'), curses.KEY_ENTER, ord(' ')):
+            self.picking = None
+            if current < len(devices):
+                row.inports = list(devices)
+                row.selectDevice(current)
+        elif key in (27, ord('q'), ord('d')):
+            self.picking = None
+
+    """Lay out everything that should be on the screen.
+
+    Returns a dictionary of (y, x) -> (text, attributes).
+    """
+    def frame(self, now):
+        height, width = self.window.getmaxyx()
+        cells = {}
+
+        def put(y, x, text, attributes=curses.A_NORMAL):
+            cells[(y, x)] = (text, attributes)
+        put(0, 0, 'SwitchBox: ' + str(len(self.rowlist)) + ' rows, ' +
+            ROUTING_MODE + ' routing')
+
+        # Scroll so the selected row's on screen
+        fits = max(1, (height - 4) // ROW_LINES)
+        if self.selectedRow < self.topRow:
+            self.topRow = self.selectedRow
+        elif self.selectedRow >= self.topRow + fits:
+            self.topRow = self.selectedRow - fits + 1
+        blinking = False
+        errmsg = None
+        for row in self.rowlist:
+            led, rowError = row.status()
+            if errmsg is None and rowError is not None:
+                errmsg = row.name() + ': ' + rowError
+            if row.blinks:
+                if max(row.blinks.values()) > now:
+                    blinking = True
+                else:
+                    row.blinks = {}
+
+        for n, row in enumerate(self.rowlist[self.topRow:
+                                             self.topRow + fits]):
+            number = self.topRow + n
+            y = 2 + n * ROW_LINES
+            isSelected = number == self.selectedRow
+            led = row.status()[0]
+            put(y, 0, '>' if isSelected else ' ')
+            put(y, 2, ' ', self.attributes[led] | curses.A_REVERSE)
+            put(y, 4, '%-20s' % row.name()[:20],
+                curses.A_BOLD if isSelected else curses.A_NORMAL)
+            device = (row.connectedName if row.connectedName is not None
+                      else netPortName(row.net.inAddress)
+                      if row.hasNetInput() else '(no device)')
+            put(y, 25, '%-40s' % device[:40])
+            for channel, state in enumerate(row.state.channels):
+                x = 4 + channel * CELL_WIDTH
+                label = ('CH' + str(state.channel) if state.type == COL_NORMAL
+                         else 'PAD' + (str(state.padchannel)
+                                       if state.padchannel is not None
+                                       else ''))
+                attributes = self.attributes[row.channelLight(channel, now)]
+                if isSelected and channel == self.selectedChannel:
+                    attributes |= curses.A_UNDERLINE
+                put(y + 1, x, ' %-5s' % label, attributes)
+                put(y + 2, x, '%3s/%-3s' % (
+                    state.trigger if state.trigger is not None else '-',
+                    state.fader if state.fader is not None else '-'))
+
+        if self.picking is not None:
+            self.pickerFrame(put, height)
+        if errmsg is None:
+            errmsg = self.warnings.message or ''
+        put(height - 2, 0, '%-*s' % (width - 1, errmsg[:width - 1]),
+            self.attributes[LED_ERROR] if errmsg else curses.A_NORMAL)
+        put(height - 1, 0, ('arrows pick  space activate  t/f learn  '
+                            'x clear  d device  ! panic  q quit')[:width - 1])
+        if blinking:
+            # Come back once the blink's over
+            self.changed()
+        return cells
+
+    """Lay out the device list over the rows.
+    """
+    def pickerFrame(self, put, height):
+        row, current = self.picking
+        devices = self.devices.ports or ('(nothing plugged in)',)
+        put(2, 40, '%-36s' % ('Input for ' + row.name())[:36],
+            curses.A_REVERSE)
+        for n, device in enumerate(devices[:max(1, height - 7)]):
+            put(3 + n, 40, ' %-35s' % device[:35],
+                curses.A_REVERSE | curses.A_BOLD if n == current
+                else curses.A_REVERSE)
+        put(3 + min(len(devices), max(1, height - 7)), 40,
+            '%-36s' % 'Enter: use it  Esc: never mind', curses.A_REVERSE)
+
+    def stop(self):
+        logging.getLogger().removeHandler(self.warnings)
+        self.scanning.cancel()
+        for row in self.rowlist:
+            row.close()
+        # Lets any saves still waiting finish first
+        self.scheduler.stop()
+        self.store.close()
+        self.panicButton.stop()
+        self.portOpener.stop()
+        self.workers.stop()
+
+
+def main():
+    import rtmidi
+    # Logging to the terminal would draw all over the screen, so it's
+    # the log file or nothing (the last warning shows at the bottom)
+    if os.path.isfile(LOG_FILE):
+        logging.basicConfig(filename=LOG_FILE, level=LOG_LEVEL,
+                            format=LOG_FORMAT)
+    else:
+        logging.getLogger().setLevel(LOG_LEVEL)
+        logging.getLogger().addHandler(logging.NullHandler())
+    # Don't keep Esc waiting to see if it's the start of a longer key
+    os.environ.setdefault('ESCDELAY', '25')
+
+    def run(window):
+        curses.curs_set(0)
+        window.keypad(True)
+        app = TerminalApp(window, rtmidi)
+        try:
+            app.run()
+        finally:
+            app.stop()
+    curses.wrapper(run)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Voice allocation for SwitchBox
+
+Normally a row sends every key to its active channel. A row with a
+voice pool spreads its notes over a range of channels instead, one
+note per channel, the way MPE synths and stacks of mono synths want
+them. Set one up in the save file:
+
+    <voices lo="2" hi="16" mode="mpe"/>
+
+lo, hi -- The pool's channels, counting from 1
+mode -- How notes get channels:
+    mpe -- Each note gets the channel that's been free the longest.
+        Pitch bend, channel pressure and CCs follow the note that was
+        played on the same input channel (which is how an MPE
+        controller sends them), so each note bends on its own.
+        Anything that isn't about a note (like the sustain pedal, or
+        an MPE controller's master channel) goes to every channel.
+    rotate -- Notes take turns going to each channel, round-robin,
+        whether the last note there has finished or not. Pitch bend,
+        pressure and CCs go to every channel.
+
+Note Offs and polyphonic aftertouch always follow their note to
+whichever channel it went to. If every channel in an mpe pool is busy,
+the oldest note gets cut off (with a Note Off) to make room.
+"""
+
+from collections import namedtuple, deque, OrderedDict
+
+VOICES_MPE = 'mpe'
+VOICES_ROTATE = 'rotate'
+
+# What noteOff() says about a Note Off that shouldn't be sent at all
+DROP = -1
+
+"""A row's voice pool.
+
+low, high -- The first and last channel in the pool, from zero
+mode -- VOICES_MPE or VOICES_ROTATE
+"""
+class VoicePool(namedtuple('VoicePool', ['low', 'high', 'mode'])):
+    __slots__ = ()
+
+"""Read a row's voice pool out of its XML element.
+
+Returns a VoicePool, or None if the row doesn't have one (or it doesn't
+make sense).
+"""
+def readVoices(XMLElement):
+    element = XMLElement.find('voices')
+    if element is None:
+        return None
+    low = element.get('lo', '')
+    high = element.get('hi', '')
+    mode = element.get('mode', VOICES_MPE)
+    if (not low.isdigit() or not high.isdigit() or
+            not 1 <= int(low) <= int(high) <= 16 or
+            mode not in (VOICES_MPE, VOICES_ROTATE)):
+        return None
+    return VoicePool(int(low) - 1, int(high) - 1, mode)
+
+
+"""Hands out channels from a pool to notes, and remembers which note
+went where.
+
+Notes are known by their input channel and note number together, as
+channel * 128 + note. Everything's constant time: free channels wait
+in a queue, longest-free first, and sounding notes are kept in the
+order they started, so the oldest can be found right away when one has
+to be cut off.
+
+Only the thread routing the row should use it.
+"""
+class VoiceAllocator():
+    def __init__(self, pool):
+        self.pool = pool
+        self.channels = tuple(range(pool.low, pool.high + 1))
+        self.isMPE = pool.mode == VOICES_MPE
+        self.free = deque(self.channels)
+        self.sounding = OrderedDict()  # Note -> channel, oldest first
+        self.byInput = {}   # Input channel -> channel of its latest note
+        self.cutOff = set() # Notes cut off to make room
+        self.next = 0       # Whose turn it is, for rotate
+
+    """A note's starting. Returns the channel it goes to.
+
+    Arguments:
+    inchannel -- The channel it came in on, from zero
+    note -- The note number
+    send -- Sends a Note Off, should a note need cutting off
+    """
+    def noteOn(self, inchannel, note, send):
+        key = (inchannel << 7) | note
+        channel = self.sounding.get(key)
+        if channel is not None:
+            # Played again without being let go of: same channel
+            self.sounding.move_to_end(key)
+        elif not self.isMPE:
+            channel = self.channels[self.next]
+            self.next = (self.next + 1) % len(self.channels)
+            self.sounding[key] = channel
+        else:
+            if self.free:
+                channel = self.free.popleft()
+            else:
+                oldest, channel = self.sounding.popitem(last=False)
+                self.cutOff.add(oldest)
+                send([0x80 | channel, oldest & 0x7F, 0])
+            self.sounding[key] = channel
+        self.byInput[inchannel] = channel
+        self.cutOff.discard(key)
+        return channel
+
+    """A note's ending. Returns the channel it was on, None if we never
+    saw it start (so it was probably sent to the active channel), or
+    DROP if it was cut off already.
+    """
+    def noteOff(self, inchannel, note):
+        key = (inchannel << 7) | note
+        channel = self.sounding.pop(key, None)
+        if channel is None:
+            if key in self.cutOff:
+                self.cutOff.discard(key)
+                return DROP
+            return None
+        if self.isMPE:
+            self.free.append(channel)
+        if self.byInput.get(inchannel) == channel:
+            del self.byInput[inchannel]
+        return channel
+
+    """The channel a sounding note is on, or None.
+    """
+    def noteChannel(self, inchannel, note):
+        return self.sounding.get((inchannel << 7) | note)
+
+    """Where pitch bend, pressure and CCs from an input channel go: the
+    channel of the note being played on it, or None for every channel
+    in the pool.
+    """
+    def expression(self, inchannel):
+        if self.isMPE:
+            return self.byInput.get(inchannel)
+        return None
+
+"""Get the voice allocator a row's dispatch function should use.
+
+The allocator belongs to the row rather than to one routing table, so
+notes can be let go of properly after the table's been swapped for
+another. It only gets replaced when the pool itself changes.
+
+Arguments:
+row -- The row (or whatever the dispatch function works for)
+pool -- The routing table's VoicePool, or None
+"""
+def allocatorFor(row, pool):
+    if pool is None:
+        return None
+    allocator = getattr(row, 'voices', None)
+    if allocator is None or allocator.pool != pool:
+        allocator = VoiceAllocator(pool)
+        row.voices = allocator
+    return allocator
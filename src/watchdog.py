@@ -0,0 +1,200 @@
+"""
+Stall watchdog for SwitchBox
+
+Anything that holds up the MIDI callbacks or the Tk main loop for too
+long (a slow disk under saveFile, a dialog that won't go away) shows up
+as late notes, and usually the musicians notice before we do. The
+watchdog keeps an eye on heartbeats from both, and when one goes quiet
+for longer than the budget it samples that thread's stack to find out
+what it's stuck in.
+"""
+
+import sys
+import logging
+import threading
+from collections import Counter, deque
+from time import perf_counter, sleep
+
+# How often the watchdog checks the heartbeats, in seconds
+POLL_S = 0.01
+
+# How many finished stalls to remember
+STALL_HISTORY = 100
+
+"""One thing being watched.
+
+There are two kinds:
+Periodic -- Something that should call beat() every so often, like the
+    Tk main loop's timers. It's stalled if a beat is late.
+Busy -- Something that calls enter() when it starts work and leave()
+    when it's done, like a MIDI callback. It's stalled if it's been at
+    it for too long.
+"""
+class Heartbeat():
+    """Arguments:
+    name -- What to call it in the status bar and the log
+    period -- How often beat() gets called, in seconds, for periodic
+        heartbeats. None for busy ones.
+    """
+    def __init__(self, name, period=None):
+        self.name = name
+        self.period = period
+        self.thread = None     # Thread ident to sample when it stalls
+        self.last = perf_counter()
+        self.busySince = 0.0   # 0 when not busy
+
+    """Periodic heartbeats: still alive.
+    """
+    def beat(self):
+        self.last = perf_counter()
+        self.thread = threading.get_ident()
+
+    """Busy heartbeats: starting work.
+
+    Arguments:
+    now -- perf_counter() at the start of the work, if the caller
+        already has it
+    """
+    def enter(self, now=None):
+        self.thread = threading.get_ident()
+        self.busySince = perf_counter() if now is None else now
+
+    """Busy heartbeats: done.
+    """
+    def leave(self):
+        self.busySince = 0.0
+
+    """How far over its time this heartbeat is, in seconds. Zero or
+    less if it's fine.
+    """
+    def overdue(self, now):
+        if self.period is not None:
+            return now - self.last - self.period
+        busySince = self.busySince
+        return now - busySince if busySince else 0.0
+
+
+"""A stall the watchdog caught.
+"""
+class Stall():
+    def __init__(self, name, started):
+        self.name = name
+        self.started = started # perf_counter() when it went over budget
+        self.duration = None   # Roughly how long it was stuck, once
+                               # it's over, in seconds
+        self.samples = Counter() # Where the thread was, each time we looked
+        self.stack = ''        # The first stack we sampled, as text
+
+    """Where the stalled thread spent most of its time, as text.
+    """
+    def where(self):
+        if not self.samples:
+            return 'unknown'
+        return self.samples.most_common(1)[0][0]
+
+    """One line of text for humans.
+    """
+    def summary(self):
+        if self.duration is None:
+            return '{0} stalled in {1}'.format(self.name, self.where())
+        return '{0} stalled {1:.0f} ms in {2}'.format(
+            self.name, self.duration * 1000, self.where())
+
+
+"""Watches heartbeats from its own thread.
+"""
+class Watchdog(threading.Thread):
+    """Arguments:
+    budget -- How late (periodic) or long (busy) a heartbeat can be, in
+        seconds, before it counts as a stall. None turns the watchdog
+        off; heartbeats still work, nobody checks them.
+    onStall -- Function that gets each Stall twice: once when it's
+        caught, and again once it's over and its duration is known.
+        Called from the watchdog thread.
+    """
+    def __init__(self, budget, onStall=None):
+        threading.Thread.__init__(self, name='SwitchBox watchdog',
+                                  daemon=True)
+        self.budget = budget
+        self.onStall = onStall
+        self.beats = ()        # Replaced, never edited
+        self.lock = threading.Lock()
+        self.ongoing = {}      # Heartbeat -> Stall
+        self.history = deque(maxlen=STALL_HISTORY)
+        self.running = budget is not None
+        if self.running:
+            self.start()
+
+    """Start watching something.
+
+    Arguments:
+    name -- What to call it
+    period -- For periodic heartbeats, how often it beats, in seconds
+
+    Returns the Heartbeat to call.
+    """
+    def watch(self, name, period=None):
+        heartbeat = Heartbeat(name, period)
+        with self.lock:
+            self.beats = self.beats + (heartbeat,)
+        return heartbeat
+
+    """Stop watching a heartbeat.
+    """
+    def forget(self, heartbeat):
+        with self.lock:
+            self.beats = tuple(beat for beat in self.beats
+                               if beat is not heartbeat)
+
+    def stop(self):
+        self.running = False
+
+    """Record where a heartbeat's thread is right now.
+    """
+    def sample(self, heartbeat, stall):
+        frame = sys._current_frames().get(heartbeat.thread)
+        if frame is None:
+            return
+        code = frame.f_code
+        stall.samples['{0} ({1}:{2})'.format(
+            code.co_name, code.co_filename.rsplit('/', 1)[-1],
+            frame.f_lineno)] += 1
+        if not stall.stack:
+            lines = []
+            while frame is not None and len(lines) < 12:
+                lines.append('  {0}:{1} in {2}'.format(
+                    frame.f_code.co_filename, frame.f_lineno,
+                    frame.f_code.co_name))
+                frame = frame.f_back
+            stall.stack = '\n'.join(lines)
+
+    def report(self, stall):
+        if self.onStall is not None:
+            try:
+                self.onStall(stall)
+            except:
+                logging.warning("Couldn't report stall: " + stall.summary())
+
+    def run(self):
+        while self.running:
+            sleep(POLL_S)
+            now = perf_counter()
+            for heartbeat in self.beats:
+                overdue = heartbeat.overdue(now)
+                stall = self.ongoing.get(heartbeat)
+                if overdue > self.budget:
+                    if stall is None:
+                        stall = Stall(heartbeat.name, now)
+                        self.ongoing[heartbeat] = stall
+                        self.sample(heartbeat, stall)
+                        logging.warning(stall.summary() + ', stack:\n' +
+                                        stall.stack)
+                        self.report(stall)
+                    else:
+                        self.sample(heartbeat, stall)
+                elif stall is not None:
+                    del self.ongoing[heartbeat]
+                    stall.duration = now - stall.started + self.budget
+                    self.history.append(stall)
+                    logging.warning(stall.summary())
+                    self.report(stall)
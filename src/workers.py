@@ -0,0 +1,554 @@
+"""
+Routing workers for SwitchBox
+
+By default, every row routes its MIDI right inside the MIDI backend's
+callback. That's as quick as it gets when things are quiet, but all
+the rows end up fighting the Tk main loop (and each other) for the
+interpreter, so one busy keyboard can make everything else jittery.
+
+RoutingWorkers can instead hand each message off to a routing worker:
+
+'inline' -- Route in the backend's callback, like always.
+'thread' -- Each shard of rows gets its own routing thread. The backend
+    callback just drops the message in the row's queue and returns. On
+    a free-threaded Python, shards really do run side by side.
+'process' -- Each shard of rows gets its own process, which owns those
+    rows' output ports and does their routing. This gets shards onto
+    separate cores on a regular Python too, at the cost of passing every
+    message through a pipe.
+"""
+
+import sys
+import logging
+import threading
+import importlib
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import wait
+from time import perf_counter
+from routing import compileDispatch
+from outputs import OutputManager
+
+# How long an idle routing thread sleeps before checking again, even if
+# nobody wakes it up. Just a safety net, in seconds.
+IDLE_WAIT_S = 0.5
+
+# How many messages a routing thread takes from one row before moving on
+# to the next, so one flooding row can't starve the rest of its shard.
+BATCH_PER_ROW = 64
+
+"""A bounded single-producer, single-consumer queue.
+
+Only the row's MIDI callback puts things in, and only its routing
+thread takes things out, so no lock is needed: the producer only ever
+moves tail, and the consumer only ever moves head. When it's full, new
+messages are dropped and counted rather than blocking the callback.
+"""
+class SpscRing():
+    """Create an empty ring.
+
+    Arguments:
+    size -- Maximum number of queued messages
+    """
+    def __init__(self, size):
+        # One slot always stays empty, so full and empty look different
+        self.size = size + 1
+        self.slots = [None] * self.size
+        self.head = 0 # Next slot to read. Only the consumer moves this.
+        self.tail = 0 # Next slot to write. Only the producer moves this.
+        self.dropped = 0
+
+    """Add a message. Returns False (and drops it) if the ring is full.
+    """
+    def push(self, item):
+        tail = self.tail
+        following = tail + 1
+        if following == self.size:
+            following = 0
+        if following == self.head:
+            self.dropped += 1
+            return False
+        self.slots[tail] = item
+        self.tail = following
+        return True
+
+    """Take the oldest message out, or return None if there isn't one.
+    """
+    def pop(self):
+        head = self.head
+        if head == self.tail:
+            return None
+        item = self.slots[head]
+        self.slots[head] = None
+        head += 1
+        self.head = head if head != self.size else 0
+        return item
+
+    def __len__(self):
+        return (self.tail - self.head) % self.size
+
+
+"""A routing thread serving one shard of rows.
+"""
+class ThreadShard(threading.Thread):
+    def __init__(self, name):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        # (row, ring) pairs. Replaced, never edited, so the loop below
+        # can go through it without a lock.
+        self.members = ()
+        self.wake = threading.Event()
+        self.sleeping = False
+        self.running = True
+        # Drop counts we've already complained about, by row
+        self.reportedDrops = {}
+        # (function, args) to run on this thread (see call()). A deque
+        # can be added to from any thread.
+        self.calls = deque()
+
+    """Start serving a row. Returns the ring its messages go in.
+    """
+    def add(self, row, size):
+        ring = SpscRing(size)
+        self.members = self.members + ((row, ring),)
+        return ring
+
+    """Stop serving a row.
+    """
+    def remove(self, row):
+        self.members = tuple(member for member in self.members
+                             if member[0] is not row)
+        self.reportedDrops.pop(row, None)
+
+    """Run a function on this thread, ahead of any routing that's
+    waiting. Safe to call from any thread.
+    """
+    def call(self, function, *args):
+        self.calls.append((function, args))
+        if self.sleeping:
+            self.wake.set()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+
+    def run(self):
+        while self.running:
+            busy = False
+            while self.calls:
+                function, args = self.calls.popleft()
+                busy = True
+                try:
+                    function(*args)
+                except:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.warning(str(exc_tb.tb_lineno) + ':' +
+                                    exc_type.__name__ + ': ' +
+                                    str(exc_obj) +
+                                    ": Couldn't run call on routing thread")
+            for row, ring in self.members:
+                for count in range(BATCH_PER_ROW):
+                    item = ring.pop()
+                    if item is None:
+                        break
+                    busy = True
+                    try:
+                        row.route(item[0], item[1], item[2])
+                    except:
+                        exc_type, exc_obj, exc_tb = sys.exc_info()
+                        logging.warning(str(exc_tb.tb_lineno) + ':' +
+                                        exc_type.__name__ + ': ' +
+                                        str(exc_obj) +
+                                        ": Couldn't route message")
+                if ring.dropped != self.reportedDrops.get(row, 0):
+                    self.reportedDrops[row] = ring.dropped
+                    logging.warning('Routing queue full, ' +
+                                    str(ring.dropped) +
+                                    ' message(s) dropped so far')
+            if busy:
+                continue
+
+            # Nothing to do. Say we're going to sleep before looking one
+            # last time, so a message that shows up in between either
+            # gets seen here or wakes us up.
+            self.sleeping = True
+            if not self.calls and not any(len(ring) for row, ring
+                                          in self.members):
+                self.wake.wait(IDLE_WAIT_S)
+            self.wake.clear()
+            self.sleeping = False
+
+
+"""Stands in for a row inside a routing process.
+
+Has the same hooks as a RowElement, but instead of touching the UI it
+sends events back to the main process, which passes them on to the
+real row.
+"""
+class ProcessRow():
+    def __init__(self, slot, events):
+        self.slot = slot
+        self.events = events
+        self.activeChannel = 0
+        self.port = None
+        self.dispatch = None
+        # Quantized switches wait for their clock tick; nothing else
+        # runs on this process's routing thread (see quantize.py)
+        self.clock = None
+        # Messages that beat the first routing table here. Their pipe
+        # isn't the one the table comes down, so that can happen.
+        self.early = []
+
+    def onLearnReceived(self, routing, cc):
+        self.events.send(('learn', self.slot, cc))
+
+    def onTriggered(self):
+        self.events.send(('trigger', self.slot, self.activeChannel))
+
+    def onFaderMoved(self, channel):
+        self.events.send(('fader', self.slot, channel))
+
+    def onSceneRequested(self, index, scenes):
+        self.events.send(('scene', self.slot, index))
+
+    def onPanicRequested(self):
+        self.events.send(('panic', self.slot, None))
+
+"""Carry out one command sent to a routing process.
+
+Returns True when it's time for the process to stop.
+"""
+def runCommand(command, outputs, ports, rows, inboxes, events):
+    kind = command[0]
+    if kind == 'open':
+        portId, name = command[1:]
+        ports[portId] = outputs.port()
+        ports[portId].open_virtual_port(name)
+    elif kind == 'send':
+        portId, message = command[1:]
+        ports[portId].send_message(message)
+    elif kind == 'close':
+        port = ports.pop(command[1], None)
+        if port is not None and port.is_port_open():
+            port.close_port()
+    elif kind == 'attach':
+        slot, inbox = command[1:]
+        rows[slot] = ProcessRow(slot, events)
+        inboxes[inbox] = rows[slot]
+    elif kind == 'detach':
+        row = rows.pop(command[1], None)
+        for inbox in [inbox for inbox in inboxes
+                      if inboxes[inbox] is row]:
+            del inboxes[inbox]
+            inbox.close()
+    elif kind == 'publish':
+        slot, portId, routing, scenes = command[1:]
+        row = rows.get(slot)
+        if row is None:
+            return False
+        if routing.channel is not None:
+            row.activeChannel = routing.channel
+            # Whatever switch was waiting for the beat is overruled
+            if row.clock is not None:
+                row.clock.cancel()
+        row.port = ports[portId]
+        row.dispatch = compileDispatch(routing, row,
+                                       row.port.send_message,
+                                       scenes)
+        for message in row.early:
+            row.dispatch(message)
+        row.early = []
+    elif kind == 'stop':
+        return True
+    return False
+
+
+"""Main loop of a routing process.
+
+Arguments:
+control -- Connection carrying commands from the main process
+events -- Connection for sending events back to the main process
+backendName -- Module name of the MIDI backend (normally 'rtmidi')
+"""
+def processShardMain(control, events, backendName):
+    backend = importlib.import_module(backendName)
+    # The process's ports share clients, same as in the main process
+    outputs = OutputManager(backend)
+    ports = {}  # Port id -> output port
+    rows = {}   # Slot -> ProcessRow
+    inboxes = {} # Connection -> ProcessRow
+    while True:
+        for conn in wait([control] + list(inboxes)):
+            if conn is control:
+                try:
+                    command = control.recv()
+                except EOFError:
+                    return
+                try:
+                    if runCommand(command, outputs, ports, rows, inboxes,
+                                  events):
+                        return
+                except:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.warning(str(exc_tb.tb_lineno) + ':' +
+                                    exc_type.__name__ + ': ' +
+                                    str(exc_obj) +
+                                    ": Routing process couldn't " +
+                                    str(command[0]))
+            else:
+                row = inboxes.get(conn)
+                if row is None:
+                    # Detached since we started waiting
+                    continue
+                try:
+                    message = conn.recv_bytes()
+                except EOFError:
+                    del inboxes[conn]
+                    continue
+                # System messages (SysEx especially) go out as the 
+                # bytes they came in as. Channel messages get their
+                # status byte rewritten, so they need to be a list.
+                if message[0] < 0xF0:
+                    message = list(message)
+                if row.dispatch is None:
+                    row.early.append(message)
+                    continue
+                try:
+                    row.dispatch(message)
+                except:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    logging.warning(str(exc_tb.tb_lineno) + ':' +
+                                    exc_type.__name__ + ': ' +
+                                    str(exc_obj) +
+                                    ": Couldn't route message")
+
+
+"""An output port living in a routing process.
+
+Looks enough like an rtmidi.MidiOut for a RowElement to use it, but
+every call is passed along to the process that actually owns the port.
+"""
+class ProcessOutPort():
+    def __init__(self, shard, portId):
+        self.shard = shard
+        self.portId = portId
+        self.isOpen = False
+
+    def open_virtual_port(self, name):
+        self.shard.command(('open', self.portId, name))
+        self.isOpen = True
+
+    def send_message(self, message):
+        self.shard.command(('send', self.portId, list(message)))
+
+    def is_port_open(self):
+        return self.isOpen
+
+    def close_port(self):
+        self.shard.command(('close', self.portId))
+        self.isOpen = False
+
+
+"""A routing process serving one shard of rows, plus the thread that
+passes its events back to the rows.
+"""
+class ProcessShard():
+    def __init__(self, name, backendName):
+        context = multiprocessing.get_context('spawn')
+        self.control, childControl = context.Pipe(duplex=False)[::-1]
+        childEvents, self.events = context.Pipe(duplex=False)[::-1]
+        self.process = context.Process(target=processShardMain, name=name,
+                                       args=(childControl, childEvents,
+                                             backendName),
+                                       daemon=True)
+        self.process.start()
+        childControl.close()
+        childEvents.close()
+        # Several threads send commands (the UI, and the MIDI callbacks
+        # when they switch scenes), so they take turns.
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.listener = threading.Thread(target=self.listen, name=name,
+                                         daemon=True)
+        self.listener.start()
+
+    """Send a command to the routing process.
+    """
+    def command(self, command):
+        with self.lock:
+            self.control.send(command)
+
+    """Pass events from the routing process on to the rows they're for.
+    """
+    def listen(self):
+        while True:
+            try:
+                kind, slot, value = self.events.recv()
+            except (EOFError, OSError):
+                return
+            row = self.rows.get(slot)
+            if row is None:
+                continue
+            if kind == 'trigger':
+                row.activeChannel = value
+                row.onTriggered()
+            elif kind == 'fader':
+                row.onFaderMoved(value)
+            elif kind == 'learn':
+                row.onLearnReceived(row.routing, value)
+            elif kind == 'scene':
+                row.onSceneRequested(value, row.upper.scenes)
+            elif kind == 'panic':
+                row.onPanicRequested()
+
+    def stop(self):
+        try:
+            self.command(('stop',))
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+
+
+"""Decides where each row's MIDI gets routed, and sets up whatever that
+takes.
+"""
+class RoutingWorkers():
+    """Arguments:
+    mode -- 'inline', 'thread' or 'process' (see the top of this file)
+    shards -- How many routing threads/processes to spread rows over.
+        0 gives every row its own.
+    queueSize -- How many messages can wait in a row's queue
+    backend -- The MIDI backend module (normally rtmidi)
+    """
+    def __init__(self, mode, shards, queueSize, backend):
+        if mode not in ('inline', 'thread', 'process'):
+            logging.warning('Unknown routing mode ' + str(mode) +
+                            ', routing inline')
+            mode = 'inline'
+        self.mode = mode
+        self.shards = shards
+        self.queueSize = queueSize
+        self.backend = backend
+        # Where rows' output ports come from, unless they live in a
+        # routing process (see outputs.py)
+        self.outputs = OutputManager(backend)
+        self.workers = []  # ThreadShards or ProcessShards
+        self.assigned = {} # Row -> (worker, slot, ring or inbox)
+        self.nextSlot = 0
+        self.nextPort = 0
+
+    """Pick the worker for a new row, starting one if needed.
+    """
+    def workerFor(self, slot):
+        if self.shards <= 0 or len(self.workers) < self.shards:
+            name = 'SwitchBox routing ' + str(len(self.workers) + 1)
+            if self.mode == 'thread':
+                worker = ThreadShard(name)
+                worker.start()
+            else:
+                worker = ProcessShard(name, self.backend.__name__)
+            self.workers.append(worker)
+            return worker
+        return self.workers[slot % self.shards]
+
+    """Make an output port for a row.
+
+    In process mode, the port lives in the row's routing process, so the
+    row has to be attached first.
+    """
+    def outPort(self, row):
+        if self.mode != 'process':
+            return self.outputs.port()
+        worker, slot, inbox = self.assigned[row]
+        self.nextPort += 1
+        return ProcessOutPort(worker, self.nextPort)
+
+    """Start routing for a row.
+
+    Returns the function to hand to the row's input port as its
+    callback.
+    """
+    def attach(self, row):
+        if self.mode == 'inline':
+            return row.onReceived
+        if row in self.assigned:
+            self.detach(row)
+        slot = self.nextSlot
+        self.nextSlot += 1
+        worker = self.workerFor(slot)
+
+        if self.mode == 'thread':
+            ring = worker.add(row, self.queueSize)
+            self.assigned[row] = (worker, slot, ring)
+
+            def enqueue(event, data=None):
+                # Stamped here, so time spent waiting in the ring
+                # counts towards the row's latency.
+                if (ring.push((event[0], event[1], perf_counter())) and
+                        worker.sleeping):
+                    worker.wake.set()
+            return enqueue
+
+        inbox, outbox = multiprocessing.get_context('spawn').Pipe(
+            duplex=False)
+        worker.rows[slot] = row
+        worker.command(('attach', slot, inbox))
+        inbox.close()
+        self.assigned[row] = (worker, slot, outbox)
+
+        def forward(event, data=None):
+            outbox.send_bytes(bytes(event[0]))
+        return forward
+
+    """Get a function that runs a function on a row's routing thread,
+    for work that has to happen there but isn't set off by a message
+    (see quantize.py). Only routing threads can do that: inline, the
+    thread is the MIDI backend's, and in process mode it's in another
+    process. Those get None.
+
+    Arguments:
+    row -- The row, attached already
+    """
+    def caller(self, row):
+        if self.mode != 'thread' or row not in self.assigned:
+            return None
+        worker = self.assigned[row][0]
+        return worker.call
+
+    """Tell the routing worker about a row's new routing table.
+
+    Threads share the row's dispatch function, so only routing processes
+    need to hear about it.
+
+    Arguments:
+    row -- The RowElement whose routing changed
+    routing -- Its new RowRouting
+    scenes -- The SceneBook the row is watching
+    """
+    def publish(self, row, routing, scenes):
+        if self.mode != 'process' or row not in self.assigned:
+            return
+        worker, slot, outbox = self.assigned[row]
+        worker.command(('publish', slot, row.outport.portId, routing,
+                        scenes))
+
+    """Stop routing for a row (e.g. when it gets deleted).
+    """
+    def detach(self, row):
+        if row not in self.assigned:
+            return
+        worker, slot, queue = self.assigned.pop(row)
+        if self.mode == 'thread':
+            worker.remove(row)
+        else:
+            worker.command(('detach', slot))
+            worker.rows.pop(slot, None)
+            queue.close()
+
+    """Shut down all routing threads/processes.
+    """
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        self.outputs.stop()
+        self.assigned = {}